@@ -8,9 +8,11 @@ from dash.dependencies import Input, Output, State
 
 from flask import Flask
 
+from engine.app.api import SimulationAPI
 from engine.app.layout import Layout
+from engine.app.metrics import MetricsEndpoint
 from engine.app.controllers import CallbackController
-from engine.constants import TAB_COUNT, WEAPON_COUNT
+from engine.constants import TAB_COUNT, WEAPON_COUNT, METRICS_TOKEN
 
 external_stylesheets = [
   dbc.themes.COSMO,
@@ -39,6 +41,8 @@ app.layout = Layout(tab_count=TAB_COUNT, weapon_count=WEAPON_COUNT).layout()
 CallbackController(app, TAB_COUNT, WEAPON_COUNT).setup_callbacks()
 
 server = app.server
+SimulationAPI(server, TAB_COUNT, WEAPON_COUNT).register()
+MetricsEndpoint(server, token=METRICS_TOKEN).register()
 
 
 if __name__ == '__main__':
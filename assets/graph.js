@@ -0,0 +1,41 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  graph: {
+    // Builds the damage graph from the per tab trace stores. The last argument
+    // is the current figure, whose layout is kept as the template.
+    assembleFigure: function() {
+      var tabs = Array.prototype.slice.call(arguments, 0, -1);
+      var figure = arguments[arguments.length - 1];
+      if (!tabs.some(Boolean)) {
+        return window.dash_clientside.no_update;
+      }
+
+      var data = [];
+      var maxValue = 0;
+      var pointsEnabled = false;
+      tabs.forEach(function(tab) {
+        if (!tab) {
+          data.push({}, {}, {});
+          return;
+        }
+        tab.traces.forEach(function(trace) {
+          data.push(trace);
+          if (trace.x && trace.x.length > 1) {
+            maxValue = Math.max(maxValue, trace.x[trace.x.length - 1]);
+          }
+        });
+        pointsEnabled = pointsEnabled || tab.points;
+      });
+
+      maxValue = maxValue || 10;
+      var dtick = Math.min(Math.pow(10, Math.floor(Math.log10(maxValue))) / 2, 1);
+      var xaxis = Object.assign({}, figure.layout.xaxis, {
+        range: [0, maxValue],
+        dtick: pointsEnabled ? dtick : null,
+      });
+      return {
+        data: data,
+        layout: Object.assign({}, figure.layout, {xaxis: xaxis}),
+      };
+    },
+  },
+});
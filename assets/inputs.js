@@ -0,0 +1,36 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  inputs: {
+    // Target values of the clicked preset button, [toughness, save, invuln,
+    // fnp, wounds]. The last argument is the preset table, by button id
+    // without its tab suffix; the first preset applies before any click.
+    applyPreset: function() {
+      var presets = arguments[arguments.length - 1];
+      var context = window.dash_clientside.callback_context;
+      var triggered = (context && context.triggered) || [];
+      var presetIds = Object.keys(presets || {});
+      if (!presetIds.length) {
+        return window.dash_clientside.no_update;
+      }
+      if (!triggered.length || triggered[0].prop_id === '.') {
+        return presets[presetIds[0]];
+      }
+      var buttonId = triggered[0].prop_id.split('.')[0];
+      var presetId = buttonId.slice(0, buttonId.lastIndexOf('_'));
+      return presets.hasOwnProperty(presetId) ? presets[presetId] : window.dash_clientside.no_update;
+    },
+
+    // Labels of the profile and weapon tabs, marked by whether they are enabled
+    profileLabel: function(name, enabled) {
+      return tabLabel(name, enabled, 'Profile');
+    },
+
+    weaponLabel: function(name, enabled) {
+      return tabLabel(name, enabled, 'Weapon');
+    },
+  },
+});
+
+function tabLabel(name, enabled, fallback) {
+  var label = name && name.length > 2 ? name : fallback;
+  return (enabled === 'enabled' ? '▪️ ' : '▫️ ') + label;
+}
@@ -0,0 +1,286 @@
+"""Times the engine over target presets and weapon profiles.
+
+  python -m benchmarks.run --output benchmarks/results/latest.json
+  python -m benchmarks.run --compare benchmarks/results/baseline.json
+
+Every case reports min/median/mean/max seconds over --repeat runs. With
+--compare, cases whose median got slower than --threshold times the earlier
+run are listed and the exit status is 1.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from urllib.parse import urlencode
+
+import numpy as np
+
+from plotly.utils import PlotlyJSONEncoder
+
+from engine.app.batch import BatchEvaluator
+from engine.app.cache import LRUCache
+from engine.app.controllers.util import CallbackMap
+from engine.app.layout import GraphLayout
+from engine.app.permalink import PERMALINK_CODEC, PARAM
+from engine.app.pool import ComputePool
+from engine.app.shared_cache import SharedCache, engine_version
+from engine.app.util import ComputeController, TabAggregate, URLMinify
+from engine.constants import TARGET_PRESETS, TAB_COUNT, WEAPON_COUNT, TAB_COLOURS
+
+
+WEAPONS = {
+  'lasgun': {'ws': 4, 'strength': 3, 'ap': 0, 'shots': '1', 'damage': '1'},
+  'bolter': {'ws': 3, 'strength': 4, 'ap': 0, 'shots': '2', 'damage': '1'},
+  'heavy_bolter': {'ws': 3, 'strength': 5, 'ap': 1, 'shots': '3', 'damage': '1'},
+  'flamer': {'ws': 1, 'strength': 4, 'ap': 0, 'shots': 'd6', 'damage': '1'},
+  'plasma': {'ws': 3, 'strength': 8, 'ap': 3, 'shots': '2', 'damage': '2'},
+  'lascannon': {'ws': 3, 'strength': 9, 'ap': 3, 'shots': '1', 'damage': 'd6'},
+  'battle_cannon': {'ws': 4, 'strength': 8, 'ap': 2, 'shots': '2d6', 'damage': 'd6'},
+}
+
+# Modifiers are not applied by the engine yet (ModifierController.mod_dict is
+# empty), so these only fill the permalinks the url suite parses; timing
+# compute() with them would measure the unmodified weapon again
+MOD_STACKS = {
+  'none': {},
+  'rerolls': {'hitmods': ['reroll_ones'], 'woundmods': ['reroll_failed']},
+  'buffed': {'hitmods': ['add_1', 'reroll_all'], 'woundmods': ['add_1'], 'savemods': ['ignoreinv']},
+  'everything': {
+    'shotmods': ['addvol_d3'],
+    'hitmods': ['add_1', 'reroll_ones'],
+    'woundmods': ['reroll_failed'],
+    'savemods': ['savesub_1'],
+    'fnpmods': ['fnpsub_1'],
+    'damagemods': ['minval_3'],
+  },
+}
+
+# name -> (weapon, approximate), forced so each case times the engine it names
+STRESS = {
+  'exact_30d6': ({'ws': 3, 'strength': 4, 'ap': 1, 'shots': '30d6', 'damage': 'd3'}, False),
+  'exact_60d6': ({'ws': 3, 'strength': 4, 'ap': 1, 'shots': '60d6', 'damage': 'd3'}, False),
+  'approx_150d6': ({'ws': 3, 'strength': 4, 'ap': 1, 'shots': '150d6', 'damage': 'd6'}, True),
+  'wide_damage': ({'ws': 3, 'strength': 8, 'ap': 2, 'shots': '4d6', 'damage': '10d6'}, False),
+}
+
+TARGET_FIELDS = ['toughness', 'save', 'invuln', 'fnp', 'wounds']
+
+
+def target(values):
+  return dict(zip(TARGET_FIELDS, values))
+
+
+def cold_controller():
+  # No result cache, no shared cache and no pool: time the engine itself
+  return ComputeController(cache=LRUCache(max_entries=0), shared_cache=SharedCache(), pool=ComputePool(0))
+
+
+class Benchmark(object):
+  def __init__(self, repeat=3, quick=False, only=None):
+    self.repeat = repeat
+    self.quick = quick
+    self.only = only
+    self.results = []
+
+  def time(self, suite, case, func, repeat=None):
+    if self.only and self.only not in f'{suite}/{case}':
+      return
+    times = []
+    for _ in range(repeat or self.repeat):
+      start = time.perf_counter()
+      func()
+      times.append(time.perf_counter() - start)
+    self.results.append({
+      'suite': suite,
+      'case': case,
+      'repeat': len(times),
+      'min': min(times),
+      'median': statistics.median(times),
+      'mean': statistics.mean(times),
+      'max': max(times),
+    })
+    print(f'{suite:10} {case:50} {statistics.median(times) * 1000:10.3f} ms', file=sys.stderr)
+
+  def presets(self):
+    return TARGET_PRESETS[:3] if self.quick else TARGET_PRESETS
+
+  def weapons(self):
+    return list(WEAPONS.items())[:3] if self.quick else list(WEAPONS.items())
+
+  def run(self):
+    self.compute_suite()
+    self.aggregate_suite()
+    self.figure_suite()
+    self.url_suite()
+    self.stress_suite()
+    return self.results
+
+  def compute_suite(self):
+    for preset_id, _, values in self.presets():
+      for weapon_name, weapon in self.weapons():
+        inputs = {**target(values), **weapon}
+        self.time('compute', f'{preset_id}/{weapon_name}', lambda: cold_controller().compute(**inputs))
+    warm = ComputeController(cache=LRUCache(), shared_cache=SharedCache(), pool=ComputePool(0))
+    inputs = {**target(TARGET_PRESETS[0][2]), **WEAPONS['battle_cannon']}
+    warm.compute(**inputs)
+    self.time('compute', 'cache_hit', lambda: warm.compute(**inputs), repeat=max(self.repeat, 100))
+
+  def aggregate_suite(self):
+    weapons = [x for _, x in list(WEAPONS.items())[-WEAPON_COUNT:]]
+    for preset_id, _, values in self.presets():
+      warm = ComputeController(cache=LRUCache(), shared_cache=SharedCache(), pool=ComputePool(0))
+      results = [warm.compute(**target(values), **x) for x in weapons]
+
+      def aggregate():
+        summary = TabAggregate.from_results(cold_controller(), results)
+        for subplot in summary.subplots:
+          summary.plot_arrays(subplot)
+      self.time('aggregate', preset_id, aggregate)
+
+  def tab_traces(self):
+    controller = ComputeController(cache=LRUCache(), shared_cache=SharedCache(), pool=ComputePool(0))
+    traces = []
+    for tab_id in range(TAB_COUNT):
+      _, _, values = TARGET_PRESETS[tab_id % len(TARGET_PRESETS)]
+      results = [controller.compute(**target(values), **x) for x in list(WEAPONS.values())[:WEAPON_COUNT]]
+      summary = TabAggregate.from_results(controller, results)
+      for subplot in summary.subplots:
+        arrays = summary.plot_arrays(subplot)
+        traces.append({'x': arrays[0], 'y': arrays[1], 'line': {'color': TAB_COLOURS[tab_id]}} if arrays else {})
+    return traces
+
+  def figure_suite(self):
+    layout = GraphLayout(TAB_COUNT)
+    traces = self.tab_traces()
+    self.time('figure', 'template', lambda: layout.figure_template(traces, 30, dtick=1), repeat=max(self.repeat, 100))
+    self.time(
+      'figure',
+      'template_json',
+      lambda: json.dumps(layout.figure_template(traces, 30, dtick=1), cls=PlotlyJSONEncoder),
+      repeat=max(self.repeat, 100),
+    )
+
+  def permalink_query(self):
+    url_minify = URLMinify(TAB_COUNT, WEAPON_COUNT)
+    fields = {}
+    weapons = list(WEAPONS.values())
+    stacks = list(MOD_STACKS.values())
+    for tab_id in range(TAB_COUNT):
+      fields[f'enabled_{tab_id}'] = 'enabled'
+      fields[f'tabname_{tab_id}'] = f'Profile {tab_id}'
+      fields[f'points_{tab_id}'] = 1
+      for name, value in target(TARGET_PRESETS[tab_id % len(TARGET_PRESETS)][2]).items():
+        fields[f'{name}_{tab_id}'] = value
+      for weapon_id in range(WEAPON_COUNT):
+        fields[f'weaponenabled_{tab_id}_{weapon_id}'] = 'enabled'
+        weapon = {**weapons[weapon_id % len(weapons)], **stacks[weapon_id % len(stacks)]}
+        for name, value in weapon.items():
+          fields[f'{name}_{tab_id}_{weapon_id}'] = ','.join(value) if isinstance(value, list) else value
+    return urlencode({url_minify.minify(k): v for k, v in fields.items()})
+
+  def url_suite(self):
+    query = self.permalink_query()
+    url = f'http://localhost/static?{query}'
+    url_minify = URLMinify(TAB_COUNT, WEAPON_COUNT)
+
+    def parse():
+      callback = CallbackMap([url], [], ['url'], [])
+      callback.url_scenario.tabs()
+    self.time('url', 'parse_permalink', parse, repeat=max(self.repeat, 100))
+    self.time('url', 'normalize_query', lambda: url_minify.normalize_query(query), repeat=max(self.repeat, 100))
+
+    spec = PERMALINK_CODEC.decode_query(query)
+    binary_url = f'http://localhost/static?{PARAM}={PERMALINK_CODEC.encode(spec)}'
+
+    def parse_binary():
+      callback = CallbackMap([binary_url], [], ['url'], [])
+      callback.url_scenario.tabs()
+    self.time('url', 'encode_binary', lambda: PERMALINK_CODEC.encode(spec), repeat=max(self.repeat, 100))
+    self.time('url', 'parse_binary', parse_binary, repeat=max(self.repeat, 100))
+    print(f'permalink bytes: query {len(url)}, binary {len(binary_url)}', file=sys.stderr)
+
+  def stress_suite(self):
+    preset = target(TARGET_PRESETS[3][2])
+    for name, (weapon, approximate) in STRESS.items():
+      self.time(
+        'stress',
+        name,
+        lambda: cold_controller().compute(**preset, **weapon, approximate=approximate),
+        repeat=1,
+      )
+    self.time(
+      'stress',
+      'montecarlo_1m',
+      lambda: cold_controller().simulate(**preset, **WEAPONS['battle_cannon'], samples=10**6, seed=0),
+      repeat=1,
+    )
+    weapons = [dict(WEAPONS['bolter'], shots=str(i)) for i in range(1, 51)]
+    targets = [target(x) for _, _, x in TARGET_PRESETS]
+    self.time('stress', 'batch_50x12', lambda: BatchEvaluator(cold_controller()).evaluate(weapons, targets))
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def metadata():
+  return {
+    'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+    'revision': git_revision(),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'warhammer_stats': engine_version(),
+    'platform': platform.platform(),
+    'cpus': os.cpu_count(),
+  }
+
+
+def compare(results, baseline_path, threshold):
+  with open(baseline_path) as baseline_file:
+    baseline = {(x['suite'], x['case']): x for x in json.load(baseline_file)['results']}
+  regressions = []
+  for result in results:
+    before = baseline.get((result['suite'], result['case']))
+    if before and before['median'] > 0:
+      ratio = result['median'] / before['median']
+      if ratio > threshold:
+        regressions.append((result['suite'], result['case'], ratio))
+  for suite, case, ratio in regressions:
+    print(f'REGRESSION {suite}/{case}: {ratio:.2f}x slower', file=sys.stderr)
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--output', default='benchmarks/results/latest.json')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--quick', action='store_true', help='only the first few presets and weapons')
+  parser.add_argument('--only', help='only cases whose suite/case contains this')
+  parser.add_argument('--compare', help='earlier results to check for regressions')
+  parser.add_argument('--threshold', type=float, default=1.25)
+  args = parser.parse_args(argv)
+
+  results = Benchmark(repeat=args.repeat, quick=args.quick, only=args.only).run()
+  directory = os.path.dirname(args.output)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  with open(args.output, 'w') as output:
+    json.dump({'meta': metadata(), 'results': results}, output, indent=2)
+  print(f'Wrote {len(results)} results to {args.output}', file=sys.stderr)
+
+  if args.compare and compare(results, args.compare, args.threshold):
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
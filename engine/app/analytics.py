@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from urllib.parse import urlencode
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+  """Stops calling a failing sink until reset_timeout seconds have passed."""
+  def __init__(self, failure_threshold=5, reset_timeout=60):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+
+  @property
+  def is_open(self):
+    return self.opened_at is not None
+
+  def allow(self):
+    if self.opened_at is None:
+      return True
+    # Half open: let a single batch through to probe the sink
+    return time.time() - self.opened_at >= self.reset_timeout
+
+  def record_success(self):
+    self.failures = 0
+    self.opened_at = None
+
+  def record_failure(self):
+    self.failures += 1
+    if self.failures >= self.failure_threshold:
+      self.opened_at = time.time()
+
+
+class NullSink(object):
+  def send(self, events):
+    pass
+
+
+class FileSink(object):
+  """Appends events as JSON lines, for running without network access."""
+  def __init__(self, path):
+    self.path = path
+
+  def send(self, events):
+    with open(self.path, 'a') as output:
+      for event in events:
+        output.write(json.dumps(event) + '\n')
+
+
+class GoogleAnalyticsSink(object):
+  url = 'https://www.google-analytics.com/batch'
+
+  def __init__(self, timeout=2):
+    self.timeout = timeout
+    self.session = requests.Session()
+
+  def send(self, events):
+    payload = '\n'.join(urlencode(x) for x in events)
+    response = self.session.post(
+      self.url,
+      headers={ "user-agent": "client" },
+      data=payload,
+      timeout=self.timeout,
+    )
+    response.raise_for_status()
+
+
+def sink_from_name(name, path=None):
+  if name == 'ga':
+    return GoogleAnalyticsSink()
+  if name == 'file':
+    return FileSink(path)
+  return NullSink()
+
+
+class AnalyticsQueue(object):
+  """Buffers events and hands them to a sink from a background thread.
+
+  Callers never block: when the buffer is full new events are dropped.
+  """
+  def __init__(self, sink, max_size=1000, batch_size=20, flush_interval=5, breaker=None):
+    self.sink = sink
+    self.max_size = max_size
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.breaker = breaker or CircuitBreaker()
+
+    self.sent = 0
+    self.dropped = 0
+    self.failed = 0
+
+    self._queue = queue.Queue(maxsize=max_size)
+    self._lock = threading.Lock()
+    self._thread = None
+    self._pid = None
+
+  def put(self, event):
+    self._ensure_worker()
+    try:
+      self._queue.put_nowait(event)
+    except queue.Full:
+      self.dropped += 1
+
+  def flush(self):
+    batch = []
+    while len(batch) < self.batch_size:
+      try:
+        batch.append(self._queue.get_nowait())
+      except queue.Empty:
+        break
+    if batch:
+      self._send(batch)
+    return len(batch)
+
+  def stats(self):
+    return {
+      'queued': self._queue.qsize(),
+      'sent': self.sent,
+      'dropped': self.dropped,
+      'failed': self.failed,
+      'breaker_open': self.breaker.is_open,
+    }
+
+  def _send(self, batch):
+    if not self.breaker.allow():
+      self.dropped += len(batch)
+      return
+    try:
+      self.sink.send(batch)
+    except Exception as error:
+      self.failed += len(batch)
+      self.breaker.record_failure()
+      logger.warning('Analytics flush failed: %s', error)
+    else:
+      self.sent += len(batch)
+      self.breaker.record_success()
+
+  def _ensure_worker(self):
+    # Threads do not survive a fork, so each gunicorn worker starts its own
+    if self._pid == os.getpid() and self._thread is not None:
+      return
+    with self._lock:
+      if self._pid != os.getpid() or self._thread is None:
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._thread = threading.Thread(target=self._run, name='analytics', daemon=True)
+        self._pid = os.getpid()
+        self._thread.start()
+
+  def _run(self):
+    while True:
+      batch = []
+      deadline = time.time() + self.flush_interval
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(self._queue.get(timeout=max(deadline - time.time(), 0.01)))
+        except queue.Empty:
+          break
+      if batch:
+        self._send(batch)
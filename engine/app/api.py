@@ -0,0 +1,356 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse
+
+from flask import Response, request, jsonify, stream_with_context
+
+from .cache import canonical_key
+from .complexity import ComplexityError
+from .permalink import PERMALINK_CODEC
+from .scenario import ScenarioSpec, field_index
+from .tables import INPUT_RANGES
+from .util import ComputeController, TabAggregate
+from ..constants import TAB_COUNT, WEAPON_COUNT, BATCH_MAX_SCENARIOS, BATCH_WORKERS, MONTE_CARLO_MAX_SAMPLES
+
+
+# Same dice as the shots and damage inputs accept: 3, d6 or 2d6
+DICE_PATTERN = re.compile(r'^(?:(\d+)?d)?(\d+)$')
+
+
+class APIError(Exception):
+  status_code = 400
+
+
+class Simulator(object):
+  """Runs scenarios given as flat input fields, the way the graph and permalinks name them."""
+  def __init__(self, tab_count=TAB_COUNT, weapon_count=WEAPON_COUNT, compute_controller=None):
+    self.tab_count = tab_count
+    self.weapon_count = weapon_count
+    self.field_index = field_index(self.tab_count, self.weapon_count)
+    self.compute_controller = compute_controller or ComputeController()
+
+  def scenario_fields(self, scenario):
+    """Fields of a scenario given as a permalink query or as {"fields": ..., "query": ...}."""
+    if isinstance(scenario, str):
+      scenario = {'query': scenario}
+    if not isinstance(scenario, dict):
+      raise APIError('Expected a JSON object or a permalink query')
+    if 'fields' not in scenario and 'query' not in scenario:
+      return dict(scenario)
+    fields = dict(scenario.get('fields') or {})
+    if scenario.get('query'):
+      query = urlparse(scenario['query']).query or scenario['query']
+      spec = PERMALINK_CODEC.decode_query(query, self.field_index)
+      fields.update(spec.global_fields)
+      fields.update(spec.items())
+    return fields
+
+  def parse_fields(self, fields):
+    """Split flat field names into (tabs, globals), tabs holding their weapons."""
+    spec = ScenarioSpec.from_fields(self.field_index, fields, split_mods=True)
+    tabs = spec.tabs()
+    for tab in tabs.values():
+      tab.setdefault('weapons', {})
+    return tabs, spec.global_fields
+
+  def simulate(self, fields, include_pmfs=True, **options):
+    tabs, global_fields = self.parse_fields(fields)
+    if not tabs:
+      raise APIError('No tab fields given')
+    return {
+      'title': global_fields.get('title'),
+      'tabs': [self.simulate_tab(i, tabs[i], include_pmfs, **options) for i in sorted(tabs)],
+    }
+
+  def simulate_tab(self, tab_id, tab_inputs, include_pmfs=True, **options):
+    points = max(self._integer(tab_inputs.get('points') or 1, f'points for tab {tab_id}'), 1)
+    enabled = self._enabled(tab_inputs.get('enabled'))
+    enabled_weapons = []
+    for weapon_id in sorted(tab_inputs['weapons']):
+      weapon_inputs = tab_inputs['weapons'][weapon_id]
+      if enabled and self._enabled(weapon_inputs.get('weaponenabled')):
+        enabled_weapons.append((weapon_id, weapon_inputs))
+        self.validate_inputs(tab_id, weapon_id, {**tab_inputs, **weapon_inputs})
+
+    weapons = []
+    tab_results = []
+    for weapon_id, weapon_inputs in enabled_weapons:
+      results = self._compute(tab_id, weapon_id, {**tab_inputs, **weapon_inputs}, **options)
+      tab_results.append(results)
+      weapon_output = {
+        'weapon': weapon_id,
+        'name': weapon_inputs.get('weaponname'),
+        'mean': results.total_wounds_dist.mean(),
+        'std': results.total_wounds_dist.std(),
+        'approximate': results.approximate,
+      }
+      if results.monte_carlo is not None:
+        weapon_output.update({
+          'mean_interval': list(results.monte_carlo.mean_interval),
+          'samples': results.monte_carlo.samples,
+          'seed': results.monte_carlo.seed,
+        })
+      weapons.append(weapon_output)
+
+    summary = TabAggregate.from_results(self.compute_controller, tab_results, points=points)
+    output = {
+      'tab': tab_id,
+      'name': tab_inputs.get('tabname'),
+      'enabled': enabled,
+      'points': points,
+      'mean': summary.mean,
+      'std': summary.std,
+      'approximate': summary.approximate,
+      'weapons': weapons,
+      'cumulative': {x: self._curve(summary, x, points) for x in summary.subplots},
+    }
+    if include_pmfs:
+      output['pmfs'] = {
+        x: list(getattr(summary.results, attr).values) for x, attr in summary.subplots.items()
+      }
+    return output
+
+  def validate_inputs(self, tab_id, weapon_id, inputs):
+    """Raise APIError for anything outside what the graph inputs offer, before it reaches an engine."""
+    where = f'tab {tab_id} weapon {weapon_id}'
+    for name, (low, high) in INPUT_RANGES.items():
+      if inputs.get(name) in (None, ''):
+        continue
+      value = self._integer(inputs[name], f'{name} for {where}')
+      if high is None and value < low:
+        raise APIError(f'{name} must be at least {low} for {where}')
+      if high is not None and not low <= value <= high:
+        raise APIError(f'{name} must be between {low} and {high} for {where}')
+    for name in ('shots', 'damage'):
+      if inputs.get(name) in (None, ''):
+        continue
+      match = DICE_PATTERN.match(str(inputs[name]).strip().lower())
+      if match is None or ('d' in match.group(0) and int(match.group(2)) < 1):
+        raise APIError(f'Invalid {name} for {where}')
+
+  def simulate_many(self, scenarios, include_pmfs=False, workers=None, **options):
+    """Yield {"index", "result"} or {"index", "error"} for each scenario as it finishes.
+
+    Identical scenarios are only run once, and with more than one worker the
+    distinct ones are spread over a process pool.
+    """
+    workers = BATCH_WORKERS if workers is None else workers
+    pending = {}
+    for index, scenario in enumerate(scenarios):
+      try:
+        fields = self.scenario_fields(scenario)
+      except APIError as error:
+        yield {'index': index, 'error': str(error)}
+        continue
+      key = canonical_key(fields)
+      pending.setdefault(key, (fields, []))[1].append(index)
+
+    if workers <= 1 or len(pending) <= 1:
+      for fields, indexes in pending.values():
+        yield from self._items(indexes, _run_scenario(self, fields, include_pmfs, options))
+      return
+
+    futures = self._submit(workers, pending.values(), include_pmfs, options)
+    try:
+      for future in as_completed(futures):
+        try:
+          outcome = future.result()
+        except Exception as error:
+          # A worker died (killed for memory, say), every scenario it took
+          # down still gets its line and the next batch gets a new pool
+          if isinstance(error, BrokenProcessPool):
+            reset_batch_pool()
+          outcome = 'error', f'Simulation failed: {type(error).__name__}'
+        yield from self._items(futures[future], outcome)
+    finally:
+      # The client went away, do not keep the pool busy on its behalf
+      for future in futures:
+        future.cancel()
+
+  def _submit(self, workers, pending, include_pmfs, options):
+    pending = list(pending)
+    try:
+      pool = batch_pool(workers)
+      return {pool.submit(_simulate_worker, fields, include_pmfs, options): indexes for fields, indexes in pending}
+    except BrokenProcessPool:
+      # Broken by an earlier batch whose client left before it noticed
+      reset_batch_pool()
+      pool = batch_pool(workers)
+      return {pool.submit(_simulate_worker, fields, include_pmfs, options): indexes for fields, indexes in pending}
+
+  def _items(self, indexes, outcome):
+    status, value = outcome
+    key = 'result' if status == 'ok' else 'error'
+    for index in indexes:
+      yield {'index': index, key: value}
+
+  def _compute(self, tab_id, weapon_id, inputs, engine='exact', approximate=None, samples=None, seed=None):
+    try:
+      if engine == 'montecarlo':
+        return self.compute_controller.simulate(samples=samples, seed=seed, **inputs)
+      return self.compute_controller.compute(approximate=approximate, **inputs)
+    except ComplexityError as error:
+      raise APIError(f'{error} in tab {tab_id} weapon {weapon_id}')
+    except (ValueError, TypeError, AttributeError):
+      raise APIError(f'Invalid inputs for tab {tab_id} weapon {weapon_id}')
+
+  def _curve(self, summary, subplot, points):
+    values = summary.curve(subplot)
+    return {
+      'x': (np.arange(len(values)) / points).tolist(),
+      'y': values.tolist(),
+    }
+
+  def _integer(self, value, name):
+    try:
+      return int(value)
+    except (TypeError, ValueError, OverflowError):
+      raise APIError(f'Invalid {name}')
+
+  def _enabled(self, value):
+    return value in (None, 'enabled')
+
+
+def _run_scenario(simulator, fields, include_pmfs, options):
+  try:
+    return 'ok', simulator.simulate(fields, include_pmfs=include_pmfs, **options)
+  except APIError as error:
+    return 'error', str(error)
+  except Exception as error:
+    return 'error', f'Simulation failed: {error}'
+
+
+_WORKER_SIMULATOR = None
+
+
+def _simulate_worker(fields, include_pmfs, options):
+  # Each worker keeps its own simulator, and with it a warm result cache
+  global _WORKER_SIMULATOR
+  if _WORKER_SIMULATOR is None:
+    _WORKER_SIMULATOR = Simulator()
+  return _run_scenario(_WORKER_SIMULATOR, fields, include_pmfs, options)
+
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def batch_pool(workers):
+  """Process pool shared by every batch request of this worker process."""
+  global _POOL, _POOL_PID
+  with _POOL_LOCK:
+    if _POOL is None or _POOL_PID != os.getpid():
+      _POOL = ProcessPoolExecutor(max_workers=workers)
+      _POOL_PID = os.getpid()
+    return _POOL
+
+
+def reset_batch_pool():
+  """Drop the pool after one of its workers died, the next batch starts a new one."""
+  global _POOL
+  with _POOL_LOCK:
+    pool, _POOL = _POOL, None
+  if pool is not None:
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def simulate_many(scenarios, include_pmfs=False, workers=None, **options):
+  return Simulator().simulate_many(scenarios, include_pmfs=include_pmfs, workers=workers, **options)
+
+
+class SimulationAPI(object):
+  """Plain JSON access to the engine, without the Dash layout or callbacks.
+
+  Accepts the same field names as the graph inputs (full or minified), either
+  as a JSON object, a permalink query under "query" or a GET query string.
+  """
+  def __init__(self, server, tab_count, weapon_count, compute_controller=None):
+    self.server = server
+    self.simulator = Simulator(tab_count, weapon_count, compute_controller)
+
+  def register(self):
+    self.server.add_url_rule(
+      '/api/v1/simulate',
+      'api_simulate',
+      self.simulate_view,
+      methods=['GET', 'POST'],
+    )
+    self.server.add_url_rule(
+      '/api/v1/simulate/batch',
+      'api_simulate_batch',
+      self.simulate_batch_view,
+      methods=['POST'],
+    )
+
+  def simulate_view(self):
+    try:
+      fields = self.request_fields()
+      return jsonify(self.simulator.simulate(
+        fields,
+        include_pmfs=self._flag('pmfs', True),
+        **self.engine_options(),
+      ))
+    except APIError as error:
+      return jsonify({'error': str(error)}), error.status_code
+
+  def simulate_batch_view(self):
+    body = request.get_json(silent=True)
+    scenarios = body.get('scenarios') if isinstance(body, dict) else None
+    if not isinstance(scenarios, list):
+      return jsonify({'error': 'Expected a JSON object with a list of scenarios'}), 400
+    if len(scenarios) > BATCH_MAX_SCENARIOS:
+      return jsonify({'error': f'At most {BATCH_MAX_SCENARIOS} scenarios per batch'}), 400
+
+    try:
+      options = self.engine_options()
+    except APIError as error:
+      return jsonify({'error': str(error)}), error.status_code
+    items = self.simulator.simulate_many(
+      scenarios,
+      include_pmfs=self._flag('pmfs', False),
+      **options,
+    )
+    lines = (json.dumps(x) + '\n' for x in items)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+  def request_fields(self):
+    if request.method == 'GET':
+      # Plain field=value pairs or a permalink token, like the graph's own links
+      return self.simulator.scenario_fields(request.query_string.decode('utf-8', 'replace'))
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      raise APIError('Expected a JSON object')
+    return self.simulator.scenario_fields(body)
+
+  def engine_options(self):
+    """?engine=exact|montecarlo, ?approximate=auto|1|0 and, for Monte Carlo, ?samples and ?seed."""
+    engine = request.args.get('engine', 'exact')
+    if engine not in ('exact', 'montecarlo'):
+      raise APIError(f'Unknown engine {engine}')
+    try:
+      samples = int(request.args['samples']) if 'samples' in request.args else None
+      seed = int(request.args['seed']) if 'seed' in request.args else None
+    except ValueError:
+      raise APIError('samples and seed must be integers')
+    if samples is not None and not 0 < samples <= MONTE_CARLO_MAX_SAMPLES:
+      raise APIError(f'samples must be between 1 and {MONTE_CARLO_MAX_SAMPLES}')
+    return {
+      'engine': engine,
+      'approximate': self._flag('approximate', None),
+      'samples': samples,
+      'seed': seed,
+    }
+
+  def _flag(self, name, default):
+    value = request.args.get(name)
+    if value is None or value.lower() == 'auto':
+      return default
+    return value.lower() not in ('0', 'false', 'no')
@@ -0,0 +1,74 @@
+import numpy as np
+
+from scipy.stats import binom, norm
+
+from warhammer_stats.pmf import PMF
+
+from . import convolve
+
+
+class NormalApproximation(object):
+  """Moment matched normal for the total damage of an unmodified attack.
+
+  Shots are thinned by the hit, wound and save probabilities, so the number of
+  unsaved wounds has closed form moments, and each wound draws an independent
+  damage roll (after feel no pain, capped at the target's wounds). The total is
+  a compound sum, which the normal matches on mean and variance and which is
+  discretised with a continuity correction.
+  """
+  def __init__(self, compute_controller, tail_sigmas=8):
+    self.compute_controller = compute_controller
+    self.tail_sigmas = tail_sigmas
+
+  def moments(self, inputs):
+    stages = self.compute_controller.stage_probabilities(inputs)
+    success = stages['hit'] * stages['wound'] * stages['unsaved']
+    shots = self._dice(inputs['shots'])
+    item = self.damage_item(inputs, stages['fnp'])
+
+    shots_mean, shots_var = self._moments(shots)
+    item_mean, item_var = self._moments(item)
+    count_mean = success * shots_mean
+    count_var = shots_mean * success * (1 - success) + success**2 * shots_var
+    mean = count_mean * item_mean
+    var = count_mean * item_var + count_var * item_mean**2
+    upper = (len(shots) - 1) * (len(item) - 1)
+    return mean, max(var, 0.0), upper
+
+  def damage_item(self, inputs, fnp_pass):
+    """Damage of a single unsaved wound."""
+    damage = self._dice(inputs['damage'])
+    support = np.arange(len(damage))
+    thinning = binom.pmf(support[None, :], support[:, None], fnp_pass)
+    after_fnp = damage @ thinning
+    cap = max(int(inputs['wounds']), 1)
+    if len(after_fnp) <= cap + 1:
+      return after_fnp
+    item = after_fnp[:cap + 1].copy()
+    item[cap] += after_fnp[cap + 1:].sum()
+    return item
+
+  def pmf(self, mean, var, upper):
+    if var <= 1e-12 or upper <= 0:
+      return PMF.static(int(round(min(max(mean, 0), upper))))
+    std = var ** 0.5
+    top = int(min(upper, np.ceil(mean + self.tail_sigmas * std)))
+    cdf = norm.cdf(np.arange(top + 1) + 0.5, mean, std)
+    values = np.diff(cdf, prepend=0.0)
+    # Everything past the last point belongs to it, the total never exceeds upper
+    values[-1] += 1 - cdf[-1]
+    return PMF(values.tolist())
+
+  def run(self, inputs):
+    mean, var, upper = self.moments(inputs)
+    zero = PMF.static(0)
+    return [self.pmf(mean, var, upper), zero, zero]
+
+  def _dice(self, value):
+    dists = self.compute_controller.parse_rsn(value).pmfs
+    return convolve.convolve_arrays([x.values for x in dists])
+
+  def _moments(self, values):
+    support = np.arange(len(values))
+    mean = float(values @ support)
+    return mean, float(values @ support**2) - mean**2
@@ -0,0 +1,154 @@
+import numpy as np
+
+from scipy import fft as sp_fft
+from scipy.stats import binom
+
+from warhammer_stats.pmf import PMF
+
+from . import convolve, tables
+from .util import ComputeController, ComputeResults
+
+
+WEAPON_FIELDS = ['ws', 'strength', 'ap', 'shots', 'damage', 'shotmods', 'hitmods', 'woundmods', 'savemods', 'fnpmods', 'damagemods']
+TARGET_FIELDS = ['toughness', 'save', 'invuln', 'fnp', 'wounds']
+
+
+def pad_stack(arrays):
+  """Stack 1d arrays of different lengths into a zero padded 2d array."""
+  width = max(len(x) for x in arrays)
+  stacked = np.zeros((len(arrays), width))
+  for i, x in enumerate(arrays):
+    stacked[i, :len(x)] = x
+  return stacked
+
+
+class BatchResults(object):
+  def __init__(self, mean, std, pmfs=None, fallbacks=None):
+    self.mean = mean
+    self.std = std
+    self.pmfs = pmfs
+    self.fallbacks = fallbacks or {}
+
+  @property
+  def shape(self):
+    return self.mean.shape
+
+  def pmf(self, weapon_index, target_index):
+    values = self.pmfs[weapon_index, target_index]
+    body = np.nonzero(values)[0]
+    return PMF(values[:body[-1] + 1 if len(body) else 1].tolist())
+
+  def results(self, weapon_index, target_index):
+    fallback = self.fallbacks.get((weapon_index, target_index))
+    if fallback is not None:
+      return fallback
+    zero = PMF.static(0)
+    return ComputeResults(self.pmf(weapon_index, target_index), zero, zero)
+
+
+class BatchEvaluator(object):
+  """Evaluates N weapon profiles against M targets as NumPy arrays.
+
+  Without modifiers every stage of the attack is an independent binomial
+  thinning of the dice that survived the previous one, so the whole sequence
+  collapses to a probability generating function:
+
+    G_total(w) = G_shots(1 - p + p * G_damage(w))
+
+  with p = P(hit) * P(wound) * P(failed save) and G_damage the per wound damage
+  after feel no pain, capped at the target's wounds. Pairs that carry
+  modifiers or fall outside the tables are handed to ComputeController instead.
+  """
+  def __init__(self, compute_controller=None):
+    self.compute_controller = compute_controller or ComputeController()
+
+  def evaluate(self, weapons, targets, moments_only=False):
+    weapon_inputs = [self._parse(x, WEAPON_FIELDS) for x in weapons]
+    target_inputs = [self._parse(x, TARGET_FIELDS) for x in targets]
+    for weapon in weapon_inputs:
+      self.compute_controller.estimator.check(weapon, batched=True)
+
+    ws = np.array([x['ws'] for x in weapon_inputs])
+    strength = np.array([x['strength'] for x in weapon_inputs])[:, None]
+    toughness = np.array([x['toughness'] for x in target_inputs])[None, :]
+    ap = np.array([x['ap'] for x in weapon_inputs])[:, None]
+    save = np.array([x['save'] for x in target_inputs])[None, :]
+    invuln = np.array([x['invuln'] for x in target_inputs])[None, :]
+    fnp = np.array([x['fnp'] for x in target_inputs])
+    wounds = np.array([x['wounds'] for x in target_inputs])
+
+    success = tables.hit_probability(ws)[:, None] * tables.wound_probability(strength, toughness)
+    success = success * tables.unsaved_probability(save, ap, invuln)
+
+    shots = pad_stack([self._dice_values(x['shots']) for x in weapon_inputs])
+    damage = pad_stack([self._dice_values(x['damage']) for x in weapon_inputs])
+    item = self.damage_item(damage, tables.fnp_probability(fnp), wounds)
+
+    mean, std = self.moments(shots, success, item)
+    pmfs = None if moments_only else self.distributions(shots, success, item)
+
+    fallbacks = {}
+    for i, weapon in enumerate(weapon_inputs):
+      for j, target in enumerate(target_inputs):
+        if self.compute_controller.batched({**weapon, **target}):
+          continue
+        results = self.compute_controller.compute(**weapon, **target)
+        fallbacks[(i, j)] = results
+        mean[i, j] = results.total_wounds_dist.mean()
+        std[i, j] = results.total_wounds_dist.std()
+        if pmfs is not None:
+          values = np.asarray(results.total_wounds_dist.values)
+          if len(values) > pmfs.shape[-1]:
+            pmfs = np.pad(pmfs, [(0, 0), (0, 0), (0, len(values) - pmfs.shape[-1])])
+          pmfs[i, j] = 0
+          pmfs[i, j, :len(values)] = values
+    return BatchResults(mean, std, pmfs, fallbacks)
+
+  def damage_item(self, damage, fnp_pass, wounds):
+    """Per wound damage distribution, shape (N, M, cap + 1)."""
+    max_damage = damage.shape[1] - 1
+    cap = int(min(max_damage, wounds.max()))
+    # Each point of damage independently survives the FNP roll
+    support = np.arange(max_damage + 1)
+    thinning = binom.pmf(support[None, None, :], support[None, :, None], fnp_pass[:, None, None])
+    after_fnp = np.einsum('nd,mdk->nmk', damage, thinning)
+    item = np.zeros(after_fnp.shape[:2] + (cap + 1,))
+    for j, target_wounds in enumerate(wounds):
+      limit = int(min(target_wounds, max_damage))
+      item[:, j, :limit] = after_fnp[:, j, :limit]
+      item[:, j, limit] = after_fnp[:, j, limit:].sum(axis=-1)
+    return item
+
+  def moments(self, shots, success, item):
+    support = np.arange(shots.shape[1])
+    shots_mean = shots @ support
+    shots_var = shots @ support**2 - shots_mean**2
+    damage_support = np.arange(item.shape[-1])
+    damage_mean = item @ damage_support
+    damage_var = item @ damage_support**2 - damage_mean**2
+
+    count_mean = success * shots_mean[:, None]
+    count_var = shots_mean[:, None] * success * (1 - success) + success**2 * shots_var[:, None]
+    mean = count_mean * damage_mean
+    var = count_mean * damage_var + count_var * damage_mean**2
+    return mean, np.sqrt(np.maximum(var, 0))
+
+  def distributions(self, shots, success, item):
+    max_shots = shots.shape[1] - 1
+    length = max_shots * (item.shape[-1] - 1) + 1
+    size = sp_fft.next_fast_len(length, real=True)
+    spectrum = sp_fft.rfft(item, size, axis=-1)
+    inner = (1 - success)[..., None] + success[..., None] * spectrum
+    total = np.broadcast_to(shots[:, -1, None, None], inner.shape).astype(complex)
+    for column in range(max_shots - 1, -1, -1):
+      total = total * inner + shots[:, column, None, None]
+    values = sp_fft.irfft(total, size, axis=-1)[..., :length]
+    return np.where(values < convolve.ROUND_OFF, 0.0, values)
+
+  def _parse(self, fields, names):
+    parsed = self.compute_controller.parse_inputs(**fields)
+    return {k: parsed[k] for k in names}
+
+  def _dice_values(self, value):
+    dists = self.compute_controller.parse_rsn(value).pmfs
+    return convolve.convolve_arrays([x.values for x in dists])
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+
+
+def canonical_key(*parts):
+  """Hash a JSON-able structure into a stable, order-independent cache key."""
+  payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+  return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+  def __init__(self, max_entries=256, max_bytes=None, sizeof=None):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self._sizeof = sizeof or (lambda value: 0)
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+    self.current_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, default=None):
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key][0]
+      self.misses += 1
+      return default
+
+  def peek(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      return entry[0] if entry else default
+
+  def set(self, key, value):
+    size = self._sizeof(value)
+    if self.max_bytes is not None and size > self.max_bytes:
+      return
+    with self._lock:
+      if key in self._entries:
+        self.current_bytes -= self._entries.pop(key)[1]
+      self._entries[key] = (value, size)
+      self.current_bytes += size
+      self._evict()
+
+  def get_or_compute(self, key, func):
+    sentinel = object()
+    value = self.get(key, sentinel)
+    if value is sentinel:
+      value = func()
+      self.set(key, value)
+    return value
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.current_bytes = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'entries': len(self._entries),
+      'bytes': self.current_bytes,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'hit_rate': self.hits / lookups if lookups else 0.0,
+    }
+
+  def _evict(self):
+    while self._entries and (self._over_entries() or self._over_bytes()):
+      _, (_, size) = self._entries.popitem(last=False)
+      self.current_bytes -= size
+      self.evictions += 1
+
+  def _over_entries(self):
+    return self.max_entries is not None and len(self._entries) > self.max_entries
+
+  def _over_bytes(self):
+    return self.max_bytes is not None and self.current_bytes > self.max_bytes
@@ -0,0 +1,93 @@
+import re
+
+
+# Rough rate the exact engine gets through the cost units below on one core
+COST_PER_SECOND = 2 * 10**7
+# Rough rate the batch evaluator gets through its own units, possible shots
+# times the length of the damage distribution, on one core
+BATCH_COST_PER_SECOND = 6 * 10**7
+# Rough rate Monte Carlo sampling rolls dice on one core
+ROLLS_PER_SECOND = 10**8
+
+
+class ComplexityError(ValueError):
+  """Raised for inputs that would take too long to compute."""
+
+
+def dice_bounds(value):
+  """(number of dice, largest possible total) of a dice string like '2d6' or '3'."""
+  value = str(value or 1).strip().lower()
+  if value.isdigit():
+    return 0, int(value)
+  match = re.match(r'(?P<number>\d+)?d(?P<faces>\d+)', value)
+  if not match:
+    return 0, 1
+  number = int(match.group('number') or 1)
+  return number, number * int(match.group('faces'))
+
+
+class Estimate(object):
+  def __init__(self, dice, shots, support, cost):
+    self.dice = dice
+    self.shots = shots
+    self.support = support
+    self.cost = cost
+
+  @property
+  def seconds(self):
+    return self.cost / COST_PER_SECOND
+
+
+class ComplexityEstimator(object):
+  """Bounds the work a single weapon may ask for before anything is computed.
+
+  The exact engine's attack phases scale with the cube of the number of
+  possible shots and its damage step with shots times the length of the
+  damage distribution. The batch evaluator, which computes unmodified weapons,
+  only does the latter. Costs are in the exact engine's units either way, and
+  checked along with the raw dice count.
+  """
+  def __init__(self, max_dice=200, max_support=50000, max_cost=5 * 10**7):
+    self.max_dice = max_dice
+    self.max_support = max_support
+    self.max_cost = max_cost
+
+  def estimate(self, inputs, batched=False):
+    shot_dice, shots = dice_bounds(inputs.get('shots'))
+    damage_dice, damage = dice_bounds(inputs.get('damage'))
+    support = shots * damage + 1
+    if batched:
+      # One spectrum sized multiply per possible shot
+      cost = (shots + 1) * support * COST_PER_SECOND / BATCH_COST_PER_SECOND
+    else:
+      cost = (shots + 1)**3 + (shots + 1) * support
+    return Estimate(shot_dice + damage_dice, shots, support, cost)
+
+  def check(self, inputs, check_cost=True, batched=False):
+    estimate = self.estimate(inputs, batched)
+    if estimate.dice > self.max_dice:
+      raise ComplexityError('Too complex: too many dice')
+    if estimate.support > self.max_support:
+      raise ComplexityError('Too complex: damage range too wide')
+    if check_cost and estimate.cost > self.max_cost:
+      raise ComplexityError('Too complex: too many shots')
+    return estimate
+
+  def sample_rolls(self, inputs):
+    """Dice rolled to sample one attack: the shots, then hit, wound, save, FNP and damage per shot."""
+    shot_dice, shots = dice_bounds(inputs.get('shots'))
+    damage_dice, _ = dice_bounds(inputs.get('damage'))
+    return shot_dice + shots * (4 + damage_dice)
+
+  def sample_cost(self, inputs, samples):
+    """Cost of sampling, in the units of estimate().cost."""
+    return samples * self.sample_rolls(inputs) * COST_PER_SECOND / ROLLS_PER_SECOND
+
+  def max_samples(self, inputs):
+    return int(self.max_cost * ROLLS_PER_SECOND / COST_PER_SECOND / max(self.sample_rolls(inputs), 1))
+
+  def check_samples(self, inputs, samples):
+    estimate = self.check(inputs, check_cost=False)
+    if self.sample_cost(inputs, samples) > self.max_cost:
+      raise ComplexityError(f'Too complex: at most {self.max_samples(inputs)} samples for this weapon')
+    return estimate
@@ -11,7 +11,10 @@ from dash.dependencies import Input, Output, State
 
 from ..layout import GraphLayout, Layout
 
-from ..util import ComputeController, URLMinify, InputGenerator
+from ..metrics import timed_callback
+from ..permalink import PERMALINK_CODEC
+from ..scenario import ScenarioSpec, field_index
+from ..util import ComputeController, URLMinify, InputGenerator, TabAggregate
 
 from warhammer_stats.pmf import PMF
 
@@ -31,7 +34,7 @@ class EmbedController(object):
       outputs={'embed_damage_graph': 'figure'},
       inputs={'url': 'href', 'page-2-radios': 'value'},
     )
-    @self.app.callback(mapper.outputs, mapper.inputs,mapper.states)
+    @timed_callback(self.app, 'embed', mapper.outputs, mapper.inputs, mapper.states)
     def _(*args):
       track_event(
         category='Render',
@@ -46,29 +49,15 @@ class EmbedController(object):
       return mapper.dict_to_output(output)
 
   def _parse_url_params(self, url):
-    parse_result = urlparse(url)
-    params = parse_qsl(parse_result.query)
-    state = dict(params)
-    max_map = self.url_minify.to_max()
-    return {max_map.get(x, x):y for x,y in state.items()}
+    spec = PERMALINK_CODEC.decode_url(url, field_index(self.tab_count, self.weapon_count))
+    return {**spec.global_fields, **dict(spec.items())}
 
   def _parse_embed_graph_args(self, inputs):
-    parsed_inputs = recurse_default()
-    for raw_input_name, value in inputs.items():
-      match = re.match(r'(?P<input_name>[^_]+)_(?P<tab>\d+)(_(?P<weapon>\d+))?', raw_input_name)
-      if match:
-        input_name = match.groupdict().get('input_name')
-        tab = match.groupdict().get('tab')
-        weapon = match.groupdict().get('weapon')
-        if input_name in ['shotmods', 'hitmods','woundmods', 'savemods', 'fnpmods', 'damagemods']:
-          value = value.split(',')
-        if weapon:
-          parsed_inputs[int(tab)]['weapons'][int(weapon)]['inputs'][input_name] = value
-        else:
-          parsed_inputs[int(tab)]['inputs'][input_name] = value
-      else:
-        parsed_inputs[-1]['inputs'][raw_input_name] = value
-    return self.default_to_regular(parsed_inputs)
+    spec = ScenarioSpec.from_fields(field_index(self.tab_count, self.weapon_count), inputs, split_mods=True)
+    parsed_inputs = spec.tabs(wrap='inputs')
+    if spec.global_fields:
+      parsed_inputs[-1] = {'inputs': spec.global_fields}
+    return parsed_inputs
 
   def default_to_regular(self, d):
     if isinstance(d, defaultdict):
@@ -83,27 +72,23 @@ class EmbedController(object):
         tab_results.append(results)
     return tab_results
 
-  def get_damage_plot(self, tab_data, tab_results):
-    damage_pmfs = [x.total_wounds_dist for x in tab_results]
-    damage_values = PMF.convolve_many(damage_pmfs).cumulative().trim_tail(thresh=10**(-4)).values
-
-    if len(damage_values) > 1:
+  def get_damage_plot(self, tab_data, tab_summary):
+    arrays = tab_summary.plot_arrays('damage')
+    if arrays:
       return {
-        'x': [i for i, x in enumerate(damage_values)],
-        'y': [100*x for i, x in enumerate(damage_values)],
+        'x': arrays[0],
+        'y': arrays[1],
         'name': tab_data['inputs'].get('tabname'),
       }
     else:
       return {}
 
-  def get_drone_plot(self, tab_data, tab_results):
-    damage_pmfs = [x.saviour_protocol_results.drone_wound_dist for x in tab_results]
-    damage_values = PMF.convolve_many(damage_pmfs).cumulative().trim_tail(thresh=10**(-4)).values
-
-    if len(damage_values) > 1:
+  def get_drone_plot(self, tab_data, tab_summary):
+    arrays = tab_summary.plot_arrays('drones')
+    if arrays:
       return {
-        'x': [i for i, x in enumerate(damage_values)],
-        'y': [100*x for i, x in enumerate(damage_values)],
+        'x': arrays[0],
+        'y': arrays[1],
         'name': tab_data['inputs'].get('tabname') + ' DRONES',
       }
     else:
@@ -112,10 +97,11 @@ class EmbedController(object):
 
   def get_tab_graphs(self, tab_data):
     results = self.get_tab_results(tab_data)
+    tab_summary = TabAggregate.from_results(self.compute_controller, results)
 
     return [
-      self.get_damage_plot(tab_data, results),
-      self.get_drone_plot(tab_data, results),
+      self.get_damage_plot(tab_data, tab_summary),
+      self.get_drone_plot(tab_data, tab_summary),
     ]
 
 
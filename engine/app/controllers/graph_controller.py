@@ -1,7 +1,6 @@
 from collections import defaultdict
 
 import re
-import math
 
 import dash
 import dash_core_components as dcc
@@ -10,13 +9,15 @@ import dash_html_components as html
 from urllib.parse import urlparse, parse_qsl, urlencode
 
 from flask import request
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 
-from ...constants import TAB_COUNT, GA_TRACKING_ID, TAB_COLOURS, DEFAULT_GRAPH_PLOTS
+from ...constants import GA_TRACKING_ID, TAB_COLOURS
 
 from ..layout import GraphLayout, Layout
 
-from ..util import ComputeController, URLMinify, InputGenerator
+from ..complexity import ComplexityError
+from ..scenario import field_index
+from ..util import ComputeController, URLMinify, InputGenerator, TabAggregate
 
 from warhammer_stats.pmf import PMF
 
@@ -37,9 +38,9 @@ class GraphController(object):
   def setup_callbacks(self):
     @mapped_callback(
       app=self.app,
+      name='graph',
       outputs=self._graph_updates(),
       inputs=self.input_generator.graph_inputs(),
-      states=self._graph_updates(),
     )
     def _(*args):
       track_event(
@@ -49,9 +50,18 @@ class GraphController(object):
       )
       return self._update_graph(*args)
 
+    # The figure is put together in the browser from the per tab stores, so
+    # neither the current figure nor unchanged traces cross the network
+    self.app.clientside_callback(
+      ClientsideFunction(namespace='graph', function_name='assembleFigure'),
+      Output('damage_graph', 'figure'),
+      [Input(f'tabgraph_{i}', 'data') for i in range(self.tab_count)],
+      [State('damage_graph', 'figure')],
+    )
+
   def _graph_updates(self):
     return {
-      **{'damage_graph': 'figure'},
+      **{f'tabgraph_{i}': 'data' for i in range(self.tab_count)},
 
       **{f'avgdisplay_{i}': 'value' for i in range(self.tab_count)},
       **{f'stddisplay_{i}': 'value' for i in range(self.tab_count)},
@@ -74,65 +84,71 @@ class GraphController(object):
 
   def _update_graph(self, callback):
     output = {}
-    current_plot_data = callback.global_states['damage_graph']['data']
-
-    changed_tabs = self._tabs_changed(current_plot_data)
-
-    grouped_plot_data = self._group_plot_data(current_plot_data)
-    points_enabled = False
+    changes = self._tabs_changed()
+    computed = self._compute_weapons(callback, changes)
     for tab_id in range(self.tab_count):
-      if tab_id in changed_tabs:
-        points_enabled = (callback.tab_inputs[tab_id].get('points') > 1) or points_enabled
-        new_data = self._tab_graph_data(tab_id, callback)
-        grouped_plot_data[tab_id] = new_data['graphs']
-        output.update(self.tab_output(tab_id, new_data, callback))
+      if tab_id in changes:
+        new_data = self._tab_graph_data(tab_id, callback, changes[tab_id], computed.get(tab_id))
+        output[f'tabgraph_{tab_id}'] = self.tab_graph_store(tab_id, new_data, callback)
+        output.update(self.tab_output(tab_id, new_data, callback, changes[tab_id]))
       else:
-        output.update(self.cached_tab_output(tab_id, callback))
-
-    for tab_id in range(self.tab_count):
-      pass
-
-    flattened_plot_data =self._flatten_plot_data(grouped_plot_data)
-    max_value = max([x.get('x')[-1] for x in flattened_plot_data if len(x.get('x', [])) > 1])
-    dtick = min(10**math.floor(math.log(max_value, 10))/2, 1)
-    output['damage_graph'] = self.graph_layout_generator.figure_template(
-      flattened_plot_data,
-      max_value,
-      top=10,
-      dtick=dtick if points_enabled else None
-    )
+        output.update(self.cached_tab_output(tab_id))
     callback.set_outputs(**output)
     return callback
 
-  def tab_output(self, tab_id, comp_data, callback):
+  def tab_graph_store(self, tab_id, comp_data, callback):
+    graphs = comp_data['graphs']
+    return {
+      'traces': [graphs[self._subplot_names[i]] for i in range(len(self._subplot_names))],
+      'points': callback.tab_inputs[tab_id].get('points') > 1,
+    }
+
+  def tab_output(self, tab_id, comp_data, callback, weapons_changed=None):
     tab_data = comp_data
     if callback.tab_inputs[tab_id].get('enabled') == 'enabled':
-      return self.enabled_tab_output(tab_id, tab_data)
+      output = self.enabled_tab_output(tab_id, tab_data)
+      if weapons_changed is not None:
+        # Untouched weapons keep the values they are already displaying
+        for weapon_id in range(self.weapon_count):
+          if weapon_id not in weapons_changed:
+            output.update(self.cached_weapon_output(tab_id, weapon_id))
+      return output
     else:
       return self.disabled_tab_output(tab_id)
 
-  def cached_tab_output(self, tab_id, callback):
-    output = {}
-    output[f'avgdisplay_{tab_id}'] = callback.tab_states[tab_id][f'avgdisplay']
-    output[f'stddisplay_{tab_id}'] = callback.tab_states[tab_id][f'stddisplay']
+  def cached_tab_output(self, tab_id):
+    output = {
+      f'tabgraph_{tab_id}': dash.no_update,
+      f'avgdisplay_{tab_id}': dash.no_update,
+      f'stddisplay_{tab_id}': dash.no_update,
+    }
     for weapon_id in range(self.weapon_count):
-      weapon_state = callback.tab_states[tab_id]['weapons'][weapon_id]
-      output[f'wepavgdisplay_{tab_id}_{weapon_id}'] = weapon_state[f'wepavgdisplay']
-      output[f'wepstddisplay_{tab_id}_{weapon_id}'] = weapon_state[f'wepstddisplay']
+      output.update(self.cached_weapon_output(tab_id, weapon_id))
     return output
 
-  def metadata_output(self, tab_id, enabled, mean=None, std=None):
+  def cached_weapon_output(self, tab_id, weapon_id):
+    return {
+      f'wepavgdisplay_{tab_id}_{weapon_id}': dash.no_update,
+      f'wepstddisplay_{tab_id}_{weapon_id}': dash.no_update,
+    }
+
+  def format_stat(self, value, approximate=False):
+    return '{}{}'.format('≈' if approximate else '', round(value, 2))
+
+  def metadata_output(self, tab_id, enabled, mean=None, std=None, error=None, approximate=False):
+    if error:
+      return {f'avgdisplay_{tab_id}': error, f'stddisplay_{tab_id}': error}
     return {
-      f'avgdisplay_{tab_id}': '{}'.format(round(mean, 2)) if enabled else 'Tab disabled',
-      f'stddisplay_{tab_id}': '{}'.format(round(std, 2)) if enabled else 'Tab disabled',
+      f'avgdisplay_{tab_id}': self.format_stat(mean, approximate) if enabled else 'Tab disabled',
+      f'stddisplay_{tab_id}': self.format_stat(std, approximate) if enabled else 'Tab disabled',
     }
 
-  def weapon_metadata_output(self, tab_id, weapon_id, enabled, wep_enabled, mean=None, std=None):
+  def weapon_metadata_output(self, tab_id, weapon_id, enabled, wep_enabled, mean=None, std=None, approximate=False):
     if enabled:
       if wep_enabled:
         return {
-          f'wepavgdisplay_{tab_id}_{weapon_id}': '{}'.format(round(mean, 2)),
-          f'wepstddisplay_{tab_id}_{weapon_id}': '{}'.format(round(std, 2)),
+          f'wepavgdisplay_{tab_id}_{weapon_id}': self.format_stat(mean, approximate),
+          f'wepstddisplay_{tab_id}_{weapon_id}': self.format_stat(std, approximate),
         }
       else:
         return {
@@ -148,9 +164,20 @@ class GraphController(object):
   def enabled_tab_output(self, tab_id, tab_data):
     output = {}
     tab_metadata = tab_data['metadata']
-    output = self.metadata_output(tab_id, True, tab_metadata['mean'], tab_metadata['std'])
+    output = self.metadata_output(
+      tab_id,
+      True,
+      tab_metadata['mean'],
+      tab_metadata['std'],
+      error=tab_metadata.get('error'),
+      approximate=tab_metadata.get('approximate'),
+    )
     for weapon_id in range(self.weapon_count):
       weapon_metadata = tab_data['metadata']['weapon_metadata'][weapon_id]
+      if weapon_metadata.get('error'):
+        output[f'wepavgdisplay_{tab_id}_{weapon_id}'] = weapon_metadata['error']
+        output[f'wepstddisplay_{tab_id}_{weapon_id}'] = weapon_metadata['error']
+        continue
       output.update(self.weapon_metadata_output(
         tab_id,
         weapon_id,
@@ -158,6 +185,7 @@ class GraphController(object):
         weapon_metadata['mean'] > -1,
         mean=weapon_metadata['mean'],
         std=weapon_metadata['std'],
+        approximate=weapon_metadata.get('approximate'),
       ))
     return output
 
@@ -167,29 +195,25 @@ class GraphController(object):
       output.update(self.weapon_metadata_output(tab_id, weapon_id, False, False, 0, 0))
     return output
 
-  def get_damage_plot(self, tab_data, tab_results, colour):
-    damage_pmfs = [x.total_wounds_dist for x in tab_results]
-    damage_values = PMF.convolve_many(damage_pmfs).cumulative().trim_tail(thresh=10**(-4)).values
-    pts = int(tab_data.get('points', 1))
-    if len(damage_values) > 1:
+  def get_damage_plot(self, tab_data, tab_summary, colour):
+    arrays = tab_summary.plot_arrays('damage')
+    if arrays:
       return {
-        'x': [i/pts for i, x in enumerate(damage_values)],
-        'y': [100*x for i, x in enumerate(damage_values)],
-        'name': tab_data.get('tabname'),
+        'x': arrays[0],
+        'y': arrays[1],
+        'name': '{} (approx.)'.format(tab_data.get('tabname')) if tab_summary.approximate else tab_data.get('tabname'),
         'line': {'color': colour},
         'legendgroup': tab_data.get('tabname')
       }
     else:
       return {}
 
-  def get_drone_plot(self, tab_data, tab_results, colour):
-    damage_pmfs = [x.saviour_protocol_results.drone_wound_dist for x in tab_results]
-    damage_values = PMF.convolve_many(damage_pmfs).cumulative().trim_tail(thresh=10**(-4)).values
-    pts = int(tab_data.get('points', 1))
-    if len(damage_values) > 1:
+  def get_drone_plot(self, tab_data, tab_summary, colour):
+    arrays = tab_summary.plot_arrays('drones')
+    if arrays:
       return {
-        'x': [i/pts for i, x in enumerate(damage_values)],
-        'y': [100*x for i, x in enumerate(damage_values)],
+        'x': arrays[0],
+        'y': arrays[1],
         'name': 'Drone DMG',
         'line': {'dash': 'dash', 'color': colour},
         'legendgroup': tab_data.get('tabname')
@@ -197,14 +221,12 @@ class GraphController(object):
     else:
       return {}
 
-  def get_self_damage_plot(self, tab_data, tab_results, colour):
-    damage_pmfs = [x.to_hit_results.self_inflicted_dist for x in tab_results]
-    damage_values = PMF.convolve_many(damage_pmfs).cumulative().trim_tail(thresh=10**(-4)).values
-    pts = int(tab_data.get('points', 1))
-    if len(damage_values) > 1:
+  def get_self_damage_plot(self, tab_data, tab_summary, colour):
+    arrays = tab_summary.plot_arrays('self')
+    if arrays:
       return {
-        'x': [i/pts for i, x in enumerate(damage_values)],
-        'y': [100*x for i, x in enumerate(damage_values)],
+        'x': arrays[0],
+        'y': arrays[1],
         'name': 'Self DMG',
         'line': {'dash': 'dot', 'color': colour},
         'legendgroup': tab_data.get('tabname')
@@ -212,22 +234,65 @@ class GraphController(object):
     else:
       return {}
 
-  def _tab_graph_data(self, tab_id, callback):
+  def _enabled_weapons(self, tab_id, callback):
+    tab_inputs = callback.tab_inputs[tab_id]
+    if tab_inputs.get('enabled') != 'enabled':
+      return {}
+    return {
+      weapon_id: weapon_inputs
+      for weapon_id, weapon_inputs in tab_inputs['weapons'].items()
+      if weapon_inputs and weapon_inputs.get('weaponenabled') == 'enabled'
+    }
+
+  def _compute_weapons(self, callback, changes):
+    """Compute every changed weapon of every changed tab in one go, so the pool can spread them out."""
+    jobs = []
+    for tab_id, weapons_changed in changes.items():
+      tab_inputs = callback.tab_inputs.get(tab_id)
+      if not tab_inputs:
+        continue
+      for weapon_id, weapon_inputs in self._enabled_weapons(tab_id, callback).items():
+        if weapons_changed is None or weapon_id in weapons_changed:
+          try:
+            self.compute_controller.check(**tab_inputs, **weapon_inputs)
+          except ComplexityError:
+            # Left out here and reported when the tab is put together
+            continue
+          jobs.append((tab_id, weapon_id, {**tab_inputs, **weapon_inputs}))
+    computed = defaultdict(dict)
+    results = self.compute_controller.compute_many([x[2] for x in jobs])
+    for (tab_id, weapon_id, _), weapon_results in zip(jobs, results):
+      computed[tab_id][weapon_id] = weapon_results
+    return computed
+
+  def _tab_graph_data(self, tab_id, callback, weapons_changed=None, computed=None):
     tab_results = []
     tab_inputs = callback.tab_inputs[tab_id]
+    computed = computed or {}
+    enabled_weapons = self._enabled_weapons(tab_id, callback)
 
     weapon_metadata = {}
-
-    tab_enabled = tab_inputs.get('enabled') == 'enabled'
+    errors = []
 
     for weapon_id in range(self.weapon_count):
-      weapon_inputs = tab_inputs['weapons'].get(weapon_id)
-      if tab_enabled and weapon_inputs and weapon_inputs.get('weaponenabled') == 'enabled':
-        results = self.compute_controller.compute(**tab_inputs, **weapon_inputs)
+      weapon_inputs = enabled_weapons.get(weapon_id)
+      if weapon_inputs:
+        try:
+          if weapon_id in computed:
+            results = computed[weapon_id]
+          elif weapons_changed is None or weapon_id in weapons_changed:
+            results = self.compute_controller.compute(**tab_inputs, **weapon_inputs)
+          else:
+            results = self.compute_controller.recall(**tab_inputs, **weapon_inputs)
+        except ComplexityError as error:
+          errors.append(str(error))
+          weapon_metadata[weapon_id] = {'mean': -1, 'std': -1, 'error': str(error)}
+          continue
         tab_results.append(results)
         weapon_metadata[weapon_id] = {
           'mean': results.total_wounds_dist.mean(),
           'std': results.total_wounds_dist.std(),
+          'approximate': results.approximate,
         }
       else:
         weapon_metadata[weapon_id] = {
@@ -235,18 +300,37 @@ class GraphController(object):
           'std': -1,
         }
 
-    tab_pmf = PMF.convolve_many([x.total_wounds_dist for x in tab_results])
+    if errors:
+      return self._rejected_tab_data(errors[0], weapon_metadata)
+
+    tab_summary = TabAggregate.from_results(
+      self.compute_controller,
+      tab_results,
+      points=int(tab_inputs.get('points', 1)),
+    )
     colour = TAB_COLOURS[tab_id]
 
     return {
       'graphs': {
-        'damage': self.get_damage_plot(tab_inputs, tab_results, colour),
-        'drones': self.get_drone_plot(tab_inputs, tab_results, colour),
-        'self': self.get_self_damage_plot(tab_inputs, tab_results, colour),
+        'damage': self.get_damage_plot(tab_inputs, tab_summary, colour),
+        'drones': self.get_drone_plot(tab_inputs, tab_summary, colour),
+        'self': self.get_self_damage_plot(tab_inputs, tab_summary, colour),
+      },
+      'metadata': {
+        'mean': tab_summary.mean,
+        'std': tab_summary.std,
+        'approximate': tab_summary.approximate,
+        'weapon_metadata': weapon_metadata,
       },
+    }
+
+  def _rejected_tab_data(self, error, weapon_metadata):
+    return {
+      'graphs': {x: {} for x in self._subplot_names.values()},
       'metadata': {
-        'mean': tab_pmf.mean(),
-        'std': tab_pmf.std(),
+        'mean': None,
+        'std': None,
+        'error': error,
         'weapon_metadata': weapon_metadata,
       },
     }
@@ -257,19 +341,27 @@ class GraphController(object):
       return None
     return ctx.triggered[0]['prop_id']
 
-  def _tabs_changed(self, graph_data):
-    if graph_data == DEFAULT_GRAPH_PLOTS:
-      return list(range(self.tab_count))
+  def _tabs_changed(self):
+    ctx = dash.callback_context
+    if not ctx.triggered:
+      # Initial render of the page, nothing is on the graph yet
+      return {i: None for i in range(self.tab_count)}
     else:
       return self._get_tabs_changed()
 
   def _get_tabs_changed(self):
+    """Map each changed tab to the set of changed weapon ids, or None for the whole tab."""
     ctx = dash.callback_context
     if not ctx:
-      return list(range(TAB_COUNT))
-    tabs = []
+      return {i: None for i in range(self.tab_count)}
+    changes = {}
+    index = field_index(self.tab_count, self.weapon_count)
     for trigger in ctx.triggered:
-      match = re.match(r'(?P<input_name>[^_]+)_(?P<tab>\d+)(_(?P<weapon>\d+))?', trigger['prop_id'])
-      if match:
-        tabs.append(int(match.groupdict().get('tab')))
-    return list(set(tabs))
+      field = index.decode(trigger['prop_id'].rpartition('.')[0])
+      if field:
+        _, tab, weapon = field
+        if weapon is None:
+          changes[tab] = None
+        elif tab not in changes or changes[tab] is not None:
+          changes.setdefault(tab, set()).add(weapon)
+    return changes
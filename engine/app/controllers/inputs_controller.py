@@ -7,13 +7,17 @@ import dash_html_components as html
 from urllib.parse import urlparse, parse_qsl, urlencode
 
 from flask import request
-from dash import callback_context
-from dash.dependencies import Input, Output, State
+from dash import callback_context, no_update
+from dash.dependencies import Input, Output, State, ClientsideFunction
 
 from ..layout import GraphLayout, Layout
+from ..metrics import timed_callback
+from ..modifiers import MODIFIER_SEARCH
 
 from ..util import ComputeController, URLMinify, InputGenerator
 
+from ...constants import TARGET_PRESETS
+
 from warhammer_stats.pmf import PMF
 
 from .util import CallbackMapper, track_event, recurse_default
@@ -32,98 +36,66 @@ class InputsController(object):
     self._setup_preset_callback(tab_id)
     self._tabname_callback(tab_id)
     self._setup_weaponname_callback(tab_id)
+    self._modifier_search_callback(tab_id)
 
   def _setup_weaponname_callback(self, tab_id):
     for weapon_id in range(self.weapon_count):
       self._weaponname_callback(tab_id, weapon_id)
 
   def _setup_preset_callback(self, tab_id):
-    @self.app.callback(
-      output=[
+    self.app.clientside_callback(
+      ClientsideFunction(namespace='inputs', function_name='applyPreset'),
+      [
         Output(f'toughness_{tab_id}', 'value'),
         Output(f'save_{tab_id}', 'value'),
         Output(f'invuln_{tab_id}', 'value'),
         Output(f'fnp_{tab_id}', 'value'),
         Output(f'wounds_{tab_id}', 'value'),
       ],
-      inputs=[
-        Input(f'guardsman_{tab_id}', 'n_clicks'),
-        Input(f'ork_boy_{tab_id}', 'n_clicks'),
-        Input(f'shield_drone_{tab_id}', 'n_clicks'),
-        Input(f'tactical_marine_{tab_id}', 'n_clicks'),
-        Input(f'intercessor_{tab_id}', 'n_clicks'),
-        Input(f'terminator_{tab_id}', 'n_clicks'),
-        Input(f'crisis_suit_{tab_id}', 'n_clicks'),
-        Input(f'custode_{tab_id}', 'n_clicks'),
-        Input(f'riptide_{tab_id}', 'n_clicks'),
-        Input(f'rhino_{tab_id}', 'n_clicks'),
-        Input(f'leman_russ_{tab_id}', 'n_clicks'),
-        Input(f'knight_{tab_id}', 'n_clicks'),
-      ],
+      [Input(f'{preset_id}_{tab_id}', 'n_clicks') for preset_id, _, _ in TARGET_PRESETS],
+      [State('target_presets', 'data')],
     )
-    def _(*args):
-      # [toughness, +, ++, +++, wounds]
-
-
-      if not callback_context or callback_context.triggered[0]['prop_id'] == '.':
-        return [3,5,7,7,1]
-      trigger = callback_context.triggered[0]['prop_id']
-
-      print(trigger)
-      if 'guardsman' in trigger:
-        return [3,5,7,7,1]
-      elif 'ork_boy' in trigger:
-        return [4,6,7,7,1]
-      elif 'shield_drone' in trigger:
-        return [4,4,4,5,1]
-      elif 'tactical_marine' in trigger:
-        return [4,3,7,7,1]
-      elif 'intercessor' in trigger:
-        return [4,3,7,7,2]
-      elif 'terminator' in trigger:
-        return [4,3,4,7,2]
-      elif 'crisis_suit' in trigger:
-        return [5,3,7,7,3]
-      elif 'custode' in trigger:
-        return [5,2,3,7,3]
-      elif 'riptide' in trigger:
-        return [7,2,5,7,14]
-      elif 'rhino' in trigger:
-        return [7,3,7,7,10]
-      elif 'leman_russ' in trigger:
-        return [8,3,7,7,12]
-      elif 'knight' in trigger:
-        return [8,3,5,7,24]
-
 
   def _tabname_callback(self, tab_id):
-    @self.app.callback(
+    self.app.clientside_callback(
+      ClientsideFunction(namespace='inputs', function_name='profileLabel'),
       Output(f'tab_{tab_id}', 'label'),
       [
         Input(f'tabname_{tab_id}', 'value'),
         Input(f'enabled_{tab_id}', 'value'),
       ],
     )
-    def _(value, enabled):
-      value = value if len(value) > 2 else 'Profile'
-      if enabled == 'enabled':
-        value = f'▪️ {value}'
-      else:
-        value = f'▫️ {value}'
-      return value
 
   def _weaponname_callback(self, tab_id, weapon_id):
-    @self.app.callback(
+    self.app.clientside_callback(
+      ClientsideFunction(namespace='inputs', function_name='weaponLabel'),
       Output(f'weapontab_{tab_id}_{weapon_id}', 'label'),
       [
         Input(f'weaponname_{tab_id}_{weapon_id}', 'value'),
         Input(f'weaponenabled_{tab_id}_{weapon_id}', 'value'),
       ],
     )
-    def _(value, enabled):
-      value = value if len(value) > 2 else 'Weapon'
-      if enabled == 'enabled':
-        value = f'▪️ {value}'
-      else:
-        value = f'▫️ {value}'
-      return value
+
+  def _modifier_search_callback(self, tab_id):
+    # One callback per tab keeps the initial page load to a request per tab
+    dropdowns = [
+      (f'{field}_{tab_id}_{weapon_id}', search)
+      for weapon_id in range(self.weapon_count)
+      for field, search in MODIFIER_SEARCH.items()
+    ]
+    @timed_callback(
+      self.app,
+      'modifiers',
+      [Output(x, 'options') for x, _ in dropdowns],
+      [Input(x, 'search_value') for x, _ in dropdowns] + [Input(x, 'value') for x, _ in dropdowns],
+    )
+    def _(*args):
+      queries, selected = args[:len(dropdowns)], args[len(dropdowns):]
+      triggered = {x['prop_id'].rpartition('.')[0] for x in callback_context.triggered}
+      options = []
+      for (dropdown_id, search), query, values in zip(dropdowns, queries, selected):
+        if dropdown_id in triggered or search.needs_update(query, values):
+          options.append(search.options_for(query, values))
+        else:
+          options.append(no_update)
+      return options
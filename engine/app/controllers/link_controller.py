@@ -11,6 +11,9 @@ from dash.dependencies import Input, Output, State
 
 from ..layout import GraphLayout, Layout
 
+from ..metrics import timed_callback
+from ..permalink import PERMALINK_CODEC, PARAM
+from ..scenario import ScenarioSpec, field_index
 from ..util import ComputeController, URLMinify, InputGenerator
 
 from warhammer_stats.pmf import PMF
@@ -30,7 +33,7 @@ class LinkController(object):
       outputs={'permalink': 'href'},
       inputs=self.input_generator.graph_inputs(),
     )
-    @self.app.callback(mapper.outputs, mapper.inputs,mapper.states)
+    @timed_callback(self.app, 'link', mapper.outputs, mapper.inputs, mapper.states)
     def _(*args):
       tab_data = mapper.input_to_kwargs_by_tab(args, self.tab_count, self.weapon_count)
       result_dict = {'permalink': self.convert_args_to_url(tab_data)}
@@ -45,13 +48,8 @@ class LinkController(object):
         for weapon_id, weapon_data in tab_data['weapons'].items():
           if weapon_data['inputs'].get('weaponenabled') == 'enabled':
             for key, value in weapon_data['inputs'].items():
-              if key in ['shotmods', 'hitmods','woundmods', 'savemods', 'fnpmods', 'damagemods']:
-                url_args[f'{key}_{tab_id}_{weapon_id}'] = ','.join(value or [])
-              else:
-                url_args[f'{key}_{tab_id}_{weapon_id}'] = value
+              url_args[f'{key}_{tab_id}_{weapon_id}'] = value
 
     url_args.update(input_data[-1]['inputs'])
-    min_map = self.url_minify.to_min()
-    url_args = {min_map.get(x, x):y for x,y in url_args.items()}
-    state = urlencode(url_args)
-    return f'/static?{state}'
+    spec = ScenarioSpec.from_fields(field_index(self.tab_count, self.weapon_count), url_args)
+    return f'/static?{PARAM}={PERMALINK_CODEC.encode(spec)}'
@@ -13,9 +13,11 @@ from dash.dependencies import Input, Output, State
 
 from ..layout import GraphLayout, Layout
 
-from ...constants import TAB_COLOURS, DEFAULT_GRAPH_PLOTS
+from ...constants import TAB_COLOURS, DEFAULT_GRAPH_PLOTS, STATIC_CACHE_ENTRIES, STATIC_CACHE_MAX_AGE
 
 
+from ..cache import LRUCache, canonical_key
+from ..metrics import REGISTRY
 from ..util import ComputeController, URLMinify, InputGenerator
 
 from warhammer_stats.pmf import PMF
@@ -23,14 +25,23 @@ from warhammer_stats.pmf import PMF
 from .util import CallbackMapper, track_event, recurse_default, mapped_callback
 from .graph_controller import GraphController
 
+STATIC_CACHE = LRUCache(max_entries=STATIC_CACHE_ENTRIES)
+CACHED_PATHS = ('/static', '/embed')
+REGISTRY.caches.add('static', STATIC_CACHE)
+
+
 class StaticController(GraphController):
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
     self.url_minify = URLMinify(self.tab_count, self.weapon_count)
+    self.static_cache = STATIC_CACHE
 
   def setup_callbacks(self):
+    self.app.server.after_request(self._cache_headers)
+
     @mapped_callback(
       app=self.app,
+      name='static',
       outputs={
         'static_graph_debug': 'children',
         'static_damage_graph': 'figure',
@@ -40,7 +51,40 @@ class StaticController(GraphController):
     )
     def _(callback):
       track_event(category='Render', action='Static')
-      return self.update_static_graph(callback)
+      return self.cached_static_graph(callback)
+
+  def _cache_headers(self, response):
+    if request.method != 'GET' or response.status_code != 200:
+      return response
+    if request.path in CACHED_PATHS:
+      # The page names the asset bundles of the current deploy, so browsers
+      # and CDNs revalidate it with the ETag every time rather than keep it
+      response.cache_control.public = True
+      response.cache_control.no_cache = True
+      response.add_etag()
+      response.make_conditional(request)
+    elif request.path.startswith(self._asset_prefix()):
+      # Dash versions asset URLs with their modification time
+      response.cache_control.no_cache = None
+      response.cache_control.public = True
+      response.cache_control.max_age = STATIC_CACHE_MAX_AGE
+    return response
+
+  def _asset_prefix(self):
+    return self.app.config.requests_pathname_prefix + self.app.config.assets_url_path.strip('/') + '/'
+
+  def static_cache_key(self, callback):
+    return canonical_key('static', callback.url_scenario.key())
+
+  def cached_static_graph(self, callback):
+    """Render a permalink once and replay the finished outputs for every later view."""
+    key = self.static_cache_key(callback)
+    output = self.static_cache.get(key)
+    if output is None:
+      output = self.update_static_graph(callback).named_outputs
+      self.static_cache.set(key, output)
+    callback.set_outputs(**output)
+    return callback
 
   def _update_avg(self, tab_id, name, mean, std):
     return {
@@ -62,28 +106,29 @@ class StaticController(GraphController):
     title = callback.global_inputs.get('title')
 
     grouped_plot_data = self._group_plot_data(DEFAULT_GRAPH_PLOTS)
+    computed = self._compute_weapons(callback, {i: None for i in range(self.tab_count)})
     for tab_id in range(self.tab_count):
       if callback.tab_inputs.get(tab_id):
-        new_data = self._tab_graph_data(tab_id, callback)
+        new_data = self._tab_graph_data(tab_id, callback, computed=computed.get(tab_id))
         grouped_plot_data[tab_id] = new_data['graphs']
+        metadata = new_data['metadata']
+        mean = metadata.get('error') or metadata['mean']
+        std = metadata.get('error') or metadata['std']
+        if metadata.get('approximate'):
+          mean, std = self.format_stat(mean, True), self.format_stat(std, True)
         output.update(self._update_avg(
           tab_id,
           callback.tab_inputs.get(tab_id, {}).get('tabname', 'n/a'),
-          new_data['metadata']['mean'],
-          new_data['metadata']['std'],
+          mean,
+          std,
         ))
-        output[f'statsrow_{tab_id}'] = self.graph_layout_generator._tab_info(
-          tab_id,
-          callback,
-          new_data['metadata']['mean'],
-          new_data['metadata']['std'],
-        )
+        output[f'statsrow_{tab_id}'] = self.graph_layout_generator._tab_info(tab_id, callback, mean, std)
       else:
         output[f'statsrow_{tab_id}'] = []
 
     flattened_plot_data =self._flatten_plot_data(grouped_plot_data)
     output['static_graph_debug'] = ''
-    max_value = max([x.get('x')[-1] for x in flattened_plot_data if len(x.get('x', [])) > 1])
+    max_value = max([x.get('x')[-1] for x in flattened_plot_data if len(x.get('x', [])) > 1], default=10)
     dtick = min(10**math.floor(math.log(max_value, 10))/2, 1)
     output['static_damage_graph'] = self.graph_layout_generator.figure_template(
       flattened_plot_data,
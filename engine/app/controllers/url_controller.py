@@ -16,6 +16,7 @@ from dash.dependencies import Input, Output, State
 
 from ..layout import GraphLayout, Layout
 
+from ..metrics import timed_callback
 from ..util import ComputeController, URLMinify, InputGenerator
 
 from ...constants import TAB_COUNT, GA_TRACKING_ID
@@ -32,7 +33,12 @@ class URLController(object):
 
   def setup_callbacks(self):
     mapper = CallbackMapper(outputs={'page_content': 'children'}, inputs={'url': 'pathname'})
-    @self.app.callback(mapper.outputs, mapper.inputs,mapper.states)
+    # Build every page up front, navigation then replays the serialized response
+    self.layout_generator.base_layout()
+    self.layout_generator.static_layout()
+    self.layout_generator.embed_layout()
+
+    @timed_callback(self.app, 'url', mapper.outputs, mapper.inputs, mapper.states, memoize=8)
     def _(pathname):
       result_dict = {}
       if pathname == '/':
@@ -5,7 +5,6 @@ import hashlib
 import dash
 import dash_daq as daq
 import re
-import requests
 import dash_core_components as dcc
 import dash_html_components as html
 
@@ -16,9 +15,14 @@ from dash.dependencies import Input, Output, State
 
 from ..layout import GraphLayout, Layout
 
+from ..analytics import AnalyticsQueue, sink_from_name
+from ..metrics import timed, timed_callback
+from ..permalink import PERMALINK_CODEC
+from ..scenario import ScenarioSpec, field_index
 from ..util import ComputeController, URLMinify, InputGenerator
 
 from ...constants import TAB_COUNT, WEAPON_COUNT, GA_TRACKING_ID
+from ...constants import ANALYTICS_SINK, ANALYTICS_FILE, ANALYTICS_QUEUE_SIZE, ANALYTICS_FLUSH_INTERVAL
 from warhammer_stats.pmf import PMF
 
 
@@ -48,6 +52,13 @@ def get_gid():
     pass
 
 
+ANALYTICS_QUEUE = AnalyticsQueue(
+  sink_from_name(ANALYTICS_SINK, ANALYTICS_FILE),
+  max_size=ANALYTICS_QUEUE_SIZE,
+  flush_interval=ANALYTICS_FLUSH_INTERVAL,
+)
+
+
 def track_event(category, action, label=None, value=0):
   cid = get_cid()
   gid = get_gid()
@@ -69,16 +80,8 @@ def track_event(category, action, label=None, value=0):
   if gid:
     data['_gid'] = gid
 
-  response = requests.post(
-    'https://www.google-analytics.com/collect',
-    headers={ "user-agent": "client" },
-    data=data,
-  )
-
-  # If the request fails, this will raise a RequestException. Depending
-  # on your application's needs, this may be a non-error and can be caught
-  # by the caller.
-  response.raise_for_status()
+  # Sent in batches from a background thread, the callback never waits on GA
+  ANALYTICS_QUEUE.put({k: v for k, v in data.items() if v is not None})
 
 class CallbackMap(object):
   def __init__(self, raw_input, outputs_order, inputs_order, states_order):
@@ -96,6 +99,8 @@ class CallbackMap(object):
     self._global_states = None
 
     self._url_minify = None
+    self._field_index = None
+    self._url_scenario = None
 
     self._outputs = {}
 
@@ -139,46 +144,37 @@ class CallbackMap(object):
   def outputs(self):
     return [self._outputs[k] for k in self._outputs_order]
 
+  @property
+  def named_outputs(self):
+    return dict(self._outputs)
+
   @property
   def url_minify(self):
     if self._url_minify is None:
       self._url_minify = URLMinify(TAB_COUNT, WEAPON_COUNT)
     return self._url_minify
 
+  @property
+  def field_index(self):
+    if self._field_index is None:
+      self._field_index = field_index(TAB_COUNT, WEAPON_COUNT)
+    return self._field_index
+
+  @property
+  def url_scenario(self):
+    """The scenario held in the query of the url input."""
+    if self._url_scenario is None:
+      self._url_scenario = self._parse_url_scenario()
+    return self._url_scenario
+
   def update_from_url(self):
-    url_args = self._parse_url_params()
     self.tab_inputs
-    tab_fields, global_fields = self._parse_static_graph_args(url_args)
-    self._tab_inputs.update(tab_fields)
-    self._global_inputs.update(global_fields)
-
-
-  def _parse_url_params(self):
-    url = self.inputs['url']
-    parse_result = urlparse(url)
-    params = parse_qsl(parse_result.query)
-    state = dict(params)
-    max_map = self.url_minify.to_max()
-    return {max_map.get(x, x): y for x,y in state.items()}
-
-  def _parse_static_graph_args(self, inputs):
-    global_fields = recurse_default()
-    tab_fields = recurse_default()
-    for raw_input_name, value in inputs.items():
-      match = re.match(r'(?P<field_name>[^_]+)_(?P<tab_id>\d+)(_(?P<weapon_id>\d+))?', raw_input_name)
-      if match:
-        field_name = match.groupdict().get('field_name')
-        tab_id = match.groupdict().get('tab_id')
-        weapon_id = match.groupdict().get('weapon_id')
-        if field_name in ['shotmods', 'hitmods','woundmods', 'savemods', 'fnpmods', 'damagemods']:
-          value = value.split(',')
-        if weapon_id:
-          tab_fields[int(tab_id)]['weapons'][int(weapon_id)][field_name] = value
-        else:
-          tab_fields[int(tab_id)][field_name] = value
-      else:
-        global_fields[raw_input_name] = value
-    return self.default_to_regular(tab_fields), self.default_to_regular(global_fields)
+    self._tab_inputs.update(self.url_scenario.tabs())
+    self._global_inputs.update(self.url_scenario.global_fields)
+
+  @timed('mapping')
+  def _parse_url_scenario(self):
+    return PERMALINK_CODEC.decode_url(self.inputs['url'], self.field_index)
 
   def set_outputs(self, **kwargs):
     self._outputs.update(kwargs)
@@ -206,27 +202,16 @@ class CallbackMap(object):
         d = {k: self.default_to_regular(v) for k, v in d.items()}
     return d
 
+  @timed('mapping')
   def _parse_tab_fields(self, fields=None):
-    tab_fields = recurse_default()
-    global_fields = recurse_default()
-    for raw_input_name, value in fields.items():
-      match = re.match(r'(?P<field_name>[^_]+)_(?P<tab_id>\d+)(_(?P<weapon_id>\d+))?', raw_input_name)
-      if match:
-        field_name = match.groupdict().get('field_name')
-        tab_id = match.groupdict().get('tab_id')
-        weapon_id = match.groupdict().get('weapon_id')
-        if weapon_id:
-          tab_fields[int(tab_id)]['weapons'][int(weapon_id)][field_name] = value
-        else:
-          tab_fields[int(tab_id)][field_name] = value
-      else:
-        global_fields[raw_input_name] = value
-    return self.default_to_regular(tab_fields), self.default_to_regular(global_fields)
+    spec = ScenarioSpec.from_fields(self.field_index, fields)
+    return spec.tabs(), spec.global_fields
 
 
 class mapped_callback(object):
-  def __init__(self, app, outputs=None, inputs=None, states=None, tab_count=1, weapon_count=1):
+  def __init__(self, app, outputs=None, inputs=None, states=None, tab_count=1, weapon_count=1, name='callback'):
     self._app = app
+    self._name = name
 
     self._outputs = outputs or {}
     self._outputs_order = sorted(self._outputs.keys())
@@ -252,7 +237,7 @@ class mapped_callback(object):
     return [State(k, self._states[k]) for k in self._states_order]
 
   def __call__(self, func):
-    @self._app.callback(self.outputs, self.inputs, self.states)
+    @timed_callback(self._app, self._name, self.outputs, self.inputs, self.states)
     def callback(*args, **kwargs):
       return self.unmap(func(self.map(*args)))
     return callback
@@ -290,33 +275,26 @@ class CallbackMapper(object):
   def states(self):
     return [State(k, self._states[k]) for k in self._states_order]
 
+  @timed('mapping')
   def input_to_kwargs_by_tab(self, args, tab_count, weapon_count):
     inputs = self.input_to_kwargs(args)
-    parsed_inputs = recurse_default()
-    parsed_inputs = self.parse_kwargs(inputs, parsed_inputs, 'inputs')
-    parsed_inputs = self.parse_kwargs(inputs, parsed_inputs, 'states')
-    return self.default_to_regular(parsed_inputs)
+    index = field_index(tab_count, weapon_count)
+    parsed_inputs = self.parse_kwargs(inputs, {}, 'inputs', index)
+    parsed_inputs = self.parse_kwargs(inputs, parsed_inputs, 'states', index)
+    return parsed_inputs
 
   def default_to_regular(self, d):
     if isinstance(d, defaultdict):
         d = {k: self.default_to_regular(v) for k, v in d.items()}
     return d
 
-  def parse_kwargs(self, inputs, parsed_inputs=None, parse_field=None):
-    parsed_inputs = parsed_inputs or recurse_default()
+  def parse_kwargs(self, inputs, parsed_inputs=None, parse_field=None, index=None):
+    parsed_inputs = {} if parsed_inputs is None else parsed_inputs
     parse_field = parse_field or 'inputs'
-    for raw_input_name, value in inputs[parse_field].items():
-      match = re.match(r'(?P<input_name>[^_]+)_(?P<tab>\d+)(_(?P<weapon>\d+))?', raw_input_name)
-      if match:
-        input_name = match.groupdict().get('input_name')
-        tab = match.groupdict().get('tab')
-        weapon = match.groupdict().get('weapon')
-        if weapon:
-          parsed_inputs[int(tab)]['weapons'][int(weapon)][parse_field][input_name] = value
-        else:
-          parsed_inputs[int(tab)][parse_field][input_name] = value
-      else:
-        parsed_inputs[-1][parse_field][raw_input_name] = value
+    spec = ScenarioSpec.from_fields(index or field_index(), inputs[parse_field])
+    spec.tabs(parsed_inputs, wrap=parse_field)
+    if spec.global_fields:
+      parsed_inputs.setdefault(-1, {}).setdefault(parse_field, {}).update(spec.global_fields)
     return parsed_inputs
 
   def input_to_kwargs(self, args):
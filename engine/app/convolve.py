@@ -0,0 +1,122 @@
+import heapq
+
+import numpy as np
+
+from scipy import fft as sp_fft
+from scipy.signal import oaconvolve
+
+from warhammer_stats.pmf import PMF
+
+
+# Below this many multiply-adds a plain direct convolution beats any transform
+DIRECT_MAX_COST = 4096
+# Overlap-add pays off once one operand is this many times longer than the other
+OVERLAP_ADD_RATIO = 32
+ROUND_OFF = 1e-15
+
+
+def choose_method(n, m):
+  """Pick a kernel for convolving supports of length n and m."""
+  short, long = min(n, m), max(n, m)
+  if short * long <= DIRECT_MAX_COST or short <= 2:
+    return 'direct'
+  if long >= OVERLAP_ADD_RATIO * short:
+    return 'overlap-add'
+  return 'fft'
+
+
+def clean(values, mass=1.0):
+  """Clamp negative and round-off noise to zero and renormalise to mass."""
+  values = np.where(values < ROUND_OFF, 0.0, values)
+  total = values.sum()
+  if total > 0 and mass > 0:
+    values *= mass / total
+  return values
+
+
+def convolve(a, b, method=None):
+  a = np.asarray(a, dtype=float)
+  b = np.asarray(b, dtype=float)
+  method = method or choose_method(len(a), len(b))
+  if method == 'direct':
+    return np.convolve(a, b)
+  if method == 'overlap-add':
+    return oaconvolve(a, b)
+  length = len(a) + len(b) - 1
+  size = sp_fft.next_fast_len(length, real=True)
+  return sp_fft.irfft(sp_fft.rfft(a, size) * sp_fft.rfft(b, size), size)[:length]
+
+
+def convolve_arrays(arrays):
+  arrays = [np.asarray(x, dtype=float) for x in arrays]
+  if not arrays:
+    return np.ones(1)
+  mass = float(np.prod([x.sum() for x in arrays]))
+  length = 1 + sum(len(x) - 1 for x in arrays)
+  largest = max(len(x) for x in arrays)
+  if len(arrays) > 2 and choose_method(largest, length) == 'fft':
+    # One transform per operand and a single inverse beats folding pairwise
+    size = sp_fft.next_fast_len(length, real=True)
+    spectrum = np.ones(size // 2 + 1, dtype=complex)
+    for x in arrays:
+      spectrum *= sp_fft.rfft(x, size)
+    return clean(sp_fft.irfft(spectrum, size)[:length], mass)
+  # Fold the shortest operands together first to keep intermediate supports small
+  heap = [(len(x), i, x) for i, x in enumerate(arrays)]
+  heapq.heapify(heap)
+  counter = len(heap)
+  while len(heap) > 1:
+    _, _, a = heapq.heappop(heap)
+    _, _, b = heapq.heappop(heap)
+    result = convolve(a, b)
+    heapq.heappush(heap, (len(result), counter, result))
+    counter += 1
+  return clean(heap[0][2], mass)
+
+
+def convolve_many(dists):
+  """Drop in replacement for PMF.convolve_many."""
+  return PMF(convolve_arrays([x.values for x in dists]).tolist())
+
+
+def compound(count_dist, item_dist):
+  """Distribution of the sum of N independent draws of item_dist, N ~ count_dist.
+
+  This is the damage step of an attack: every failed save rolls the damage
+  characteristic again and the results are summed.
+  """
+  counts = np.asarray(count_dist.values, dtype=float)
+  item = np.asarray(item_dist.values, dtype=float)
+  nonzero = np.nonzero(counts)[0]
+  if not len(nonzero):
+    return PMF([0.0])
+  max_count = int(nonzero[-1])
+  mass = float(counts.sum())
+  length = max_count * (len(item) - 1) + 1
+  if choose_method(max_count * len(item), len(item)) == 'direct':
+    values = _compound_direct(counts[:max_count + 1], item, length)
+  else:
+    values = _compound_fft(counts[:max_count + 1], item, length)
+  return PMF(clean(values, mass).tolist())
+
+
+def _compound_direct(counts, item, length):
+  values = np.zeros(length)
+  power = np.ones(1)
+  for count, prob in enumerate(counts):
+    if count:
+      power = np.convolve(power, item)
+    if prob:
+      values[:len(power)] += prob * power
+  return values
+
+
+def _compound_fft(counts, item, length):
+  # Evaluate the count generating function at the item's spectrum (Horner), so
+  # every dice count shares a single forward and inverse transform
+  size = sp_fft.next_fast_len(length, real=True)
+  spectrum = sp_fft.rfft(item, size)
+  total = np.full(size // 2 + 1, counts[-1], dtype=complex)
+  for prob in counts[-2::-1]:
+    total = total * spectrum + prob
+  return sp_fft.irfft(total, size)[:length]
@@ -1,3 +1,5 @@
+import functools
+
 import dash
 import dash_daq
 import re
@@ -9,6 +11,21 @@ from .graph_layout import GraphLayout
 from .input_layout import InputLayout
 
 
+# Page trees only depend on the tab and weapon counts, build each one once
+PAGE_CACHE = {}
+
+
+def memoized_page(method):
+  @functools.wraps(method)
+  def wrapper(self):
+    key = (method.__name__, self.tab_count, self.weapon_count)
+    page = PAGE_CACHE.get(key)
+    if page is None:
+      page = PAGE_CACHE[key] = method(self)
+    return page
+  return wrapper
+
+
 class Layout(object):
   def __init__(self, tab_count=0, weapon_count=0):
     self.tab_count = tab_count
@@ -20,6 +37,7 @@ class Layout(object):
       html.Div(id='page_content')
     ])
 
+  @memoized_page
   def base_layout(self):
     return html.Div(
       [
@@ -28,7 +46,10 @@ class Layout(object):
         self.base_title(),
         dbc.Row(
           dbc.Col(
-            GraphLayout(self.tab_count).layout(),
+            [
+              GraphLayout(self.tab_count).layout(),
+              *GraphLayout(self.tab_count).stores(),
+            ],
             className='portlet-container portlet-dropzone',
           ),
           style={'align-items': 'center'},
@@ -37,7 +58,10 @@ class Layout(object):
         dbc.Row(
           [
             dbc.Col(
-              InputLayout(self.tab_count, self.weapon_count).layout(),
+              [
+                InputLayout(self.tab_count, self.weapon_count).layout(),
+                *InputLayout(self.tab_count, self.weapon_count).stores(),
+              ],
             ),
           ]
         ),
@@ -62,6 +86,7 @@ class Layout(object):
     )
     return dbc.CardBody(dbc.Row([dbc.Col(content)], className="mb-2 ",))
 
+  @memoized_page
   def static_layout(self):
     return html.Div(
       [
@@ -88,6 +113,7 @@ class Layout(object):
       ],
     )
 
+  @memoized_page
   def embed_layout(self):
     return html.Div(
       [
@@ -2,6 +2,7 @@
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 
+from ..metrics import timed
 from ...constants import TAB_COUNT, GA_TRACKING_ID, TAB_COLOURS, DEFAULT_GRAPH_PLOTS
 
 
@@ -33,6 +34,9 @@ class GraphLayout(object):
     )
     return content
 
+  def stores(self):
+    return [dcc.Store(id=f'tabgraph_{i}') for i in range(self.tab_count)]
+
   def _tab_info(self, tab_id, callback, average, std):
     tab_inputs = callback.tab_inputs[tab_id]
     ''''damagemods': ['addvol_d6'], 'fnpmods': ['fnpadd_2'], 'hitmods': ['reroll_ones'], 'savemods': ['normaldrone'], 'shotmods': ['reroll_ones'], 'shots': '2d6', 'strength': '4', 'weaponenabled': 'enabled', 'woundmods': ['add_2']'''
@@ -61,13 +65,16 @@ class GraphLayout(object):
         tab_inputs['invuln'],
         tab_inputs['fnp'],
         tab_inputs['wounds'],
-        round(average, 2),
-        round(std, 2),
+        self._format_stat(average),
+        self._format_stat(std),
       ),
       dbc.Col(weapon_rows),
     ], className='mb-2',)
 
 
+  def _format_stat(self, value):
+    return value if isinstance(value, str) else round(value, 2)
+
   def _tab_output(self, name, points, average, std):
     return [
       dbc.Col(self._make_group(self._output_pill('Name', name))),
@@ -169,6 +176,7 @@ class GraphLayout(object):
     )
     return content
 
+  @timed('figure')
   def figure_template(self, data=None, max_len=10, dtick=None, title=None, static=False, top=50):
     return {
       'data': data or DEFAULT_GRAPH_PLOTS,
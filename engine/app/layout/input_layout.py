@@ -5,7 +5,7 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 
-from ...constants import TAB_COLOURS
+from ...constants import TAB_COLOURS, TARGET_PRESETS
 
 
 FOOTER_CONTENT = '''
@@ -60,6 +60,15 @@ class InputLayout(object):
       style={'padding-top': '4px', 'padding-bottom': '0px'},
     )
 
+  def stores(self):
+    # The preset buttons are handled in the browser, from this table
+    return [
+      dcc.Store(
+        id='target_presets',
+        data={preset_id: values for preset_id, _, values in TARGET_PRESETS},
+      ),
+    ]
+
 
 class InputTabLayout(object):
   def __init__(self, tab_id, tab_count=0, weapon_count=0):
@@ -177,18 +186,8 @@ class InputTabLayout(object):
   def _target_input_row(self):
     presets = dbc.DropdownMenu(
       [
-        dbc.DropdownMenuItem("Guardsmen", id=f'guardsman_{self.tab_id}'),
-        dbc.DropdownMenuItem("Ork Boyz", id=f'ork_boy_{self.tab_id}'),
-        dbc.DropdownMenuItem("Shield Drone", id=f'shield_drone_{self.tab_id}'),
-        dbc.DropdownMenuItem("Tactical Marine", id=f'tactical_marine_{self.tab_id}'),
-        dbc.DropdownMenuItem("Intercessor", id=f'intercessor_{self.tab_id}'),
-        dbc.DropdownMenuItem("Terminator", id=f'terminator_{self.tab_id}'),
-        dbc.DropdownMenuItem("Crisis Suit", id=f'crisis_suit_{self.tab_id}'),
-        dbc.DropdownMenuItem("Custode", id=f'custode_{self.tab_id}'),
-        dbc.DropdownMenuItem("Riptide", id=f'riptide_{self.tab_id}'),
-        dbc.DropdownMenuItem("Rhino", id=f'rhino_{self.tab_id}'),
-        dbc.DropdownMenuItem("Leman Russ", id=f'leman_russ_{self.tab_id}'),
-        dbc.DropdownMenuItem("Knight", id=f'knight_{self.tab_id}'),
+        dbc.DropdownMenuItem(label, id=f'{preset_id}_{self.tab_id}')
+        for preset_id, label, _ in TARGET_PRESETS
       ],
       label="Presets",
       bs_size='sm',
@@ -589,119 +588,159 @@ class WeaponTabLayout(object):
     ]
 
   def _shot_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_allvol'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dicevol'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-      {'label': f'Roll two dice choose highest', 'value': f'reroll_melta'},
-      {'label': f'Add +D6', 'value': f'addvol_d6'},
-      {'label': f'Add +D3', 'value': f'addvol_d3'},
-    ]
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i}', 'value': f'addvol_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i}', 'value': f'subvol_{i}'})
-    return options
+    return MODIFIER_DEFAULTS['shotmods']
 
   def _hit_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_all'},
-      {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-      {'label': f'Suffer MW on a hit roll of 1', 'value': f'overheat'},
-    ]
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i}', 'value': f'add_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i}', 'value': f'sub_{i}'})
-    for x in ['MW', 'hits', 'shots']:
-      for i in range(1, 7):
-        for j in range(2, 7):
-          options.append({'label': f'+{i} {x} on a {j}+', 'value': f'addon_{i}_{x}_{j}_mod'})
-    for x in ['MW', 'hits', 'shots']:
-      for i in range(1, 7):
-        for j in range(2, 7):
-          values = ', '.join([str(x) for x in range(j, 7)])
-          options.append({'label': f'+{i} {x} on a {values}', 'value': f'addon_{i}_{x}_{j}'})
-    return options
+    return MODIFIER_DEFAULTS['hitmods']
 
   def _wound_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_all'},
-      {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-      {'label': f'Haywire', 'value': f'haywire'},
-    ]
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i}', 'value': f'add_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i}', 'value': f'sub_{i}'})
-    # for i in range(2, 7):
-    #   options.append({'label': f'Only wound on {i}+', 'value': f'lower_{i}'})
-    for x in ['MW', 'wounds']:
-      for i in range(1, 7):
-        for j in range(2, 7):
-          options.append({'label': f'+{i} {x} on a {j}+', 'value': f'addon_{i}_{x}_{j}_mod'})
-    for x in ['MW', 'wounds']:
-      for i in range(1, 7):
-        for j in range(2, 7):
-          values = ', '.join([str(x) for x in range(j, 7)])
-          options.append({'label': f'+{i} {x} on a {values}', 'value': f'addon_{i}_{x}_{j}'})
-    return options
+    return MODIFIER_DEFAULTS['woundmods']
 
   def _save_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_all'},
-      {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-      {'label': f'Ignore invulnerable', 'value': f'ignoreinv'},
-      {'label': f'Saviour Protocol', 'value': f'normaldrone'},
-      {'label': f'Saviour Protocol (Shield)', 'value': f'shielddrone'},
-    ]
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i} to save', 'value': f'saveadd_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i} to save', 'value': f'savesub_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i} to invuln', 'value': f'invadd_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i} to invuln', 'value': f'invsub_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Ignore AP -{i} and lower', 'value': f'ignoreap_{i}'})
-    return options
+    return MODIFIER_DEFAULTS['savemods']
 
   def _fnp_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_all'},
-      {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-    ]
-    for i in range(1, 7):
-      options.append({'label': f'Add +{i} to FNP', 'value': f'fnpadd_{i}'})
-    for i in range(1, 7):
-      options.append({'label': f'Sub -{i} to FNP', 'value': f'fnpsub_{i}'})
-    return options
+    return MODIFIER_DEFAULTS['fnpmods']
 
   def _damage_modifier_options(self):
-    options = [
-      {'label': f'Reroll all dice', 'value': f'reroll_allvol'},
-      {'label': f'Reroll one dice', 'value': f'reroll_one_dicevol'},
-      {'label': f'Reroll ones', 'value': f'reroll_ones'},
-      {'label': f'Roll two dice choose highest', 'value': f'reroll_melta'},
-      {'label': f'Half damage (rounding up)', 'value': f'halfdam'},
-      {'label': f'Add +D6', 'value': f'addvol_d6'},
-      {'label': f'Add +D3', 'value': f'addvol_d3'},
-    ]
+    return MODIFIER_DEFAULTS['damagemods']
+
+
+def shot_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_allvol'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dicevol'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+    {'label': f'Roll two dice choose highest', 'value': f'reroll_melta'},
+    {'label': f'Add +D6', 'value': f'addvol_d6'},
+    {'label': f'Add +D3', 'value': f'addvol_d3'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i}', 'value': f'addvol_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i}', 'value': f'subvol_{i}'})
+  return options
+
+
+def hit_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_all'},
+    {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+    {'label': f'Suffer MW on a hit roll of 1', 'value': f'overheat'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i}', 'value': f'add_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i}', 'value': f'sub_{i}'})
+  for x in ['MW', 'hits', 'shots']:
     for i in range(1, 7):
-      options.append({'label': f'Add +{i}', 'value': f'addvol_{i}'})
+      for j in range(2, 7):
+        options.append({'label': f'+{i} {x} on a {j}+', 'value': f'addon_{i}_{x}_{j}_mod'})
+  for x in ['MW', 'hits', 'shots']:
     for i in range(1, 7):
-      options.append({'label': f'Sub -{i}', 'value': f'subvol_{i}'})
-    for i in range(2, 7):
-      options.append({'label': f'Minimum {i} damage', 'value': f'minval_{i}'})
-    return options
-
-
+      for j in range(2, 7):
+        values = ', '.join([str(x) for x in range(j, 7)])
+        options.append({'label': f'+{i} {x} on a {values}', 'value': f'addon_{i}_{x}_{j}'})
+  return options
+
+
+def wound_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_all'},
+    {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+    {'label': f'Haywire', 'value': f'haywire'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i}', 'value': f'add_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i}', 'value': f'sub_{i}'})
+  # for i in range(2, 7):
+  #   options.append({'label': f'Only wound on {i}+', 'value': f'lower_{i}'})
+  for x in ['MW', 'wounds']:
+    for i in range(1, 7):
+      for j in range(2, 7):
+        options.append({'label': f'+{i} {x} on a {j}+', 'value': f'addon_{i}_{x}_{j}_mod'})
+  for x in ['MW', 'wounds']:
+    for i in range(1, 7):
+      for j in range(2, 7):
+        values = ', '.join([str(x) for x in range(j, 7)])
+        options.append({'label': f'+{i} {x} on a {values}', 'value': f'addon_{i}_{x}_{j}'})
+  return options
+
+
+def save_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_all'},
+    {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+    {'label': f'Ignore invulnerable', 'value': f'ignoreinv'},
+    {'label': f'Saviour Protocol', 'value': f'normaldrone'},
+    {'label': f'Saviour Protocol (Shield)', 'value': f'shielddrone'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i} to save', 'value': f'saveadd_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i} to save', 'value': f'savesub_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i} to invuln', 'value': f'invadd_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i} to invuln', 'value': f'invsub_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Ignore AP -{i} and lower', 'value': f'ignoreap_{i}'})
+  return options
+
+
+def fnp_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_all'},
+    {'label': f'Reroll failed dice', 'value': f'reroll_failed'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dice'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i} to FNP', 'value': f'fnpadd_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i} to FNP', 'value': f'fnpsub_{i}'})
+  return options
+
+
+def damage_modifier_options():
+  options = [
+    {'label': f'Reroll all dice', 'value': f'reroll_allvol'},
+    {'label': f'Reroll one dice', 'value': f'reroll_one_dicevol'},
+    {'label': f'Reroll ones', 'value': f'reroll_ones'},
+    {'label': f'Roll two dice choose highest', 'value': f'reroll_melta'},
+    {'label': f'Half damage (rounding up)', 'value': f'halfdam'},
+    {'label': f'Add +D6', 'value': f'addvol_d6'},
+    {'label': f'Add +D3', 'value': f'addvol_d3'},
+  ]
+  for i in range(1, 7):
+    options.append({'label': f'Add +{i}', 'value': f'addvol_{i}'})
+  for i in range(1, 7):
+    options.append({'label': f'Sub -{i}', 'value': f'subvol_{i}'})
+  for i in range(2, 7):
+    options.append({'label': f'Minimum {i} damage', 'value': f'minval_{i}'})
+  return options
+
+
+# Built once per process and shared by every weapon's dropdowns
+MODIFIER_OPTIONS = {
+  'shotmods': shot_modifier_options(),
+  'hitmods': hit_modifier_options(),
+  'woundmods': wound_modifier_options(),
+  'savemods': save_modifier_options(),
+  'fnpmods': fnp_modifier_options(),
+  'damagemods': damage_modifier_options(),
+}
+
+# What the dropdowns ship with, the generated addon options are only sent as
+# search results or once selected
+MODIFIER_DEFAULTS = {
+  field: [x for x in options if not x['value'].startswith('addon_')]
+  for field, options in MODIFIER_OPTIONS.items()
+}
@@ -0,0 +1,323 @@
+"""Callback timings, cache hit rates and payload sizes in the Prometheus text format.
+
+Every gunicorn worker keeps its own registry and labels its series with its
+pid, so a scrape reads whichever worker answered it. Aggregate with
+sum by (le) (rate(...)) before histogram_quantile to get fleet wide p50/p99.
+"""
+import bisect
+import functools
+import hmac
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Response, g, request
+
+from .cache import LRUCache, canonical_key
+from .profiling import PROFILER
+
+
+TIME_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The callback or URL rule the current request is running, and the stages
+# already open in it so nested stages of the same name are only counted once
+CURRENT_ROUTE = ContextVar('metrics_route', default='none')
+OPEN_STAGES = ContextVar('metrics_stages', default=())
+STAGE_TOTALS = ContextVar('metrics_totals', default=None)
+
+
+def escape(value):
+  return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+  kind = None
+
+  def __init__(self, name, documentation, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def _key(self, labels):
+    return tuple(str(labels[x]) for x in self.labelnames)
+
+  def header(self):
+    return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+  def render(self, const_labels=()):
+    lines = self.header()
+    with self._lock:
+      items = sorted(self._values.items())
+    for key, value in items:
+      lines.extend(self.samples(tuple(zip(self.labelnames, key)) + const_labels, value))
+    return lines
+
+  def samples(self, labels, value):
+    return [f'{self.name}{format_labels(labels)} {format_value(value)}']
+
+
+class Counter(Metric):
+  kind = 'counter'
+
+  def inc(self, amount=1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+  kind = 'histogram'
+
+  def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    key = self._key(labels)
+    with self._lock:
+      counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+      counts[bisect.bisect_left(self.buckets, value)] += 1
+      self._values[key] = (counts, total + value)
+
+  def samples(self, labels, value):
+    counts, total = value
+    lines = []
+    cumulative = 0
+    for bound, count in zip(self.buckets + (float('inf'),), counts):
+      cumulative += count
+      bucket_labels = labels + (('le', format_value(float(bound))),)
+      lines.append(f'{self.name}_bucket{format_labels(bucket_labels)} {cumulative}')
+    lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(total)}')
+    lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+    return lines
+
+
+class CacheMetrics(object):
+  """Reads the hit and miss counters of the registered caches at scrape time."""
+  def __init__(self):
+    self.caches = {}
+
+  def add(self, name, cache):
+    self.caches[name] = cache
+
+  def render(self, const_labels=()):
+    stats = {name: cache.stats() for name, cache in self.caches.items()}
+    lines = []
+    for field, kind, documentation in [
+      ('hits', 'counter', 'Cache lookups that found an entry.'),
+      ('misses', 'counter', 'Cache lookups that found nothing.'),
+      ('hit_rate', 'gauge', 'Hits over lookups since the worker started.'),
+      ('entries', 'gauge', 'Entries currently held.'),
+      ('bytes', 'gauge', 'Estimated bytes currently held.'),
+    ]:
+      name = f'whstats_cache_{field}' + ('_total' if kind == 'counter' else '')
+      values = [(cache, x[field]) for cache, x in stats.items() if field in x]
+      if not values:
+        continue
+      lines.extend([f'# HELP {name} {documentation}', f'# TYPE {name} {kind}'])
+      for cache, value in values:
+        lines.append(f'{name}{format_labels((("cache", cache),) + const_labels)} {format_value(value)}')
+    return lines
+
+
+class MetricsRegistry(object):
+  def __init__(self):
+    self.metrics = []
+    self.caches = CacheMetrics()
+
+  def register(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def render(self):
+    const_labels = (('pid', os.getpid()),)
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.render(const_labels))
+    lines.extend(self.caches.render(const_labels))
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+  'whstats_stage_seconds',
+  'Time spent in each stage of a callback or request.',
+  ['route', 'stage'],
+))
+CALLBACK_SECONDS = REGISTRY.register(Histogram(
+  'whstats_callback_seconds',
+  'Time to run and serialize a Dash callback.',
+  ['callback'],
+))
+CALLBACK_ERRORS = REGISTRY.register(Counter(
+  'whstats_callback_errors_total',
+  'Dash callbacks that raised, PreventUpdate included.',
+  ['callback', 'error'],
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+  'whstats_request_seconds',
+  'Time to answer an HTTP request, by URL rule.',
+  ['route', 'method', 'status'],
+))
+REQUEST_BYTES = REGISTRY.register(Histogram(
+  'whstats_request_bytes',
+  'Size of request bodies, by URL rule.',
+  ['route'],
+  buckets=SIZE_BUCKETS,
+))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+  'whstats_response_bytes',
+  'Size of responses, by URL rule or Dash callback.',
+  ['route'],
+  buckets=SIZE_BUCKETS,
+))
+
+
+@contextmanager
+def stage(name):
+  """Time the block as stage `name` of the current route."""
+  open_stages = OPEN_STAGES.get()
+  if name in open_stages:
+    yield
+    return
+  token = OPEN_STAGES.set(open_stages + (name,))
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, route=CURRENT_ROUTE.get(), stage=name)
+    OPEN_STAGES.reset(token)
+    totals = STAGE_TOTALS.get()
+    if totals is not None:
+      totals[name] = totals.get(name, 0.0) + elapsed
+
+
+def timed(name):
+  """Decorator form of stage()."""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with stage(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def timed_callback(app, name, outputs, inputs, states=(), memoize=0):
+  """app.callback that also records the callback as route `name`.
+
+  Dash serializes the outputs after the callback returns, inside the function
+  it dispatches to, so that function is swapped in app.callback_map for one
+  that times the whole dispatch; what the handler itself did not spend is
+  reported as the "serialize" stage. Slow and sampled dispatches go through
+  the profiler as well.
+
+  memoize=N keeps the serialized responses for the last N distinct inputs,
+  for callbacks whose outputs depend on nothing else.
+  """
+  def decorator(func):
+    def handler(*args, **kwargs):
+      with stage('handler'):
+        return func(*args, **kwargs)
+    dispatch = app.callback(outputs, inputs, states)(handler)
+    responses = LRUCache(max_entries=memoize) if memoize else None
+    if responses is not None:
+      REGISTRY.caches.add(f'{name}_responses', responses)
+
+    def callback(*args, **kwargs):
+      route_token = CURRENT_ROUTE.set(name)
+      stages_token = OPEN_STAGES.set(())
+      totals_token = STAGE_TOTALS.set({})
+      start = time.perf_counter()
+      try:
+        key = canonical_key(args, kwargs.get('outputs_list')) if responses is not None else None
+        response = responses.get(key) if key is not None else None
+        if response is None:
+          response = PROFILER.call(name, dispatch, *args, stages=STAGE_TOTALS.get(), **kwargs)
+          if key is not None:
+            responses.set(key, response)
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed - STAGE_TOTALS.get().get('handler', 0.0), route=name, stage='serialize')
+        RESPONSE_BYTES.observe(len(response), route=name)
+        return response
+      except Exception as error:
+        CALLBACK_ERRORS.inc(callback=name, error=type(error).__name__)
+        raise
+      finally:
+        CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=name)
+        STAGE_TOTALS.reset(totals_token)
+        OPEN_STAGES.reset(stages_token)
+        CURRENT_ROUTE.reset(route_token)
+
+    for entry in app.callback_map.values():
+      if entry.get('callback') is dispatch:
+        entry['callback'] = callback
+    return dispatch
+  return decorator
+
+
+class MetricsEndpoint(object):
+  """Times every request of the Flask server and serves the registry on /metrics."""
+  def __init__(self, server, registry=REGISTRY, token=None):
+    self.server = server
+    self.registry = registry
+    self.token = token
+
+  def register(self):
+    self.server.before_request(self._start)
+    self.server.after_request(self._finish)
+    self.server.add_url_rule('/metrics', 'metrics', self.metrics_view, methods=['GET'])
+
+  def metrics_view(self):
+    if self.token:
+      expected = f'Bearer {self.token}'
+      if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(self.registry.render(), content_type=CONTENT_TYPE)
+
+  def _route(self):
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+  def _start(self):
+    g.metrics_start = time.perf_counter()
+    CURRENT_ROUTE.set(self._route())
+    OPEN_STAGES.set(())
+    STAGE_TOTALS.set({})
+
+  def _finish(self, response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+      return response
+    route = self._route()
+    REQUEST_SECONDS.observe(
+      time.perf_counter() - start,
+      route=route,
+      method=request.method,
+      status=response.status_code,
+    )
+    if request.content_length:
+      REQUEST_BYTES.observe(request.content_length, route=route)
+    if not response.is_streamed:
+      RESPONSE_BYTES.observe(response.calculate_content_length() or 0, route=route)
+    return response
@@ -0,0 +1,72 @@
+"""Server side search over the modifier dropdown options.
+
+The dropdowns only ship MODIFIER_DEFAULTS; the generated addon options (a few
+hundred per weapon) are sent back as the user types, from a prefix index over
+the tokens of each option's label and value.
+"""
+import re
+
+from .layout.input_layout import MODIFIER_OPTIONS, MODIFIER_DEFAULTS
+from ..constants import MODIFIER_SEARCH_LIMIT
+
+
+# Close to how the dropdown filters options on the client, so what the server
+# sends back is not hidden again by the browser
+TOKEN_PATTERN = re.compile(r"[^a-z0-9\-']+")
+
+
+def tokenize(text):
+  return [x for x in TOKEN_PATTERN.split(str(text).lower()) if x]
+
+
+class ModifierSearch(object):
+  """Options of one modifier field, searchable by token prefix."""
+  def __init__(self, options, defaults, limit=MODIFIER_SEARCH_LIMIT):
+    self.options = options
+    self.defaults = defaults
+    self.limit = limit
+    self.positions = {x['value']: i for i, x in enumerate(options)}
+    self.default_values = {x['value'] for x in defaults}
+    # token prefix -> positions of the options with a token starting with it
+    self.prefixes = {}
+    for position, option in enumerate(options):
+      for token in tokenize(option['label']) + tokenize(option['value']):
+        for end in range(1, len(token) + 1):
+          self.prefixes.setdefault(token[:end], set()).add(position)
+
+  def search(self, query):
+    """Positions of the options matching every word of the query in catalogue order, None without words."""
+    matches = None
+    for token in tokenize(query):
+      positions = self.prefixes.get(token, set())
+      matches = positions if matches is None else matches & positions
+      if not matches:
+        return []
+    return sorted(matches)[:self.limit] if matches is not None else None
+
+  def options_for(self, query=None, selected=None):
+    """The dropdown options for a search, the defaults without one.
+
+    Selected values always stay in the options, the dropdown drops any value
+    it has no option for.
+    """
+    positions = self.search(query) if query else None
+    options = list(self.defaults) if positions is None else [self.options[x] for x in positions]
+    shown = {x['value'] for x in options}
+    for value in selected or []:
+      if value not in shown and value in self.positions:
+        options.append(self.options[self.positions[value]])
+        shown.add(value)
+    return options
+
+  def needs_update(self, query=None, selected=None):
+    """False when the defaults the dropdown shipped with already cover it."""
+    return bool(query) or any(x not in self.default_values for x in selected or [])
+
+
+# Only the fields with options left out of their defaults need searching
+MODIFIER_SEARCH = {
+  field: ModifierSearch(options, MODIFIER_DEFAULTS[field])
+  for field, options in MODIFIER_OPTIONS.items()
+  if len(options) != len(MODIFIER_DEFAULTS[field])
+}
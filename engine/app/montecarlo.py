@@ -0,0 +1,149 @@
+import re
+
+import numpy as np
+
+from warhammer_stats.pmf import PMF
+
+from . import tables
+
+
+def parse_dice(value):
+  """(number, faces, constant) of a dice string like '2d6' or '3'."""
+  value = str(value or 1).strip().lower()
+  if value.isdigit():
+    return 0, 0, int(value)
+  match = re.match(r'(?P<number>\d+)?d(?P<faces>\d+)', value)
+  if not match:
+    return 0, 0, 0
+  return int(match.group('number') or 1), int(match.group('faces')), 0
+
+
+def roll_dice(rng, dice, size):
+  number, faces, constant = dice
+  if not number:
+    return np.full(size, constant, dtype=np.int64)
+  return rng.integers(1, faces + 1, size=(size, number)).sum(axis=1)
+
+
+class AttackSampler(object):
+  """Rolls whole attack sequences, one row per attack.
+
+  Every stage sees the actual dice of the stages before it, so rules that
+  feed one roll into the next (rend, exploding hits and the like) only need
+  to override the stage they change, e.g. save_thresholds for rend.
+  """
+  def __init__(self, inputs):
+    self.inputs = inputs
+    self.shots = parse_dice(inputs['shots'])
+    self.damage = parse_dice(inputs['damage'])
+    self.max_shots = max(self.shots[0] * self.shots[1], self.shots[2])
+    self.max_damage = max(self.damage[0] * self.damage[1], self.damage[2])
+
+  @property
+  def max_total(self):
+    return self.max_shots * min(self.max_damage, max(self.inputs['wounds'], 1))
+
+  def hit_threshold(self):
+    # A BS of 1 always hits, otherwise a 1 always misses
+    ws = self.inputs['ws']
+    return 1 if ws <= 1 else max(ws, 2)
+
+  def wound_threshold(self):
+    return tables.wound_threshold(self.inputs['strength'], self.inputs['toughness'])
+
+  def save_thresholds(self, wound_rolls):
+    save = max(self.inputs['save'] + self.inputs['ap'], 2)
+    return np.full(wound_rolls.shape, min(save, max(self.inputs['invuln'], 2)))
+
+  def sample(self, rng, size):
+    """Total damage of size independent attacks."""
+    shots = roll_dice(rng, self.shots, size)
+    width = max(int(shots.max()), 1)
+    fired = np.arange(width)[None, :] < shots[:, None]
+
+    hit_rolls = rng.integers(1, 7, size=(size, width))
+    hits = fired & (hit_rolls >= self.hit_threshold())
+    wound_rolls = rng.integers(1, 7, size=(size, width))
+    wounds = hits & (wound_rolls >= self.wound_threshold())
+    save_rolls = rng.integers(1, 7, size=(size, width))
+    unsaved = wounds & (save_rolls < self.save_thresholds(wound_rolls))
+
+    rows = np.nonzero(unsaved)[0]
+    damage = roll_dice(rng, self.damage, len(rows))
+    damage = rng.binomial(damage, float(tables.fnp_probability(self.inputs['fnp'])))
+    damage = np.minimum(damage, max(self.inputs['wounds'], 1))
+    return np.bincount(rows, weights=damage, minlength=size).astype(np.int64)
+
+
+def _sample_counts(inputs, size, seed, sampler_class=AttackSampler):
+  """Histogram of size sampled attacks, run in a worker process."""
+  sampler = sampler_class(inputs)
+  totals = sampler.sample(np.random.default_rng(seed), size)
+  return np.bincount(totals, minlength=sampler.max_total + 1)
+
+
+class MonteCarloResults(object):
+  def __init__(self, counts, seed, z=1.96):
+    self.counts = counts
+    self.samples = int(counts.sum())
+    self.seed = seed
+    self.z = z
+
+    self.values = counts / self.samples
+    support = np.arange(len(counts))
+    self.mean = float(self.values @ support)
+    self.std = float(max(self.values @ support**2 - self.mean**2, 0) ** 0.5)
+
+  @property
+  def mean_interval(self):
+    error = self.z * self.std / self.samples**0.5
+    return self.mean - error, self.mean + error
+
+  def cumulative_interval(self):
+    """Wilson score interval of P(total >= x) at every x."""
+    cumulative = self.values[::-1].cumsum()[::-1]
+    n, z = self.samples, self.z
+    centre = (cumulative + z**2 / (2 * n)) / (1 + z**2 / n)
+    spread = z * np.sqrt(cumulative * (1 - cumulative) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    return np.clip(centre - spread, 0, 1), np.clip(centre + spread, 0, 1)
+
+  @property
+  def dists(self):
+    body = np.nonzero(self.counts)[0]
+    values = self.values[:body[-1] + 1 if len(body) else 1]
+    zero = PMF.static(0)
+    return [PMF(values.tolist()), zero, zero]
+
+
+class MonteCarloEngine(object):
+  """Samples attacks in seeded batches, optionally spread over a process pool.
+
+  Each batch draws from its own child of one SeedSequence, so a given seed and
+  sample count give the same histogram whatever the number of workers.
+  """
+  def __init__(self, pool=None, samples=10**6, batch_size=10**5, max_cells=4 * 10**6):
+    self.pool = pool
+    self.samples = samples
+    self.batch_size = batch_size
+    self.max_cells = max_cells
+
+  def batches(self, sampler, samples):
+    # Keep every batch's dice arrays to roughly max_cells entries
+    size = max(min(self.batch_size, self.max_cells // max(sampler.max_shots, 1)), 1)
+    return [min(size, samples - start) for start in range(0, samples, size)]
+
+  def run(self, inputs, samples=None, seed=None, sampler_class=AttackSampler):
+    samples = samples or self.samples
+    seed_sequence = np.random.SeedSequence(seed)
+    sampler = sampler_class(inputs)
+    sizes = self.batches(sampler, samples)
+    seeds = seed_sequence.spawn(len(sizes))
+    args = [(inputs, size, child, sampler_class) for size, child in zip(sizes, seeds)]
+    if self.pool is not None and self.pool.enabled and len(args) > 1:
+      histograms = list(self.pool.executor.map(_sample_counts, *zip(*args)))
+    else:
+      histograms = [_sample_counts(*x) for x in args]
+    counts = np.zeros(sampler.max_total + 1, dtype=np.int64)
+    for histogram in histograms:
+      counts[:len(histogram)] += histogram
+    return MonteCarloResults(counts, seed_sequence.entropy)
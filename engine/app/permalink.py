@@ -0,0 +1,302 @@
+"""Versioned binary permalinks, /static?p=<base64url>.
+
+Version 1 layout, every integer a LEB128 varint:
+
+  version, tab_count, weapon_count
+  tab mask                           bit t set for each tab with fields
+  per tab:    field mask, weapon mask over TAB_FIELDS and its weapons
+  per weapon: field mask over WEAPON_FIELDS
+  the values of every set field, in mask order
+  global field count, then (name, value) pairs
+
+A value is one varint h followed by its payload, by h % 4:
+
+  0  None
+  1  the integer zigzag(h // 4), for ints and canonical decimal strings
+  2  a string of h // 4 '_' separated tokens
+  3  a list of h // 4 such strings, for modifiers
+
+A token is a varint c: c % 3 == 0 is the integer c // 3, 1 the word
+WORDS[c // 3] and 2 a literal of c // 3 UTF-8 bytes that follow. Field lists
+and WORDS are frozen per version; new fields or words need a new version.
+Queries in the older field=value format (full or minified) still decode.
+"""
+import base64
+import logging
+
+from urllib.parse import urlparse, parse_qsl
+
+from .scenario import MISSING, ScenarioSpec, field_index
+
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+PARAM = 'p'
+# Bounds the field indexes a crafted link can make us build
+MAX_TABS = 16
+MAX_WEAPONS = 16
+
+TAB_FIELDS = ['enabled', 'tabname', 'points', 'toughness', 'save', 'invuln', 'fnp', 'wounds']
+WEAPON_FIELDS = [
+  'weaponenabled', 'ws', 'strength', 'ap', 'shots', 'damage',
+  'shotmods', 'hitmods', 'woundmods', 'savemods', 'fnpmods', 'damagemods', 'weaponname',
+]
+WORDS = [
+  'enabled', 'disabled', 'Profile', 'Weapon', 'title',
+  'd3', 'd6', '2d3', '2d6', '3d3', '3d6', '4d6',
+  'reroll', 'all', 'allvol', 'one', 'dice', 'dicevol', 'ones', 'failed', 'melta',
+  'add', 'sub', 'addvol', 'subvol', 'addon', 'mod', 'MW', 'hits', 'shots', 'wounds',
+  'overheat', 'haywire', 'halfdam', 'minval', 'lower',
+  'ignoreinv', 'ignoreap', 'normaldrone', 'shielddrone',
+  'saveadd', 'savesub', 'invadd', 'invsub', 'fnpadd', 'fnpsub',
+]
+WORD_CODES = {x: i for i, x in enumerate(WORDS)}
+SMALL_INTS = {x: str((x // 4) // 2 if (x // 4) % 2 == 0 else -(x // 4 + 1) // 2) for x in range(1, 0x80, 4)}
+
+
+class PermalinkError(ValueError):
+  pass
+
+
+class Writer(object):
+  def __init__(self):
+    self.buffer = bytearray()
+
+  def varint(self, value):
+    while value >= 0x80:
+      self.buffer.append((value & 0x7f) | 0x80)
+      value >>= 7
+    self.buffer.append(value)
+
+  def mask(self, flags):
+    self.varint(sum(1 << i for i, x in enumerate(flags) if x))
+
+  def token(self, token):
+    if _is_int(token) and not token.startswith('-'):
+      self.varint(3 * int(token))
+    elif token in WORD_CODES:
+      self.varint(3 * WORD_CODES[token] + 1)
+    else:
+      data = token.encode('utf-8')
+      self.varint(3 * len(data) + 2)
+      self.buffer += data
+
+  def tokens(self, value):
+    for token in value.split('_'):
+      self.token(token)
+
+  def value(self, value):
+    if value is None:
+      self.varint(0)
+    elif isinstance(value, bool):
+      self.value(str(value))
+    elif isinstance(value, int) or (isinstance(value, str) and _is_int(value)):
+      number = int(value)
+      self.varint(4 * (2 * number if number >= 0 else -2 * number - 1) + 1)
+    elif isinstance(value, (list, tuple)):
+      self.varint(4 * len(value) + 3)
+      for item in value:
+        item = str(item)
+        self.varint(item.count('_') + 1)
+        self.tokens(item)
+    else:
+      value = str(value)
+      self.varint(4 * (value.count('_') + 1) + 2)
+      self.tokens(value)
+
+
+class Reader(object):
+  def __init__(self, data):
+    self.data = data
+    self.offset = 0
+
+  def varint(self):
+    if self.offset < len(self.data) and self.data[self.offset] < 0x80:
+      self.offset += 1
+      return self.data[self.offset - 1]
+    value = 0
+    shift = 0
+    while True:
+      if self.offset >= len(self.data) or shift > 63:
+        raise PermalinkError('Truncated permalink')
+      byte = self.data[self.offset]
+      self.offset += 1
+      value |= (byte & 0x7f) << shift
+      if not byte & 0x80:
+        return value
+      shift += 7
+
+  def mask(self, size):
+    value = self.varint()
+    return [bool(value >> i & 1) for i in range(size)]
+
+  def token(self):
+    code = self.varint()
+    kind, payload = code % 3, code // 3
+    if kind == 0:
+      return str(payload)
+    if kind == 1:
+      if payload >= len(WORDS):
+        raise PermalinkError('Unknown word in permalink')
+      return WORDS[payload]
+    end = self.offset + payload
+    if end > len(self.data):
+      raise PermalinkError('Truncated permalink')
+    token = self.data[self.offset:end].decode('utf-8')
+    self.offset = end
+    return token
+
+  def tokens(self, count):
+    return '_'.join(self.token() for _ in range(count))
+
+  def value(self):
+    code = self.varint()
+    kind, payload = code % 4, code // 4
+    if kind == 0:
+      return None
+    if kind == 1:
+      # Decoded the way a field=value query would give it
+      return str(payload // 2 if payload % 2 == 0 else -(payload + 1) // 2)
+    if kind == 2:
+      return self.tokens(payload)
+    return [self.tokens(self.varint()) for _ in range(payload)]
+
+
+def _is_int(value):
+  digits = value[1:] if value.startswith('-') else value
+  return digits.isdigit() and digits.isascii() and str(int(value)) == value
+
+
+class PermalinkCodec(object):
+  """Encodes a ScenarioSpec as a short URL safe token and back."""
+  def __init__(self):
+    self._slot_tables = {}
+
+  def slot_table(self, index):
+    """Slots of TAB_FIELDS and WEAPON_FIELDS for every tab and weapon, None where the index has no such field."""
+    key = (index.tab_count, index.weapon_count)
+    if key not in self._slot_tables:
+      slots = index.slots
+      self._slot_tables[key] = [
+        (
+          [slots.get(f'{x}_{tab_id}') for x in TAB_FIELDS],
+          [[slots.get(f'{x}_{tab_id}_{weapon_id}') for x in WEAPON_FIELDS] for weapon_id in range(index.weapon_count)],
+        )
+        for tab_id in range(index.tab_count)
+      ]
+    return self._slot_tables[key]
+
+  def encode(self, spec):
+    index = spec.index
+    values = spec.values
+    writer = Writer()
+    writer.varint(VERSION)
+    writer.varint(index.tab_count)
+    writer.varint(index.weapon_count)
+
+    tabs = []
+    for tab_slots, weapon_slots in self.slot_table(index):
+      fields = [x if x is not None and values[x] is not MISSING else None for x in tab_slots]
+      weapons = []
+      for slots in weapon_slots:
+        weapon_fields = [x if x is not None and values[x] is not MISSING else None for x in slots]
+        weapons.append(weapon_fields if any(x is not None for x in weapon_fields) else None)
+      present = any(x is not None for x in fields) or any(weapons)
+      tabs.append((fields, weapons) if present else None)
+
+    writer.mask(tabs)
+    present_slots = []
+    for tab in filter(None, tabs):
+      fields, weapons = tab
+      writer.mask([x is not None for x in fields])
+      writer.mask(weapons)
+      present_slots += [x for x in fields if x is not None]
+      for weapon_fields in filter(None, weapons):
+        writer.mask([x is not None for x in weapon_fields])
+        present_slots += [x for x in weapon_fields if x is not None]
+    for slot in present_slots:
+      writer.value(values[slot])
+
+    writer.varint(len(spec.global_fields))
+    for name, value in spec.global_fields.items():
+      writer.value(str(name))
+      writer.value(value)
+    return base64.urlsafe_b64encode(bytes(writer.buffer)).rstrip(b'=').decode('ascii')
+
+  def decode(self, token):
+    """The ScenarioSpec of a token, PermalinkError for anything malformed."""
+    try:
+      return self._decode(token)
+    except PermalinkError:
+      raise
+    except Exception as error:
+      raise PermalinkError(f'Malformed permalink: {type(error).__name__}') from error
+
+  def _decode(self, token):
+    try:
+      data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+      raise PermalinkError('Permalink is not base64url')
+    reader = Reader(data)
+    version = reader.varint()
+    if version != VERSION:
+      raise PermalinkError(f'Unknown permalink version {version}')
+    tab_count = reader.varint()
+    weapon_count = reader.varint()
+    if not (0 < tab_count <= MAX_TABS and 0 < weapon_count <= MAX_WEAPONS):
+      raise PermalinkError('Permalink tab or weapon count out of range')
+    spec = ScenarioSpec(field_index(tab_count, weapon_count))
+    slot_table = self.slot_table(spec.index)
+
+    present_slots = []
+    for tab_id, tab_present in enumerate(reader.mask(tab_count)):
+      if not tab_present:
+        continue
+      tab_slots, weapon_slots = slot_table[tab_id]
+      present_slots += [x for x, y in zip(tab_slots, reader.mask(len(TAB_FIELDS))) if y]
+      for weapon_id, weapon_present in enumerate(reader.mask(weapon_count)):
+        if weapon_present:
+          present_slots += [x for x, y in zip(weapon_slots[weapon_id], reader.mask(len(WEAPON_FIELDS))) if y]
+    values = spec.values
+    data_length = len(data)
+    for slot in present_slots:
+      # Most values are a single byte small int, skip the general reader for those
+      offset = reader.offset
+      code = data[offset] if offset < data_length else 0x80
+      if code < 0x80 and code % 4 == 1:
+        reader.offset = offset + 1
+        value = SMALL_INTS[code]
+      else:
+        value = reader.value()
+      if slot is not None:
+        values[slot] = value
+
+    for _ in range(reader.varint()):
+      name = reader.value()
+      if not isinstance(name, str):
+        raise PermalinkError('Permalink field name is not a string')
+      spec.global_fields[name] = reader.value()
+    if reader.offset != len(data):
+      raise PermalinkError('Trailing bytes in permalink')
+    return spec
+
+  def decode_query(self, query, index=None):
+    """The scenario of a permalink query, binary or field=value."""
+    params = dict(parse_qsl(query))
+    token = params.pop(PARAM, None)
+    if token is not None:
+      try:
+        spec = self.decode(token)
+        spec.global_fields.update(params)
+        return spec
+      except PermalinkError as error:
+        logger.info('Ignoring bad permalink: %s', error)
+        params[PARAM] = token
+    return ScenarioSpec.from_fields(index or field_index(), params, split_mods=True)
+
+  def decode_url(self, url, index=None):
+    return self.decode_query(urlparse(url).query, index)
+
+
+PERMALINK_CODEC = PermalinkCodec()
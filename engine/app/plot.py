@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class PlotEncoder(object):
+  """Shrinks a curve to what can actually be seen on the graph.
+
+  Values are rounded to display precision, the inner points of flat runs are
+  dropped (a straight line between the run's ends draws the same thing) and
+  whatever is left is resampled evenly along the curve's length so no trace
+  ever carries more than max_points points.
+  """
+  def __init__(self, max_points=400, x_decimals=4, y_decimals=2):
+    self.max_points = max_points
+    self.x_decimals = x_decimals
+    self.y_decimals = y_decimals
+
+  def encode(self, x, y):
+    x = np.round(np.asarray(x, dtype=float), self.x_decimals)
+    y = np.round(np.asarray(y, dtype=float), self.y_decimals)
+    keep = self.flat_mask(y)
+    x, y = x[keep], y[keep]
+    if len(x) > self.max_points:
+      index = self.resample(x, y)
+      x, y = x[index], y[index]
+    return x, y
+
+  def flat_mask(self, y):
+    """Keep only the first and last point of each run of equal values."""
+    keep = np.ones(len(y), dtype=bool)
+    if len(y) > 2:
+      keep[1:-1] = (y[1:-1] != y[:-2]) | (y[1:-1] != y[2:])
+    return keep
+
+  def resample(self, x, y):
+    # Measure the curve in axis fractions so both directions count equally
+    dx = np.diff(x) / max(x[-1] - x[0], 1e-12)
+    dy = np.diff(y) / max(y.max() - y.min(), 1e-12)
+    length = np.concatenate([[0.0], np.cumsum(np.hypot(dx, dy))])
+    targets = np.linspace(0, length[-1], self.max_points)
+    index = np.unique(np.clip(np.searchsorted(length, targets), 0, len(x) - 1))
+    index[0], index[-1] = 0, len(x) - 1
+    return index
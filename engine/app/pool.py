@@ -0,0 +1,102 @@
+import os
+import threading
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+from warhammer_stats.pmf import PMF
+
+
+def pack_dists(dists):
+  """Copy PMF values into a new shared memory block, returning (name, lengths)."""
+  values = [np.asarray(x.values, dtype=float) for x in dists]
+  lengths = [len(x) for x in values]
+  block = shared_memory.SharedMemory(create=True, size=max(sum(lengths), 1) * 8)
+  try:
+    np.ndarray((sum(lengths),), dtype=float, buffer=block.buf)[:] = np.concatenate(values)
+    return block.name, lengths
+  finally:
+    block.close()
+
+
+def unpack_dists(name, lengths):
+  """Read back the PMFs written by pack_dists and free the block."""
+  block = shared_memory.SharedMemory(name=name)
+  try:
+    flat = np.ndarray((sum(lengths),), dtype=float, buffer=block.buf).copy()
+  finally:
+    block.close()
+    block.unlink()
+  bounds = np.cumsum([0] + lengths)
+  return [PMF(flat[a:b].tolist()) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+_WORKER_CONTROLLER = None
+
+
+def _run_worker(inputs):
+  global _WORKER_CONTROLLER
+  if _WORKER_CONTROLLER is None:
+    from .util import ComputeController
+    _WORKER_CONTROLLER = ComputeController()
+  return pack_dists(_WORKER_CONTROLLER.run(inputs).dists)
+
+
+class ComputePool(object):
+  """Runs attack sequences in a persistent process pool.
+
+  Results come back through shared memory rather than being pickled, and in
+  the order they were submitted. With no workers everything runs in-process.
+  """
+  def __init__(self, workers=0):
+    self.workers = workers
+    self._executor = None
+    self._pid = None
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self):
+    return self.workers > 1
+
+  @property
+  def executor(self):
+    # A pool does not survive a fork, so each gunicorn worker gets its own
+    with self._lock:
+      if self._executor is None or self._pid != os.getpid():
+        # Start the tracker before forking so workers and parent share it,
+        # otherwise blocks unlinked here are reported as leaked there
+        resource_tracker.ensure_running()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._pid = os.getpid()
+      return self._executor
+
+  def run_many(self, compute_controller, inputs_list):
+    """Dists of compute_controller.run(inputs) for each inputs, in order."""
+    if not self.enabled or len(inputs_list) < 2:
+      return [compute_controller.run(x).dists for x in inputs_list]
+    futures = [self.executor.submit(_run_worker, x) for x in inputs_list]
+    # Every finished block has to be unpacked, and so unlinked, even when
+    # another one failed, or it stays in /dev/shm
+    wait(futures)
+    results = []
+    error = None
+    for future in futures:
+      try:
+        results.append(unpack_dists(*future.result()))
+      except Exception as future_error:
+        error = error or future_error
+    if error is not None:
+      if isinstance(error, BrokenProcessPool):
+        self.reset()
+      raise error
+    return results
+
+  def reset(self):
+    """Drop a broken executor, the next call starts a new one."""
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor is not None:
+      executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,140 @@
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from flask import has_request_context, request
+
+from ..constants import TAB_COUNT, WEAPON_COUNT
+from ..constants import PROFILE_SLOW_SECONDS, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_MAX_FILES
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileDirectory(object):
+  """pstats dumps in a local directory, oldest removed past max_files."""
+  def __init__(self, path, max_files=50):
+    self.path = path
+    self.max_files = max_files
+    self._sequence = itertools.count()
+
+  def write(self, profile, name, seconds):
+    os.makedirs(self.path, exist_ok=True)
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+    filename = f'{stamp}-{os.getpid()}-{next(self._sequence)}-{name}-{int(seconds * 1000)}ms.pstats'
+    path = os.path.join(self.path, filename)
+    pstats.Stats(profile).dump_stats(path)
+    self.rotate()
+    return path
+
+  def rotate(self):
+    dumps = sorted(
+      (os.path.join(self.path, x) for x in os.listdir(self.path) if x.endswith('.pstats')),
+      key=os.path.getmtime,
+    )
+    for path in dumps[:max(len(dumps) - self.max_files, 0)]:
+      try:
+        os.remove(path)
+      except OSError:
+        # Another worker rotated it first
+        pass
+
+
+class CallbackProfiler(object):
+  """Logs slow Dash callbacks and runs a sampled fraction of them under cProfile.
+
+  Slow callbacks get a single JSON log line holding the callback inputs as a
+  minified permalink query, so the page can be opened again as
+  /static?<query>. Only one callback per process is profiled at a time, the
+  others just run while it does, so a low sample rate is cheap enough to leave
+  on.
+  """
+  def __init__(self, slow_seconds=PROFILE_SLOW_SECONDS, sample_rate=PROFILE_SAMPLE_RATE, directory=None):
+    self.slow_seconds = slow_seconds
+    self.sample_rate = sample_rate
+    self.directory = directory or ProfileDirectory(PROFILE_DIR, PROFILE_MAX_FILES)
+    self._lock = threading.Lock()
+    self._url_minify = None
+
+  @property
+  def url_minify(self):
+    if self._url_minify is None:
+      # util imports metrics, which imports this module
+      from .util import URLMinify
+      self._url_minify = URLMinify(TAB_COUNT, WEAPON_COUNT)
+    return self._url_minify
+
+  def call(self, name, func, *args, stages=None, **kwargs):
+    profile = self._start_profile()
+    start = time.perf_counter()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      seconds = time.perf_counter() - start
+      path = None
+      if profile is not None:
+        profile.disable()
+        self._lock.release()
+        path = self._write(profile, name, seconds)
+      if self.slow_seconds > 0 and seconds >= self.slow_seconds:
+        self.log_slow(name, seconds, path, stages)
+
+  def log_slow(self, name, seconds, profile_path=None, stages=None):
+    entry = {
+      'event': 'slow_callback',
+      'callback': name,
+      'seconds': round(seconds, 4),
+      'threshold': self.slow_seconds,
+      'pid': os.getpid(),
+      'stages': {k: round(v, 4) for k, v in (stages or {}).items()},
+      'query': self.input_state(),
+      'profile': profile_path,
+    }
+    logger.warning('%s', json.dumps(entry, sort_keys=True))
+
+  def input_state(self):
+    """Inputs of the current Dash request as a minified permalink query."""
+    if not has_request_context():
+      return None
+    body = request.get_json(silent=True) or {}
+    fields = {}
+    for item in (body.get('inputs') or []) + (body.get('state') or []):
+      if not isinstance(item, dict) or not isinstance(item.get('id'), str):
+        continue
+      value = item.get('value')
+      if value in (None, '', []):
+        continue
+      fields[self.url_minify.minify(item['id'])] = ','.join(map(str, value)) if isinstance(value, list) else value
+    return urlencode(sorted(fields.items()))
+
+  def _start_profile(self):
+    if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+      return None
+    if not self._lock.acquire(blocking=False):
+      return None
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:
+      # Something else, a debugger say, already profiles this thread
+      self._lock.release()
+      return None
+    return profile
+
+  def _write(self, profile, name, seconds):
+    try:
+      return self.directory.write(profile, name, seconds)
+    except OSError as error:
+      logger.warning('Could not write profile: %s', error)
+      return None
+
+
+PROFILER = CallbackProfiler()
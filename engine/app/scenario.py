@@ -0,0 +1,160 @@
+"""Flat input ids of the layout, decoded once into slots of a compact scenario.
+
+Every callback, permalink and API request names its fields the way the layout
+does (toughness_0, ws_0_1, or minified t_0, ws_0_1). FieldIndex resolves each
+of those ids to a slot with a single dict lookup, and ScenarioSpec keeps the
+values of one request in a list indexed by slot, so nothing is pattern matched
+per request.
+"""
+import functools
+
+from .util import InputGenerator, URLMinify, MOD_FIELDS
+from ..constants import TAB_COUNT, WEAPON_COUNT
+
+
+# Not a graph input, but carried by the layout and the API
+EXTRA_WEAPON_FIELDS = ['weaponname']
+
+MISSING = object()
+
+
+class FieldIndex(object):
+  """Slot of every tab and weapon input id, full and minified."""
+  def __init__(self, tab_count, weapon_count):
+    self.tab_count = tab_count
+    self.weapon_count = weapon_count
+    self.url_minify = URLMinify(tab_count, weapon_count)
+
+    # slot -> (field_name, tab_id, weapon_id), weapon_id None for tab fields
+    self.fields = []
+    self.field_ids = []
+    self.slots = {}
+    to_min = self.url_minify.to_min()
+    for field_id in self._field_ids(tab_count, weapon_count):
+      field_name, tab_id, weapon_id = self._split(field_id)
+      self.slots[field_id] = len(self.fields)
+      self.slots.setdefault(to_min.get(field_id, field_id), len(self.fields))
+      self.fields.append((field_name, tab_id, weapon_id))
+      self.field_ids.append(field_id)
+    self.min_ids = [to_min.get(x, x) for x in self.field_ids]
+    self.splits = [x[0] in MOD_FIELDS for x in self.fields]
+
+  def __len__(self):
+    return len(self.fields)
+
+  def decode(self, field_id):
+    """(field_name, tab_id, weapon_id) of a full or minified id, None for globals."""
+    slot = self.slots.get(field_id)
+    return None if slot is None else self.fields[slot]
+
+  def encode(self, slot, minify=False):
+    return self.min_ids[slot] if minify else self.field_ids[slot]
+
+  def _field_ids(self, tab_count, weapon_count):
+    field_ids = [x for x in InputGenerator(tab_count, weapon_count).graph_inputs() if '_' in x]
+    for tab_id in range(tab_count):
+      for weapon_id in range(weapon_count):
+        field_ids += [f'{x}_{tab_id}_{weapon_id}' for x in EXTRA_WEAPON_FIELDS]
+    return field_ids
+
+  def _split(self, field_id):
+    field_name, *ids = field_id.split('_')
+    return field_name, int(ids[0]), int(ids[1]) if len(ids) > 1 else None
+
+
+@functools.lru_cache(maxsize=32)
+def field_index(tab_count=TAB_COUNT, weapon_count=WEAPON_COUNT):
+  return FieldIndex(tab_count, weapon_count)
+
+
+class ScenarioSpec(object):
+  """The input values of one request, by slot of a FieldIndex.
+
+  Ids the index does not know (url, title, ...) are kept as global fields.
+  """
+  __slots__ = ('index', 'values', 'global_fields')
+
+  def __init__(self, index, values=None, global_fields=None):
+    self.index = index
+    self.values = values if values is not None else [MISSING] * len(index)
+    self.global_fields = global_fields if global_fields is not None else {}
+
+  @classmethod
+  def from_fields(cls, index, fields, split_mods=False):
+    """Decode {field_id: value}, splitting comma separated modifiers when they come from a URL."""
+    spec = cls(index)
+    slots = index.slots
+    values = spec.values
+    for field_id, value in fields.items():
+      slot = slots.get(field_id)
+      if slot is None:
+        spec.global_fields[field_id] = value
+      elif split_mods and index.splits[slot] and isinstance(value, str):
+        values[slot] = value.split(',')
+      else:
+        values[slot] = value
+    return spec
+
+  def update(self, other):
+    for slot, value in enumerate(other.values):
+      if value is not MISSING:
+        self.values[slot] = value
+    self.global_fields.update(other.global_fields)
+    return self
+
+  def get(self, field_id, default=None):
+    slot = self.index.slots.get(field_id)
+    if slot is None:
+      return self.global_fields.get(field_id, default)
+    value = self.values[slot]
+    return default if value is MISSING else value
+
+  def items(self, minify=False):
+    """(field_id, value) of every value that was given."""
+    for slot, value in enumerate(self.values):
+      if value is not MISSING:
+        yield self.index.encode(slot, minify), value
+
+  def tabs(self, tree=None, wrap=None):
+    """Nested {tab_id: {field: value, 'weapons': {weapon_id: {field: value}}}}.
+
+    With wrap the fields sit one level down, under tree[...][wrap], the shape
+    CallbackMapper hands its controllers. Fills and returns tree when given.
+    """
+    tree = {} if tree is None else tree
+    fields = self.index.fields
+    for slot, value in enumerate(self.values):
+      if value is MISSING:
+        continue
+      field_name, tab_id, weapon_id = fields[slot]
+      target = tree.get(tab_id)
+      if target is None:
+        target = tree[tab_id] = {}
+      if weapon_id is not None:
+        target = target.setdefault('weapons', {}).setdefault(weapon_id, {})
+      if wrap is not None:
+        target = target.setdefault(wrap, {})
+      target[field_name] = value
+    return tree
+
+  def key(self):
+    """Hashable and stable across equivalent inputs, full or minified, in any order."""
+    return (
+      self.index.tab_count,
+      self.index.weapon_count,
+      tuple(self._hashable(x) for x in self.values),
+      tuple(sorted((k, self._hashable(v)) for k, v in self.global_fields.items())),
+    )
+
+  def _hashable(self, value):
+    if value is MISSING:
+      return None
+    if isinstance(value, list):
+      return tuple(value)
+    return value
+
+  def __eq__(self, other):
+    return isinstance(other, ScenarioSpec) and self.key() == other.key()
+
+  def __hash__(self):
+    return hash(self.key())
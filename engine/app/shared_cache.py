@@ -0,0 +1,309 @@
+import logging
+import os
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from array import array
+from urllib.parse import urlparse, unquote
+
+from warhammer_stats.pmf import PMF
+
+
+logger = logging.getLogger(__name__)
+
+
+def engine_version():
+  try:
+    from importlib.metadata import version
+    return version('warhammer-stats')
+  except Exception:
+    pass
+  try:
+    import pkg_resources
+    return pkg_resources.get_distribution('warhammer-stats').version
+  except Exception:
+    return 'unknown'
+
+
+class PMFCodec(object):
+  """Packs a list of PMFs into a zlib compressed blob.
+
+  Each PMF is stored as its leading zero count, its length and the remaining
+  float64 values, so static and right-shifted distributions cost almost nothing.
+  """
+  magic = b'PMF1'
+
+  def encode(self, pmfs):
+    parts = [self.magic, struct.pack('<H', len(pmfs))]
+    for pmf in pmfs:
+      values = list(pmf.values)
+      offset = 0
+      while offset < len(values) - 1 and values[offset] == 0:
+        offset += 1
+      body = array('d', values[offset:])
+      if sys.byteorder == 'big':
+        body.byteswap()
+      parts.append(struct.pack('<II', offset, len(body)))
+      parts.append(body.tobytes())
+    return zlib.compress(b''.join(parts))
+
+  def decode(self, blob):
+    data = zlib.decompress(blob)
+    if data[:4] != self.magic:
+      raise ValueError('Unknown PMF encoding')
+    count, = struct.unpack_from('<H', data, 4)
+    position = 6
+    pmfs = []
+    for _ in range(count):
+      offset, length = struct.unpack_from('<II', data, position)
+      position += 8
+      body = array('d')
+      body.frombytes(data[position:position + 8 * length])
+      if sys.byteorder == 'big':
+        body.byteswap()
+      position += 8 * length
+      pmfs.append(PMF([0.0] * offset + body.tolist()))
+    return pmfs
+
+
+class NullBackend(object):
+  def get(self, key):
+    return None
+
+  def set(self, key, value, ttl=None):
+    pass
+
+
+class SQLiteBackend(object):
+  """Cache backed by a single SQLite file, shared by every worker on the host."""
+  def __init__(self, path, max_rows=50000):
+    self.path = path
+    self.max_rows = max_rows
+    self._local = threading.local()
+    self._writes = 0
+
+  @property
+  def connection(self):
+    # Connections must not cross a fork, so key them on the pid as well as the thread
+    if getattr(self._local, 'pid', None) != os.getpid():
+      connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+      connection.execute('PRAGMA journal_mode=WAL')
+      connection.execute('PRAGMA synchronous=NORMAL')
+      connection.execute(
+        'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)'
+      )
+      self._local.connection = connection
+      self._local.pid = os.getpid()
+    return self._local.connection
+
+  def get(self, key):
+    row = self.connection.execute(
+      'SELECT value, expires FROM cache WHERE key = ?', (key,)
+    ).fetchone()
+    if row is None:
+      return None
+    value, expires = row
+    if expires is not None and expires < time.time():
+      return None
+    return bytes(value)
+
+  def set(self, key, value, ttl=None):
+    expires = time.time() + ttl if ttl else None
+    self.connection.execute(
+      'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+      (key, sqlite3.Binary(value), expires),
+    )
+    self._writes += 1
+    if self._writes % 1000 == 0:
+      self.prune()
+
+  def prune(self):
+    self.connection.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+    self.connection.execute(
+      'DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY expires DESC LIMIT ?)',
+      (self.max_rows,),
+    )
+
+
+class RedisBackend(object):
+  """Minimal RESP client, so any Redis compatible server (or a local fake) will do."""
+  def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=0.5):
+    self.host = host
+    self.port = port
+    self.db = db
+    self.password = password
+    self.timeout = timeout
+    self._lock = threading.Lock()
+    self._socket = None
+    self._reader = None
+    self._pid = None
+
+  @classmethod
+  def from_url(cls, url):
+    parsed = urlparse(url)
+    return cls(
+      host=parsed.hostname or 'localhost',
+      port=parsed.port or 6379,
+      db=int(parsed.path.strip('/') or 0),
+      password=unquote(parsed.password) if parsed.password else None,
+    )
+
+  def get(self, key):
+    return self.command('GET', key)
+
+  def set(self, key, value, ttl=None):
+    if ttl:
+      self.command('SET', key, value, 'EX', int(ttl))
+    else:
+      self.command('SET', key, value)
+
+  def command(self, *args):
+    with self._lock:
+      try:
+        return self._send(args)
+      except (OSError, EOFError):
+        # Stale connection, try once more on a fresh one
+        self.close()
+        return self._send(args)
+
+  def close(self):
+    if self._socket is not None:
+      try:
+        self._socket.close()
+      except OSError:
+        pass
+    self._socket = None
+    self._reader = None
+
+  def _send(self, args):
+    try:
+      if self._socket is None or self._pid != os.getpid():
+        self._connect()
+      self._socket.sendall(self._pack(args))
+      return self._read_reply()
+    except BaseException:
+      # A reply still on its way would be read as the next command's
+      self.close()
+      raise
+
+  def _connect(self):
+    self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+    self._reader = self._socket.makefile('rb')
+    self._pid = os.getpid()
+    if self.password:
+      self._socket.sendall(self._pack(['AUTH', self.password]))
+      self._read_reply()
+    if self.db:
+      self._socket.sendall(self._pack(['SELECT', self.db]))
+      self._read_reply()
+
+  def _pack(self, args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+      if not isinstance(arg, bytes):
+        arg = str(arg).encode('utf-8')
+      parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+  def _read_reply(self):
+    line = self._reader.readline()
+    if not line:
+      raise EOFError('Connection closed by server')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+      return body
+    if kind == b'-':
+      raise RedisError(body.decode('utf-8', 'replace'))
+    if kind == b':':
+      return int(body)
+    if kind == b'$':
+      length = int(body)
+      if length < 0:
+        return None
+      data = self._reader.read(length + 2)
+      return data[:-2]
+    if kind == b'*':
+      length = int(body)
+      if length < 0:
+        return None
+      return [self._read_reply() for _ in range(length)]
+    raise RedisError(f'Unexpected reply {line!r}')
+
+
+class RedisError(Exception):
+  pass
+
+
+def backend_from_url(url):
+  if not url:
+    return NullBackend()
+  parsed = urlparse(url)
+  if parsed.scheme == 'sqlite':
+    return SQLiteBackend(parsed.path or ':memory:')
+  if parsed.scheme in ('redis', 'tcp'):
+    return RedisBackend.from_url(url)
+  raise ValueError(f'Unsupported shared cache url: {url}')
+
+
+class SharedCache(object):
+  """Versioned, cross-worker cache of PMF lists.
+
+  Backend errors are logged and treated as misses; a broken cache must never
+  take a render down with it.
+  """
+  def __init__(self, backend=None, codec=None, namespace='whstats', version=None, ttl=None):
+    self.backend = backend or NullBackend()
+    self.codec = codec or PMFCodec()
+    self.namespace = namespace
+    self.version = version or engine_version()
+    self.ttl = ttl
+
+    self.hits = 0
+    self.misses = 0
+    self.errors = 0
+
+  @property
+  def enabled(self):
+    return not isinstance(self.backend, NullBackend)
+
+  def full_key(self, kind, key):
+    return f'{self.namespace}:{self.version}:{kind}:{key}'
+
+  def get_pmfs(self, kind, key):
+    if not self.enabled:
+      return None
+    try:
+      blob = self.backend.get(self.full_key(kind, key))
+      pmfs = self.codec.decode(blob) if blob else None
+    except Exception as error:
+      self.errors += 1
+      logger.warning('Shared cache read failed: %s', error)
+      pmfs = None
+    if pmfs is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return pmfs
+
+  def set_pmfs(self, kind, key, pmfs):
+    if not self.enabled:
+      return
+    try:
+      self.backend.set(self.full_key(kind, key), self.codec.encode(pmfs), ttl=self.ttl)
+    except Exception as error:
+      self.errors += 1
+      logger.warning('Shared cache write failed: %s', error)
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'errors': self.errors,
+      'hit_rate': self.hits / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,161 @@
+"""Per die success probabilities for every characteristic the inputs offer.
+
+The tables are built once at import and indexed as
+TABLE[reroll, characteristic..., modifier + MOD_OFFSET], so every lookup is a
+single (optionally vectorized) index operation.
+"""
+import numpy as np
+
+
+REROLLS = ['none', 'ones', 'failed', 'all']
+MOD_OFFSET = 6
+MODS = range(-MOD_OFFSET, MOD_OFFSET + 1)
+
+MAX_BS = 7
+MAX_STRENGTH = 20
+MAX_TOUGHNESS = 10
+MAX_SAVE = 7
+MAX_AP = 6
+
+# Characteristics the graph inputs offer, the domain where reading the tables
+# gives the same answer as the attack engine. Wounds have no upper bound.
+INPUT_RANGES = {
+  'ws': (1, MAX_BS),
+  'strength': (1, MAX_STRENGTH),
+  'toughness': (1, MAX_TOUGHNESS),
+  'ap': (0, MAX_AP),
+  'save': (2, MAX_SAVE),
+  'invuln': (2, MAX_SAVE),
+  'fnp': (2, MAX_SAVE),
+  'wounds': (1, None),
+}
+
+
+def success_probability(thresh):
+  return min(max((7 - thresh) / 6, 0.0), 1.0)
+
+
+def reroll_probability(reroll, thresh, mod_thresh):
+  """P(success) of one d6 needing mod_thresh, re-rolled the way warhammer_stats does it."""
+  success = success_probability(mod_thresh)
+  if mod_thresh <= 1:
+    return success
+  if reroll == 'ones':
+    return success + success / 6
+  if reroll == 'failed':
+    # Only dice that failed before modifiers are re-rolled
+    return success + (min(thresh, mod_thresh) - 1) / 6 * success
+  if reroll == 'all':
+    return success + (1 - success) * success
+  return success
+
+
+def wound_threshold(strength, toughness):
+  if strength <= toughness/2.0:
+    return 6
+  elif strength >= toughness*2:
+    return 2
+  elif toughness > strength:
+    return 5
+  elif toughness == strength:
+    return 4
+  return 3
+
+
+def _build_hit_table():
+  table = np.zeros((len(REROLLS), MAX_BS + 1, len(MODS)))
+  for r, reroll in enumerate(REROLLS):
+    for bs in range(1, MAX_BS + 1):
+      for m, mod in enumerate(MODS):
+        # A BS of 1 auto hits and ignores modifiers, otherwise a 1 always fails
+        mod_thresh = 1 if bs == 1 else max(bs - mod, 2)
+        table[r, bs, m] = reroll_probability(reroll, bs, mod_thresh)
+  table[:, 0] = table[:, 1]
+  return table
+
+
+def _build_wound_table():
+  table = np.zeros((len(REROLLS), MAX_STRENGTH + 1, MAX_TOUGHNESS + 1, len(MODS)))
+  for r, reroll in enumerate(REROLLS):
+    for strength in range(1, MAX_STRENGTH + 1):
+      for toughness in range(1, MAX_TOUGHNESS + 1):
+        thresh = wound_threshold(strength, toughness)
+        for m, mod in enumerate(MODS):
+          table[r, strength, toughness, m] = reroll_probability(reroll, thresh, max(thresh - mod, 2))
+  table[:, 0] = table[:, 1]
+  table[:, :, 0] = table[:, :, 1]
+  return table
+
+
+def _build_save_table():
+  # Probability the save is failed, so the wound goes through
+  table = np.zeros((len(REROLLS), MAX_SAVE + 1, MAX_SAVE + 1, MAX_AP + 1))
+  for r, reroll in enumerate(REROLLS):
+    for save in range(2, MAX_SAVE + 1):
+      for invuln in range(2, MAX_SAVE + 1):
+        for ap in range(0, MAX_AP + 1):
+          thresh = min(max(save + ap, 2), max(invuln, 2))
+          table[r, save, invuln, ap] = 1 - reroll_probability(reroll, thresh, thresh)
+  table[:, :2] = table[:, 2:3]
+  table[:, :, :2] = table[:, :, 2:3]
+  return table
+
+
+def _build_fnp_table():
+  # Probability a point of damage is not ignored
+  table = np.zeros((len(REROLLS), MAX_SAVE + 1, len(MODS)))
+  for r, reroll in enumerate(REROLLS):
+    for fnp in range(2, MAX_SAVE + 1):
+      for m, mod in enumerate(MODS):
+        thresh = max(fnp - mod, 2)
+        table[r, fnp, m] = 1 - reroll_probability(reroll, thresh, thresh)
+  table[:, :2] = table[:, 2:3]
+  return table
+
+
+HIT_TABLE = _build_hit_table()
+WOUND_TABLE = _build_wound_table()
+SAVE_TABLE = _build_save_table()
+FNP_TABLE = _build_fnp_table()
+
+
+def _reroll_index(reroll):
+  return REROLLS.index(reroll or 'none')
+
+
+def _mod_index(mod):
+  return np.clip(mod, -MOD_OFFSET, MOD_OFFSET) + MOD_OFFSET
+
+
+def hit_probability(bs, mod=0, reroll=None):
+  return HIT_TABLE[_reroll_index(reroll), np.clip(bs, 0, MAX_BS), _mod_index(mod)]
+
+
+def wound_probability(strength, toughness, mod=0, reroll=None):
+  return WOUND_TABLE[
+    _reroll_index(reroll),
+    np.clip(strength, 0, MAX_STRENGTH),
+    np.clip(toughness, 0, MAX_TOUGHNESS),
+    _mod_index(mod),
+  ]
+
+
+def unsaved_probability(save, ap, invuln=7, reroll=None):
+  return SAVE_TABLE[
+    _reroll_index(reroll),
+    np.clip(save, 0, MAX_SAVE),
+    np.clip(invuln, 0, MAX_SAVE),
+    np.clip(ap, 0, MAX_AP),
+  ]
+
+
+def fnp_probability(fnp, mod=0, reroll=None):
+  return FNP_TABLE[_reroll_index(reroll), np.clip(fnp, 0, MAX_SAVE), _mod_index(mod)]
+
+
+def in_domain(inputs):
+  """Whether parsed inputs are all within INPUT_RANGES."""
+  return all(
+    low <= inputs[name] and (high is None or inputs[name] <= high)
+    for name, (low, high) in INPUT_RANGES.items()
+  )
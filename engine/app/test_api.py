@@ -0,0 +1,172 @@
+import os
+import time
+
+import pytest
+
+from flask import Flask
+
+from . import api
+from .api import SimulationAPI, Simulator, _simulate_worker, reset_batch_pool
+from .permalink import PERMALINK_CODEC, PARAM
+from .scenario import ScenarioSpec, field_index
+
+
+WEAPON = {
+  'toughness_0': '4',
+  'save_0': '3',
+  'wounds_0': '2',
+  'ws_0_0': '3',
+  'strength_0_0': '4',
+  'ap_0_0': '1',
+  'shots_0_0': '2d6',
+  'damage_0_0': 'd3',
+}
+
+
+@pytest.fixture
+def client():
+  server = Flask(__name__)
+  SimulationAPI(server, 2, 2).register()
+  return server.test_client()
+
+
+def test_simulate(client):
+  response = client.post('/api/v1/simulate', json=WEAPON)
+  assert response.status_code == 200
+  tab, = response.get_json()['tabs']
+  assert tab['weapons'][0]['mean'] == pytest.approx(tab['mean'])
+  assert tab['mean'] > 0
+
+
+@pytest.mark.parametrize('field, value', [
+  ('shots_0_0', 'd0'),
+  ('damage_0_0', '2d0'),
+  ('shots_0_0', '2d6+1'),
+  ('damage_0_0', ['d3']),
+  ('wounds_0', '-1'),
+  ('wounds_0', '0'),
+  ('points_0', [1]),
+  ('ws_0_0', '0'),
+  ('ws_0_0', '8'),
+  ('strength_0_0', '21'),
+  ('toughness_0', '11'),
+  ('ap_0_0', '-1'),
+  ('save_0', '1'),
+  ('invuln_0', '8'),
+  ('fnp_0', 'x'),
+  ('ws_0_0', {'a': 1}),
+])
+def test_out_of_domain_inputs_are_rejected(client, field, value):
+  response = client.post('/api/v1/simulate', json={**WEAPON, field: value})
+  assert response.status_code == 400
+  assert 'error' in response.get_json()
+
+
+def test_disabled_weapons_are_not_validated(client):
+  fields = {**WEAPON, 'weaponenabled_0_1': 'disabled', 'shots_0_1': 'd0'}
+  assert client.post('/api/v1/simulate', json=fields).status_code == 200
+
+
+def test_get_accepts_permalink_tokens(client):
+  spec = ScenarioSpec.from_fields(field_index(2, 2), WEAPON)
+  token = client.get('/api/v1/simulate', query_string={PARAM: PERMALINK_CODEC.encode(spec), 'pmfs': '0'})
+  fields = client.get('/api/v1/simulate', query_string={**WEAPON, 'pmfs': '0'})
+  posted = client.post('/api/v1/simulate?pmfs=0', json=WEAPON)
+  assert token.status_code == fields.status_code == posted.status_code == 200
+  assert token.get_json() == fields.get_json() == posted.get_json()
+  assert 'pmfs' not in token.get_json()['tabs'][0]
+
+
+def test_get_accepts_minified_fields(client):
+  response = client.get('/api/v1/simulate', query_string={'t_0': '4', 'sh_0_0': '2d6', 'ws_0_0': '3'})
+  assert response.status_code == 200
+  assert response.get_json()['tabs'][0]['mean'] > 0
+
+
+def _crashing_worker(fields, include_pmfs, options):
+  if fields.get('title') == 'crash':
+    os._exit(1)
+  if fields.get('title') == 'slow':
+    time.sleep(0.5)
+  return _simulate_worker(fields, include_pmfs, options)
+
+
+@pytest.fixture
+def simulator():
+  yield Simulator(2, 2)
+  reset_batch_pool()
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+  """The futures of every _submit call, {future: indexes}."""
+  calls = []
+  submit = Simulator._submit
+  def record(self, *args):
+    futures = submit(self, *args)
+    calls.append(futures)
+    return futures
+  monkeypatch.setattr(Simulator, '_submit', record)
+  return calls
+
+
+def by_index(items):
+  return {x['index']: x for x in items}
+
+
+def other(strength):
+  return {**WEAPON, 'strength_0_0': str(strength)}
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_simulate_many_reports_errors_per_item(simulator, workers):
+  scenarios = [WEAPON, 7, {**WEAPON, 'shots_0_0': 'd0'}, {'query': f'{PARAM}=!!!'}, other(5)]
+  items = by_index(simulator.simulate_many(scenarios, workers=workers))
+  assert sorted(items) == [0, 1, 2, 3, 4]
+  assert [('result' in items[i]) for i in range(5)] == [True, False, False, False, True]
+  assert 'weapon 0' in items[2]['error']
+
+
+def test_simulate_many_runs_identical_scenarios_once(simulator, monkeypatch):
+  calls = []
+  simulate = Simulator.simulate
+  def record(self, fields, *args, **kwargs):
+    calls.append(fields)
+    return simulate(self, fields, *args, **kwargs)
+  monkeypatch.setattr(Simulator, 'simulate', record)
+  items = by_index(simulator.simulate_many([WEAPON, other(5), dict(reversed(WEAPON.items())), WEAPON], workers=0))
+  assert len(calls) == 2
+  assert items[0]['result'] == items[2]['result'] == items[3]['result'] != items[1]['result']
+
+
+def test_simulate_many_submits_identical_scenarios_once(simulator, submitted):
+  items = by_index(simulator.simulate_many([WEAPON, other(5), WEAPON, other(5), other(8)], workers=2))
+  futures, = submitted
+  assert sorted(sorted(x) for x in futures.values()) == [[0, 2], [1, 3], [4]]
+  assert items[0]['result'] == items[2]['result']
+  assert items[1]['result'] == items[3]['result'] != items[4]['result']
+
+
+def test_simulate_many_recovers_from_a_dead_worker(simulator, monkeypatch):
+  reset_batch_pool()
+  monkeypatch.setattr(api, '_simulate_worker', _crashing_worker)
+  scenarios = [WEAPON, {**WEAPON, 'title': 'crash'}, other(5)]
+  items = by_index(simulator.simulate_many(scenarios, workers=2))
+  assert sorted(items) == [0, 1, 2]
+  assert 'BrokenProcessPool' in items[1]['error']
+
+  items = by_index(simulator.simulate_many([WEAPON, other(5)], workers=2))
+  assert all('result' in x for x in items.values())
+
+
+def test_simulate_many_cancels_futures_when_the_client_leaves(simulator, submitted, monkeypatch):
+  reset_batch_pool()
+  monkeypatch.setattr(api, '_simulate_worker', _crashing_worker)
+  scenarios = [{**other(x), 'title': 'slow'} for x in range(1, 11)]
+  items = simulator.simulate_many(scenarios, workers=2)
+  next(items)
+  items.close()
+  futures, = submitted
+  # Calls the pool already handed to its workers run on, nothing waits behind them
+  assert all(x.running() or x.done() for x in futures)
+  assert sum(x.cancelled() for x in futures) >= len(futures) // 2
@@ -0,0 +1,82 @@
+import random
+
+import numpy as np
+import pytest
+
+from .batch import BatchEvaluator, TARGET_FIELDS
+from .cache import LRUCache
+from .shared_cache import SharedCache
+from .tables import INPUT_RANGES
+from .util import ComputeController
+
+
+BASE = {'ws': 3, 'strength': 4, 'ap': 1, 'toughness': 4, 'save': 3, 'invuln': 5, 'fnp': 6, 'wounds': 2, 'shots': '2d3', 'damage': 'd3'}
+
+
+@pytest.fixture
+def controller():
+  return ComputeController(cache=LRUCache(), shared_cache=SharedCache())
+
+
+def assert_matches_attack(controller, fields, results):
+  expected = controller.run(controller.parse_inputs(**fields)).total_wounds_dist.values
+  actual = results.total_wounds_dist.values
+  width = max(len(expected), len(actual))
+  np.testing.assert_allclose(
+    np.pad(actual, (0, width - len(actual))),
+    np.pad(expected, (0, width - len(expected))),
+    atol=1e-12,
+  )
+
+
+def boundary_cases():
+  for name, (low, high) in INPUT_RANGES.items():
+    for value in [low, high or 30]:
+      yield {**BASE, name: value}
+
+
+def random_cases(count=40):
+  rng = random.Random(0)
+  for _ in range(count):
+    fields = {
+      name: rng.randint(low, high or 8) for name, (low, high) in INPUT_RANGES.items()
+    }
+    fields['shots'] = rng.choice(['1', '4', 'd3', 'd6', '2d6'])
+    fields['damage'] = rng.choice(['1', '3', 'd3', 'd6', '2d3'])
+    yield fields
+
+
+@pytest.mark.parametrize('fields', [*boundary_cases(), *random_cases()])
+def test_batch_matches_attack_in_domain(controller, fields):
+  inputs = controller.parse_inputs(**fields)
+  assert controller.batched(inputs)
+  assert_matches_attack(controller, fields, controller._run_batch({None: inputs})[None])
+
+
+@pytest.mark.parametrize('name, value', [
+  ('ws', 8), ('ws', 10), ('strength', 25), ('toughness', 12), ('ap', 7),
+  ('save', 1), ('invuln', 1), ('fnp', 1),
+])
+def test_out_of_domain_inputs_run_the_attack_engine(controller, name, value):
+  fields = {**BASE, name: value}
+  assert not controller.batched(controller.parse_inputs(**fields))
+  assert_matches_attack(controller, fields, controller.compute(approximate=None, **fields))
+
+
+@pytest.mark.parametrize('wounds', ['0', '-1', 0])
+def test_wounds_are_at_least_one(controller, wounds):
+  fields = {**BASE, 'wounds': wounds}
+  assert controller.parse_inputs(**fields)['wounds'] == 1
+  results = controller.compute(**fields)
+  assert results.total_wounds_dist.values == controller.compute(**{**BASE, 'wounds': 1}).total_wounds_dist.values
+
+
+def test_evaluate_mixes_batched_and_attack_pairs(controller):
+  weapons = [{k: BASE[k] for k in BASE if k not in TARGET_FIELDS}, {'ws': 8, 'strength': 5, 'shots': 'd6', 'damage': '2'}]
+  targets = [{k: BASE[k] for k in TARGET_FIELDS}, {**{k: BASE[k] for k in TARGET_FIELDS}, 'save': 1}]
+  batch = BatchEvaluator(controller).evaluate(weapons, targets)
+  assert set(batch.fallbacks) == {(0, 1), (1, 0), (1, 1)}
+  for i, weapon in enumerate(weapons):
+    for j, target in enumerate(targets):
+      assert_matches_attack(controller, {**weapon, **target}, batch.results(i, j))
+      assert batch.mean[i, j] == pytest.approx(batch.results(i, j).total_wounds_dist.mean())
@@ -0,0 +1,34 @@
+import pytest
+
+from .complexity import ComplexityError, ComplexityEstimator
+from .util import ComputeController
+
+
+TARGET = {'toughness': 4, 'save': 3, 'wounds': 3}
+
+
+@pytest.fixture
+def controller():
+  return ComputeController()
+
+
+@pytest.mark.parametrize('shots, damage', [('30d6', '1'), ('170', '1'), ('60d6', 'd3')])
+def test_batched_weapons_are_not_approximated(controller, shots, damage):
+  inputs = controller.parse_inputs(**TARGET, ws=3, strength=4, shots=shots, damage=damage)
+  assert controller.approximates(inputs) is False
+
+
+def test_batched_weapons_are_computed_past_the_exact_engine_limit(controller):
+  weapon = {**TARGET, 'ws': 3, 'strength': 4, 'shots': '1000', 'damage': '2'}
+  with pytest.raises(ComplexityError):
+    ComplexityEstimator().check(controller.parse_inputs(**weapon))
+  results = controller.compute(approximate=False, **weapon)
+  assert results.approximate is False
+  assert results.total_wounds_dist.mean() == pytest.approx(1000 * 4 / 6 * 3 / 6 * 2 / 6 * 2)
+
+
+def test_batched_cost_is_still_bounded():
+  estimator = ComplexityEstimator()
+  assert estimator.check({'shots': '3000', 'damage': '10'}, batched=True)
+  with pytest.raises(ComplexityError):
+    estimator.check({'shots': '20000', 'damage': '2'}, batched=True)
@@ -0,0 +1,124 @@
+import base64
+import random
+
+import pytest
+
+from .permalink import PERMALINK_CODEC, PARAM, VERSION, PermalinkError, Writer
+from .scenario import ScenarioSpec, field_index
+
+
+FIELDS = {
+  'enabled_0': 'enabled',
+  'tabname_0': 'Profile 0',
+  'toughness_0': '4',
+  'save_0': '3',
+  'invuln_0': '7',
+  'weaponenabled_0_0': 'enabled',
+  'ws_0_0': '3',
+  'strength_0_0': '-1',
+  'shots_0_0': '2d6',
+  'damage_0_0': 'd3',
+  'hitmods_0_0': ['reroll_ones', 'addon_1_MW_6_mod'],
+  'woundmods_0_0': [],
+  'weaponname_0_0': 'Heavy bolter ünïcode_name',
+  'toughness_1': '007',
+  'tabname_1': None,
+  'title': 'A title',
+}
+
+
+def token(writer):
+  return base64.urlsafe_b64encode(bytes(writer.buffer)).rstrip(b'=').decode('ascii')
+
+
+def header(tab_count=1, weapon_count=1):
+  writer = Writer()
+  writer.varint(VERSION)
+  writer.varint(tab_count)
+  writer.varint(weapon_count)
+  return writer
+
+
+def test_round_trip():
+  spec = ScenarioSpec.from_fields(field_index(), FIELDS)
+  assert PERMALINK_CODEC.decode(PERMALINK_CODEC.encode(spec)) == spec
+
+
+def test_round_trip_other_counts():
+  spec = ScenarioSpec.from_fields(field_index(2, 5), {'shots_1_4': '3d6', 'title': 'x'})
+  decoded = PERMALINK_CODEC.decode(PERMALINK_CODEC.encode(spec))
+  assert decoded == spec
+  assert (decoded.index.tab_count, decoded.index.weapon_count) == (2, 5)
+
+
+def test_empty_round_trip():
+  spec = ScenarioSpec(field_index())
+  assert PERMALINK_CODEC.decode(PERMALINK_CODEC.encode(spec)) == spec
+
+
+def test_legacy_query_matches_binary():
+  query = 'toughness_0=4&ws_0_0=3&hitmods_0_0=reroll_ones,add_1&title=x'
+  legacy = PERMALINK_CODEC.decode_query(query)
+  binary = PERMALINK_CODEC.decode_query(f'{PARAM}={PERMALINK_CODEC.encode(legacy)}')
+  assert binary == legacy
+  assert binary.get('hitmods_0_0') == ['reroll_ones', 'add_1']
+
+
+@pytest.mark.parametrize('bad', [
+  '',
+  '!!!',
+  'AQ',
+  token(header(tab_count=0)),
+  token(header(tab_count=10**6)),
+  PERMALINK_CODEC.encode(ScenarioSpec(field_index())) + 'AA',
+])
+def test_malformed_tokens(bad):
+  with pytest.raises(PermalinkError):
+    PERMALINK_CODEC.decode(bad)
+
+
+def test_unknown_version():
+  writer = Writer()
+  writer.varint(VERSION + 1)
+  with pytest.raises(PermalinkError):
+    PERMALINK_CODEC.decode(token(writer))
+
+
+def test_global_name_must_be_a_string():
+  for name in [['a', 'b'], None]:
+    writer = header()
+    writer.varint(0)
+    writer.varint(1)
+    writer.value(name)
+    writer.value('value')
+    with pytest.raises(PermalinkError):
+      PERMALINK_CODEC.decode(token(writer))
+
+
+def test_bad_token_falls_back_to_legacy_fields():
+  writer = header()
+  writer.varint(0)
+  writer.varint(1)
+  writer.value(['a'])
+  writer.value('value')
+  spec = PERMALINK_CODEC.decode_query(f'{PARAM}={token(writer)}&toughness_0=5')
+  assert spec.get('toughness_0') == '5'
+  assert spec.get(PARAM) == token(writer)
+
+
+def test_mutated_tokens_only_raise_permalink_errors():
+  data = bytearray(base64.urlsafe_b64decode(
+    PERMALINK_CODEC.encode(ScenarioSpec.from_fields(field_index(), FIELDS)) + '==='
+  ))
+  rng = random.Random(0)
+  for _ in range(2000):
+    mutated = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+      mutated[rng.randrange(len(mutated))] = rng.randrange(256)
+    mutated = mutated[:rng.randint(1, len(mutated))]
+    bad = base64.urlsafe_b64encode(bytes(mutated)).decode('ascii')
+    try:
+      PERMALINK_CODEC.decode(bad)
+    except PermalinkError:
+      pass
+    PERMALINK_CODEC.decode_query(f'{PARAM}={bad}')
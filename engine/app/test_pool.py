@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+
+from concurrent.futures.process import BrokenProcessPool
+
+from . import pool as pool_module
+from .pool import ComputePool, pack_dists, unpack_dists, _run_worker
+from .util import ComputeController
+
+
+SHM = '/dev/shm'
+INPUTS = {
+  'ws': 3, 'strength': 4, 'ap': 1, 'toughness': 4, 'save': 3, 'invuln': 7, 'fnp': 7, 'wounds': 2,
+  'shots': '2d6', 'damage': 'd3',
+  'shotmods': [], 'hitmods': [], 'woundmods': [], 'savemods': [], 'fnpmods': [], 'damagemods': [],
+}
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(SHM), reason='needs /dev/shm to look for leaks')
+
+
+def _crashing_worker(inputs):
+  if inputs['shots'] == 'crash':
+    time.sleep(0.5)
+    os._exit(1)
+  return _run_worker(inputs)
+
+
+def blocks():
+  return set(os.listdir(SHM))
+
+
+@pytest.fixture
+def pool():
+  pool = ComputePool(2)
+  yield pool
+  pool.reset()
+
+
+def test_results_come_back_in_order(pool):
+  controller = ComputeController()
+  inputs_list = [{**INPUTS, 'shots': str(x)} for x in range(1, 5)]
+  before = blocks()
+  dists = pool.run_many(controller, inputs_list)
+  assert [x[0].values for x in dists] == [controller.run(x).total_wounds_dist.values for x in inputs_list]
+  assert blocks() <= before
+
+
+def test_failed_task_does_not_leak_blocks(pool):
+  before = blocks()
+  # The attack engine fails on targets without wounds
+  inputs_list = [INPUTS, {**INPUTS, 'wounds': -1}, {**INPUTS, 'shots': '3'}]
+  with pytest.raises(IndexError):
+    pool.run_many(ComputeController(), inputs_list)
+  assert blocks() <= before
+
+
+def test_dead_worker_does_not_leak_blocks(pool, monkeypatch):
+  monkeypatch.setattr(pool_module, '_run_worker', _crashing_worker)
+  before = blocks()
+  with pytest.raises(BrokenProcessPool):
+    pool.run_many(ComputeController(), [INPUTS, {**INPUTS, 'shots': 'crash'}, {**INPUTS, 'shots': '3'}])
+  assert blocks() <= before
+  # The next call gets a new executor
+  assert len(pool.run_many(ComputeController(), [INPUTS, {**INPUTS, 'shots': '3'}])) == 2
+
+
+def test_pack_round_trip():
+  dists = ComputeController().run(INPUTS).dists
+  assert [x.values for x in unpack_dists(*pack_dists(dists))] == [x.values for x in dists]
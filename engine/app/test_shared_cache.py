@@ -0,0 +1,150 @@
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from warhammer_stats.pmf import PMF
+
+from .shared_cache import RedisBackend, RedisError, SharedCache
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+  """Enough of a Redis server for RedisBackend: GET, SET [EX], SELECT and AUTH.
+
+  Replies to keys in `delays` are held back that many seconds, and `offset`
+  moves the clock used for expiry forward.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self):
+    super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+    self.data = {}
+    self.delays = {}
+    self.offset = 0
+    self.connections = 0
+    self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+  @property
+  def port(self):
+    return self.server_address[1]
+
+  def now(self):
+    return time.time() + self.offset
+
+  def execute(self, args):
+    name = args[0].upper()
+    if name in (b'SELECT', b'AUTH'):
+      return b'+OK\r\n'
+    if name == b'SET':
+      expires = self.now() + int(args[4]) if len(args) > 4 and args[3].upper() == b'EX' else None
+      self.data[args[1]] = (args[2], expires)
+      return b'+OK\r\n'
+    if name == b'GET':
+      time.sleep(self.delays.get(args[1], 0))
+      value, expires = self.data.get(args[1], (None, None))
+      if value is None or (expires is not None and expires <= self.now()):
+        return b'$-1\r\n'
+      return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'-ERR unknown command\r\n'
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    self.server.connections += 1
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      args = []
+      for _ in range(int(line[1:-2])):
+        length = int(self.rfile.readline()[1:-2])
+        args.append(self.rfile.read(length + 2)[:-2])
+      try:
+        self.wfile.write(self.server.execute(args))
+      except OSError:
+        return
+
+
+@pytest.fixture
+def server():
+  server = FakeRedis()
+  server.thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+
+def backend(server, timeout=0.5):
+  return RedisBackend(port=server.port, db=1, password='secret', timeout=timeout)
+
+
+def test_get_and_set(server):
+  redis = backend(server)
+  assert redis.get('missing') is None
+  redis.set('key', b'\x00value\r\n')
+  assert redis.get('key') == b'\x00value\r\n'
+  assert server.connections == 1
+
+
+def test_expiry(server):
+  redis = backend(server)
+  redis.set('short', b'a', ttl=10)
+  redis.set('forever', b'b')
+  assert redis.get('short') == b'a'
+  server.offset = 11
+  assert redis.get('short') is None
+  assert redis.get('forever') == b'b'
+
+
+def test_error_reply(server):
+  with pytest.raises(RedisError):
+    backend(server).command('NOPE')
+
+
+def test_reconnects_after_server_closes(server):
+  redis = backend(server)
+  redis.set('key', b'a')
+  redis._socket.shutdown(socket.SHUT_RDWR)
+  assert redis.get('key') == b'a'
+  assert server.connections == 2
+
+
+def test_timeout_during_reply_does_not_shift_replies(server):
+  redis = backend(server, timeout=0.1)
+  redis.set('slow', b'slow value')
+  redis.set('fast', b'fast value')
+  server.delays[b'slow'] = 0.3
+  with pytest.raises(OSError):
+    redis.get('slow')
+  assert redis._socket is None
+  # The late replies to the slow GETs must not be read as this one's
+  assert redis.get('fast') == b'fast value'
+
+
+def test_reconnects_after_fork(server):
+  redis = backend(server)
+  redis.set('key', b'parent')
+  pid = os.fork()
+  if pid == 0:
+    try:
+      ok = redis.get('key') == b'parent' and redis._pid == os.getpid()
+      redis.set('key', b'child')
+    finally:
+      os._exit(0 if ok else 1)
+  _, status = os.waitpid(pid, 0)
+  assert os.WEXITSTATUS(status) == 0
+  assert server.connections == 2
+  assert redis.get('key') == b'child'
+
+
+def test_shared_cache_round_trip(server):
+  cache = SharedCache(backend(server), version='test', ttl=60)
+  pmfs = [PMF([0.0, 0.25, 0.75]), PMF.static(0)]
+  cache.set_pmfs('attack', 'abc', pmfs)
+  assert [x.values for x in cache.get_pmfs('attack', 'abc')] == [x.values for x in pmfs]
+  assert cache.get_pmfs('attack', 'other') is None
+  assert cache.stats()['hits'] == 1
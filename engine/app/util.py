@@ -1,17 +1,122 @@
 import re
-from warhammer_stats.attack import Attack
+import sys
+
+import numpy as np
+
+from urllib.parse import parse_qsl, urlencode
+
+from warhammer_stats.attack import Attack, DamagePhase, DamagePhaseResults
 from warhammer_stats.pmf import PMF, PMFCollection
 from warhammer_stats.weapon import Weapon
 from warhammer_stats.target import Target
 from warhammer_stats.modifiers import ModifierCollection
 
+from . import convolve, tables
+from .approx import NormalApproximation
+from .montecarlo import MonteCarloEngine
+from .cache import LRUCache, canonical_key
+from .metrics import REGISTRY, stage, timed
+from .complexity import ComplexityEstimator
+from .plot import PlotEncoder
+from .pool import ComputePool
+from .shared_cache import SharedCache, backend_from_url
+from ..constants import RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES, SHARED_CACHE_URL, SHARED_CACHE_TTL
+from ..constants import PLOT_MAX_POINTS, COMPUTE_WORKERS
+from ..constants import COMPLEXITY_MAX_DICE, COMPLEXITY_MAX_SUPPORT, COMPLEXITY_MAX_COST
+from ..constants import APPROX_LATENCY_TARGET, MONTE_CARLO_SAMPLES
+
+
+MOD_FIELDS = ['shotmods', 'hitmods', 'woundmods', 'savemods', 'fnpmods', 'damagemods']
+
 
 class ModifierController:
   @property
   def mod_dict(self):
     return {}
 
+class CompoundDamagePhase(DamagePhase):
+  def calc_dist(self, dist):
+    # The stock phase convolves the damage dist from scratch for every dice count
+    return DamagePhaseResults(
+      damage_dist=convolve.compound(dist, self._calc_individual_damage_dist())
+    )
+
+
+class EngineAttack(Attack):
+  def _damage_phase_phase(self):
+    return CompoundDamagePhase(self.weapon, self.target, self.modifiers)
+
+
+class ComputeResults(object):
+  def __init__(self, total_wounds_dist, drone_wound_dist, self_inflicted_dist, key=None, approximate=False, monte_carlo=None):
+    self.total_wounds_dist = total_wounds_dist
+    self.drone_wound_dist = drone_wound_dist
+    self.self_inflicted_dist = self_inflicted_dist
+    self.key = key
+    self.approximate = approximate
+    self.monte_carlo = monte_carlo
+
+  @classmethod
+  def from_attack(cls, attack_results):
+    return cls(
+      total_wounds_dist=attack_results.total_wounds_dist,
+      drone_wound_dist=attack_results.saviour_protocol_results.drone_wound_dist,
+      self_inflicted_dist=attack_results.to_hit_results.self_inflicted_dist,
+    )
+
+  @classmethod
+  def from_dists(cls, dists, key=None, approximate=False, monte_carlo=None):
+    return cls(*dists, key=key, approximate=approximate, monte_carlo=monte_carlo)
+
+  @property
+  def dists(self):
+    return [self.total_wounds_dist, self.drone_wound_dist, self.self_inflicted_dist]
+
+  @property
+  def nbytes(self):
+    # Rough resident size: list header plus a boxed float per value
+    return sum(sys.getsizeof(x.values) + len(x.values) * sys.getsizeof(0.0) for x in self.dists)
+
+
+RESULT_CACHE = LRUCache(
+  max_entries=RESULT_CACHE_ENTRIES,
+  max_bytes=RESULT_CACHE_BYTES,
+  sizeof=lambda results: results.nbytes,
+)
+
+SHARED_CACHE = SharedCache(backend_from_url(SHARED_CACHE_URL), ttl=SHARED_CACHE_TTL)
+
+REGISTRY.caches.add('result', RESULT_CACHE)
+REGISTRY.caches.add('shared', SHARED_CACHE)
+
+COMPUTE_POOL = ComputePool(COMPUTE_WORKERS)
+
+ESTIMATOR = ComplexityEstimator(
+  max_dice=COMPLEXITY_MAX_DICE,
+  max_support=COMPLEXITY_MAX_SUPPORT,
+  max_cost=COMPLEXITY_MAX_COST,
+)
+
+
 class ComputeController:
+  def __init__(self, cache=None, shared_cache=None, pool=None, estimator=None):
+    self.cache = RESULT_CACHE if cache is None else cache
+    self.shared_cache = SHARED_CACHE if shared_cache is None else shared_cache
+    self.pool = COMPUTE_POOL if pool is None else pool
+    self.estimator = ESTIMATOR if estimator is None else estimator
+    self.approximation = NormalApproximation(self)
+    self.monte_carlo = MonteCarloEngine(pool=self.pool, samples=MONTE_CARLO_SAMPLES)
+    self.approx_seconds = APPROX_LATENCY_TARGET
+    self._batch_evaluator = None
+
+  @property
+  def batch_evaluator(self):
+    if self._batch_evaluator is None:
+      # batch imports this module
+      from .batch import BatchEvaluator
+      self._batch_evaluator = BatchEvaluator(self)
+    return self._batch_evaluator
+
   def parse_mods(self, raw_mods):
     if not raw_mods:
       return []
@@ -21,52 +126,235 @@ class ComputeController:
       mods.append(mod_dict.get(mod_id))
     return [mod for mod in mods if mod is not None]
 
-  def compute(self, *args, **kwargs):
-    ws = kwargs.get('ws')
-    toughness = kwargs.get('toughness')
-    strength = kwargs.get('strength')
-    ap = kwargs.get('ap')
-    save = kwargs.get('save')
-    invuln = kwargs.get('invuln')
-    fnp = kwargs.get('fnp')
-    wounds = kwargs.get('wounds')
-    shots = kwargs.get('shots')
-    damage = kwargs.get('damage')
-    shotmods = kwargs.get('shotmods')
-    hitmods = kwargs.get('hitmods')
-    woundmods = kwargs.get('woundmods')
-    savemods = kwargs.get('savemods')
-    fnpmods = kwargs.get('fnpmods')
-    damagemods = kwargs.get('damagemods')
+  def parse_inputs(self, *args, **kwargs):
+    return {
+      'ws': int(kwargs.get('ws') or 7),
+      'toughness': int(kwargs.get('toughness') or 1),
+      'strength': int(kwargs.get('strength') or 1),
+      'ap': int(kwargs.get('ap') or 0),
+      'save': int(kwargs.get('save') or 7),
+      'invuln': int(kwargs.get('invuln') or 7),
+      'fnp': int(kwargs.get('fnp') or 7),
+      # A target has at least one wound, the attack engine fails on fewer
+      'wounds': max(int(kwargs.get('wounds') or 1), 1),
+      'shots': str(kwargs.get('shots') or 1).strip().lower(),
+      'damage': str(kwargs.get('damage') or 1).strip().lower(),
+      **{x: [mod for mod in (kwargs.get(x) or []) if mod] for x in MOD_FIELDS},
+    }
+
+  def stage_probabilities(self, inputs):
+    """Per die probabilities of each stage, read from the precomputed tables."""
+    return {
+      'hit': float(tables.hit_probability(inputs['ws'])),
+      'wound': float(tables.wound_probability(inputs['strength'], inputs['toughness'])),
+      'unsaved': float(tables.unsaved_probability(inputs['save'], inputs['ap'], inputs['invuln'])),
+      'fnp': float(tables.fnp_probability(inputs['fnp'])),
+    }
 
+  def modified(self, inputs):
+    return any(self.parse_mods(inputs[x]) for x in MOD_FIELDS)
+
+  def batched(self, inputs):
+    """Whether exact results for the inputs come from the batch evaluator rather than run().
+
+    The tables clip characteristics to what the graph inputs offer, so anything
+    outside that is left to the attack engine.
+    """
+    return not self.modified(inputs) and tables.in_domain(inputs)
+
+  def cache_key(self, inputs, approximate=False):
+    if approximate:
+      return canonical_key(inputs, 'normal')
+    return canonical_key(inputs)
+
+  def approximates(self, inputs, approximate=None):
+    """Check the inputs against the budget and decide whether to approximate them.
+
+    approximate=None picks the approximation for batched weapons estimated to
+    take longer than the latency target, True and False force the choice.
+    Like the batch evaluator, the approximation only covers the table domain.
+    """
+    batched = self.batched(inputs)
+    if approximate is not False and batched:
+      estimate = self.estimator.check(inputs, check_cost=False, batched=True)
+      if approximate or (self.approx_seconds > 0 and estimate.seconds > self.approx_seconds):
+        return True
+    self.estimator.check(inputs, batched=batched)
+    return False
+
+  def check(self, *args, approximate=None, **kwargs):
+    """Raise ComplexityError if the inputs are over the compute budget."""
+    return self.approximates(self.parse_inputs(**kwargs), approximate)
+
+  def compute(self, *args, approximate=None, **kwargs):
+    inputs = self.parse_inputs(**kwargs)
+    approximate = self.approximates(inputs, approximate)
+    key = self.cache_key(inputs, approximate)
+    return self.cache.get_or_compute(key, lambda: self._shared_run(key, inputs, approximate))
+
+  def simulate(self, *args, samples=None, seed=None, **kwargs):
+    """compute() by Monte Carlo sampling, only cached when seeded and so reproducible.
+
+    Without samples, as many as the budget allows up to the default are drawn.
+    """
+    inputs = self.parse_inputs(**kwargs)
+    samples = samples or min(self.monte_carlo.samples, max(self.estimator.max_samples(inputs), 1))
+    self.estimator.check_samples(inputs, samples)
+    if seed is None:
+      return self._sample(inputs, samples, seed)
+    key = canonical_key(inputs, 'montecarlo', samples, seed)
+    return self.cache.get_or_compute(key, lambda: self._sample(inputs, samples, seed, key))
+
+  def compute_many(self, inputs_list, approximate=None):
+    """compute() for several weapons at once.
+
+    Exact cache misses without modifiers are evaluated together as arrays, per
+    target, and the rest run in parallel on the pool.
+    """
+    parsed = [self.parse_inputs(**x) for x in inputs_list]
+    modes = [self.approximates(x, approximate) for x in parsed]
+    keys = [self.cache_key(x, mode) for x, mode in zip(parsed, modes)]
+    found = {}
+    missing = {}
+    for key, inputs, mode in zip(keys, parsed, modes):
+      if key in found or key in missing:
+        continue
+      results = self._cached(key, mode)
+      if results is not None:
+        found[key] = results
+      elif mode:
+        # Cheap enough that shipping it to the pool would cost more
+        found[key] = self._store(key, self._run(inputs, mode))
+      else:
+        missing[key] = inputs
+    if missing:
+      with stage('compute'):
+        for key, results in self._run_batch(missing).items():
+          found[key] = self._store(key, results)
+          del missing[key]
+        computed = self.pool.run_many(self, list(missing.values())) if missing else []
+      for key, dists in zip(missing, computed):
+        found[key] = self._store(key, ComputeResults.from_dists(dists))
+    return [found[x] for x in keys]
+
+  def _run_batch(self, missing):
+    """Exact results of the batched weapons in {key: inputs}, one batch per target."""
+    from .batch import TARGET_FIELDS
+    groups = {}
+    for key, inputs in missing.items():
+      if self.batched(inputs):
+        groups.setdefault(tuple(inputs[x] for x in TARGET_FIELDS), []).append(key)
+    computed = {}
+    for target, group in groups.items():
+      batch = self.batch_evaluator.evaluate([missing[x] for x in group], [dict(zip(TARGET_FIELDS, target))])
+      for i, key in enumerate(group):
+        computed[key] = batch.results(i, 0)
+    return computed
+
+  def recall(self, *args, approximate=None, **kwargs):
+    """Results for inputs that have not changed since they were last computed."""
+    inputs = self.parse_inputs(**kwargs)
+    key = self.cache_key(inputs, self.approximates(inputs, approximate))
+    results = self.cache.peek(key)
+    return results if results is not None else self.compute(approximate=approximate, **kwargs)
+
+  def aggregate(self, results):
+    """Convolve the results of several weapons into a single tab result."""
+    if not results:
+      return ComputeResults.from_dists([PMF.static(0)] * 3)
+    if any(x.key is None for x in results):
+      tab_results = self._convolve(results)
+    else:
+      key = canonical_key('tab', [x.key for x in results])
+      tab_results = self.cache.get_or_compute(key, lambda: self._shared_convolve(key, results))
+    tab_results.approximate = any(x.approximate for x in results)
+    return tab_results
+
+  def cache_stats(self):
+    return {'local': self.cache.stats(), 'shared': self.shared_cache.stats()}
+
+  def _cached(self, key, approximate=False):
+    results = self.cache.get(key)
+    if results is None:
+      dists = self.shared_cache.get_pmfs('attack', key)
+      if dists is not None:
+        results = ComputeResults.from_dists(dists, key=key, approximate=approximate)
+        self.cache.set(key, results)
+    return results
+
+  def _store(self, key, results):
+    results.key = key
+    self.cache.set(key, results)
+    self.shared_cache.set_pmfs('attack', key, results.dists)
+    return results
+
+  @timed('compute')
+  def _sample(self, inputs, samples, seed, key=None):
+    monte_carlo = self.monte_carlo.run(inputs, samples=samples, seed=seed)
+    return ComputeResults.from_dists(monte_carlo.dists, key=key, approximate=True, monte_carlo=monte_carlo)
+
+  @timed('compute')
+  def _run(self, inputs, approximate=False):
+    if approximate:
+      return ComputeResults.from_dists(self.approximation.run(inputs), approximate=True)
+    if self.batched(inputs):
+      # Unmodified attacks are built from the stage probability tables
+      return self._run_batch({None: inputs})[None]
+    return self.run(inputs)
+
+  def _shared_run(self, key, inputs, approximate=False):
+    dists = self.shared_cache.get_pmfs('attack', key)
+    if dists is not None:
+      return ComputeResults.from_dists(dists, key=key, approximate=approximate)
+    results = self._run(inputs, approximate)
+    results.key = key
+    self.shared_cache.set_pmfs('attack', key, results.dists)
+    return results
+
+  def _shared_convolve(self, key, results):
+    dists = self.shared_cache.get_pmfs('tab', key)
+    if dists is not None:
+      return ComputeResults.from_dists(dists, key=key)
+    tab_results = self._convolve(results)
+    tab_results.key = key
+    self.shared_cache.set_pmfs('tab', key, tab_results.dists)
+    return tab_results
+
+  @timed('convolution')
+  def _convolve(self, results):
+    return ComputeResults.from_dists([
+      convolve.convolve_many([x.dists[i] for x in results]) for i in range(3)
+    ])
+
+  def run(self, inputs):
     modifiers = ModifierCollection(
-      shot_mods=self.parse_mods(shotmods),
-      hit_mods=self.parse_mods(hitmods),
-      wound_mods=self.parse_mods(woundmods),
-      pen_mods=self.parse_mods(savemods),
-      fnp_mods=self.parse_mods(fnpmods),
-      damage_mods=self.parse_mods(damagemods),
+      shot_mods=self.parse_mods(inputs['shotmods']),
+      hit_mods=self.parse_mods(inputs['hitmods']),
+      wound_mods=self.parse_mods(inputs['woundmods']),
+      pen_mods=self.parse_mods(inputs['savemods']),
+      fnp_mods=self.parse_mods(inputs['fnpmods']),
+      damage_mods=self.parse_mods(inputs['damagemods']),
     )
 
     target = Target(
-      toughness=int(toughness or 1),
-      save=int(save or 7),
-      invuln=int(invuln or 7),
-      fnp=int(fnp or 7),
-      wounds=int(wounds or 1),
+      toughness=inputs['toughness'],
+      save=inputs['save'],
+      invuln=inputs['invuln'],
+      fnp=inputs['fnp'],
+      wounds=inputs['wounds'],
     )
 
     weapon = Weapon(
-      bs=int(ws or 7),
-      shots=self.parse_rsn(shots or 1),
-      strength=int(strength or 1),
-      ap=int(ap or 0),
-      damage=self.parse_rsn(damage or 1),
+      bs=inputs['ws'],
+      shots=self.parse_rsn(inputs['shots']),
+      strength=inputs['strength'],
+      ap=inputs['ap'],
+      damage=self.parse_rsn(inputs['damage']),
       modifiers=modifiers,
     )
 
-    attack_sequence = Attack(weapon=weapon, target=target)
-    return attack_sequence.run()
+    attack_sequence = EngineAttack(weapon=weapon, target=target)
+    return ComputeResults.from_attack(attack_sequence.run())
 
   def parse_rsn(self, value):
     try:
@@ -80,6 +368,56 @@ class ComputeController:
         return PMFCollection.empty()
 
 
+PLOT_ENCODER = PlotEncoder(max_points=PLOT_MAX_POINTS)
+
+
+class TabAggregate(object):
+  """Per tab statistics and plot arrays derived from a single convolution pass.
+
+  The graph, static and embed controllers all read from this so each
+  distribution is convolved, accumulated and trimmed exactly once.
+  """
+  subplots = {
+    'damage': 'total_wounds_dist',
+    'drones': 'drone_wound_dist',
+    'self': 'self_inflicted_dist',
+  }
+
+  def __init__(self, results, points=1, thresh=10**(-4), encoder=None):
+    self.results = results
+    self.points = points
+    self.thresh = thresh
+    self.encoder = encoder or PLOT_ENCODER
+    self.approximate = results.approximate
+    self._curves = {}
+
+    total = np.asarray(results.total_wounds_dist.values, dtype=float)
+    support = np.arange(len(total))
+    self.mean = float(np.dot(support, total))
+    self.std = float(max(np.dot(support**2, total) - self.mean**2, 0) ** 0.5)
+
+  @classmethod
+  def from_results(cls, compute_controller, tab_results, points=1):
+    return cls(compute_controller.aggregate(tab_results), points=points)
+
+  def curve(self, subplot):
+    """Trimmed probability of dealing at least each value."""
+    if subplot not in self._curves:
+      values = np.asarray(getattr(self.results, self.subplots[subplot]).values, dtype=float)
+      cumulative = values[::-1].cumsum()[::-1]
+      body = np.nonzero(cumulative >= self.thresh)[0]
+      self._curves[subplot] = cumulative[:body[-1] + 1] if len(body) else cumulative[:0]
+    return self._curves[subplot]
+
+  @timed('figure')
+  def plot_arrays(self, subplot, points=None):
+    values = self.curve(subplot)
+    if len(values) <= 1:
+      return None
+    pts = points or self.points
+    return self.encoder.encode(np.arange(len(values)) / pts, 100 * values)
+
+
 class URLMinify(object):
   def __init__(self, tab_count, weapon_count):
     self.tab_count = tab_count
@@ -97,6 +435,12 @@ class URLMinify(object):
   def maxify(self, key):
     return self.to_max().get(key, key)
 
+  def normalize_query(self, query):
+    """Sorted, minified form of a permalink query, equal for equivalent links."""
+    to_min = self.to_min()
+    params = dict(parse_qsl(query))
+    return urlencode(sorted((to_min.get(k, k), v) for k, v in params.items()))
+
   def to_min(self):
     return {x:y for x, y in self.mapping}
 
@@ -1,7 +1,54 @@
 import os
+import tempfile
 is_prod = os.environ.get('IS_HEROKU', None) == 'True'
 GA_TRACKING_ID = os.environ.get('GA_TRACKING_ID', None)
 SUBPLOT_COUNT = 3
+RESULT_CACHE_ENTRIES = int(os.environ.get('RESULT_CACHE_ENTRIES', 512))
+RESULT_CACHE_BYTES = int(os.environ.get('RESULT_CACHE_BYTES', 64 * 1024 * 1024))
+# e.g. sqlite:///tmp/cache.sqlite3 or redis://localhost:6379/0, empty disables it
+SHARED_CACHE_URL = os.environ.get(
+  'SHARED_CACHE_URL',
+  f'sqlite:///{tempfile.gettempdir()}/warhammer-stats-cache.sqlite3' if is_prod else '',
+)
+SHARED_CACHE_TTL = int(os.environ.get('SHARED_CACHE_TTL', 7 * 24 * 60 * 60))
+# ga, file or none
+ANALYTICS_SINK = os.environ.get('ANALYTICS_SINK', 'ga')
+ANALYTICS_FILE = os.environ.get('ANALYTICS_FILE', 'analytics.jsonl')
+ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', 1000))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 5))
+PLOT_MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', 400))
+STATIC_CACHE_ENTRIES = int(os.environ.get('STATIC_CACHE_ENTRIES', 256))
+STATIC_CACHE_MAX_AGE = int(os.environ.get('STATIC_CACHE_MAX_AGE', 60 * 60))
+# Worker pools are per web process: gunicorn --workers=N runs up to
+# N * (1 + COMPUTE_WORKERS + BATCH_WORKERS) processes, so keep these small
+# and raise them only alongside a lower web worker count.
+# Processes used for Monte Carlo sampling and for the weapons of a render the
+# batch evaluator does not take (modifiers, or characteristics outside what
+# the graph offers). Modifiers are not wired up yet, so renders from the graph
+# never use it and it is off unless set; 0 or 1 runs everything in turn.
+COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', 0))
+# Inputs over any of these are refused instead of computed
+COMPLEXITY_MAX_DICE = int(os.environ.get('COMPLEXITY_MAX_DICE', 200))
+COMPLEXITY_MAX_SUPPORT = int(os.environ.get('COMPLEXITY_MAX_SUPPORT', 50000))
+COMPLEXITY_MAX_COST = float(os.environ.get('COMPLEXITY_MAX_COST', 5e7))
+# Weapons estimated to take longer than this are approximated, 0 always computes them exactly
+APPROX_LATENCY_TARGET = float(os.environ.get('APPROX_LATENCY_TARGET', 0.25))
+MONTE_CARLO_SAMPLES = int(os.environ.get('MONTE_CARLO_SAMPLES', 10**6))
+MONTE_CARLO_MAX_SAMPLES = int(os.environ.get('MONTE_CARLO_MAX_SAMPLES', 10**6))
+BATCH_MAX_SCENARIOS = int(os.environ.get('BATCH_MAX_SCENARIOS', 1000))
+# Processes used by the bulk endpoint, 0 runs every scenario in the request thread
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 2))
+# When set, /metrics wants an "Authorization: Bearer <token>" header
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', None)
+# Callbacks slower than this are logged with their inputs, 0 turns the log off
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 2.0))
+# Fraction of callbacks run under cProfile, their stats kept in PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+# Most options a modifier dropdown search sends back
+MODIFIER_SEARCH_LIMIT = int(os.environ.get('MODIFIER_SEARCH_LIMIT', 50))
 if is_prod:
   TAB_COUNT = 6
   WEAPON_COUNT = 4
@@ -22,4 +69,20 @@ TAB_COLOURS = [
   '#17becf',
 ]
 
+# id, label, [toughness, save, invuln, fnp, wounds]
+TARGET_PRESETS = [
+  ('guardsman', 'Guardsmen', [3, 5, 7, 7, 1]),
+  ('ork_boy', 'Ork Boyz', [4, 6, 7, 7, 1]),
+  ('shield_drone', 'Shield Drone', [4, 4, 4, 5, 1]),
+  ('tactical_marine', 'Tactical Marine', [4, 3, 7, 7, 1]),
+  ('intercessor', 'Intercessor', [4, 3, 7, 7, 2]),
+  ('terminator', 'Terminator', [4, 3, 4, 7, 2]),
+  ('crisis_suit', 'Crisis Suit', [5, 3, 7, 7, 3]),
+  ('custode', 'Custode', [5, 2, 3, 7, 3]),
+  ('riptide', 'Riptide', [7, 2, 5, 7, 14]),
+  ('rhino', 'Rhino', [7, 3, 7, 7, 10]),
+  ('leman_russ', 'Leman Russ', [8, 3, 7, 7, 12]),
+  ('knight', 'Knight', [8, 3, 5, 7, 24]),
+]
+
 DEFAULT_GRAPH_PLOTS = [{}] * TAB_COUNT * SUBPLOT_COUNT
\ No newline at end of file
@@ -1,39 +1,20 @@
-import matplotlib.pyplot as plt
-import numpy as np
+from engine.app.util import ComputeController
 
-from engine.stats.pmf import PMF, PMFCollection
-from engine.stats.units import Unit
-from engine.stats.weapons import Weapon
-from engine.stats.attack import AttackSequence
-from engine.stats.modifiers import ReRollFailed, ModifierCollection
-def main():
 
-  weapon = Weapon(
-    shots=PMFCollection.static(450),
+def main():
+  # 450 lasgun shots from guardsmen (BS 4+) into more guardsmen (T3 5+)
+  results = ComputeController().compute(
+    ws=4,
+    shots='450',
     strength=3,
     ap=0,
-    damage=PMFCollection.static(1),
-  )
-
-  target = Unit(
+    damage='1',
     toughness=3,
     save=5,
     wounds=1,
   )
 
-  attacker = Unit(ws=4)
-
-  attack = AttackSequence(
-    weapon=weapon,
-    target=target,
-    attacker=attacker,
-    mods=ModifierCollection()
-  ).run()
-
-  print(attack.damage_dist.mean())
-
-
-
+  print(results.total_wounds_dist.mean())
 
 
 if __name__ == "__main__":